@@ -0,0 +1,295 @@
+#Benchmark della Chat P2P: tempi di avvio, throughput e latenza della rete con più peer locali, rendering della GUI.
+#Ogni benchmark stampa un report JSON (e con --output lo salva su file) per confrontare versioni diverse.
+import argparse #Per leggere le opzioni da riga di comando.
+import json #Per leggere i tempi stampati da p2pchat.py e scrivere il report.
+import os #Per trovare p2pchat.py nella stessa cartella di questo script.
+import statistics #Per calcolare mediana, minimo e massimo dei campioni.
+import subprocess #Per avviare p2pchat.py in un processo nuovo a ogni misura (avvio "a freddo" dell'interprete).
+import sys #Per usare lo stesso interprete Python che esegue il benchmark.
+import time #Per registrare l'istante di lancio di ogni processo.
+import multiprocessing #Ogni peer del benchmark di rete gira in un processo separato, con il proprio GIL.
+import platform #Informazioni sulla macchina da salvare nel report.
+import tempfile #Cartella temporanea per la coda dei messaggi dei peer (consegna affidabile).
+import shutil #Per eliminare la cartella temporanea a fine misura.
+from array import array #Latenze raccolte da ogni peer in forma compatta.
+try:
+    import resource #Memoria massima (RSS) dei processi; disponibile solo su sistemi Unix.
+except ImportError:
+    resource = None
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "p2pchat.py")
+
+#Avvia una volta p2pchat.py con --startup-probe e restituisce i millisecondi trascorsi dal lancio del processo
+#fino a ogni evento stampato ("listening": socket in ascolto, "window": prima finestra visibile).
+#Storico, coda dei messaggi e rubrica sono disattivati: la misura non apre i file dell'utente (né li blocca a un'istanza in uso).
+def measure_startup(gui, extra_args=()):
+    command = [sys.executable, SCRIPT, "--startup-probe", "--username", "bench", "--port", "0",
+               "--no-history", "--no-delivery", "--no-address-book", *extra_args]
+    if not gui:
+        command.append("--headless")
+    started = time.time()
+    result = subprocess.run(command, capture_output=True, text=True, timeout=60)
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "nessun output")
+    probe = json.loads(result.stdout.strip().splitlines()[-1])
+    return {key: (value - started) * 1000 for key, value in probe.items()}
+
+#Ripete la misura di avvio per la modalità headless e per la GUI e restituisce le statistiche in millisecondi.
+def benchmark_startup(runs, extra_args=()):
+    report = {}
+    for mode, gui in (("headless", False), ("gui", True)):
+        try:
+            samples = [measure_startup(gui, extra_args) for _ in range(runs)]
+        except (RuntimeError, subprocess.TimeoutExpired) as e:
+            #Ad esempio GUI senza display o senza customtkinter installato.
+            report[mode] = {"error": str(e)}
+            continue
+        report[mode] = {
+            key: {
+                "median_ms": round(statistics.median(sample[key] for sample in samples), 1),
+                "min_ms": round(min(sample[key] for sample in samples), 1),
+                "max_ms": round(max(sample[key] for sample in samples), 1),
+            }
+            for key in samples[0]
+        }
+    return report
+
+#Collegamenti tra i peer per ogni topologia: coppie (i, j) in cui il peer i si connette al peer j.
+def topology_links(topology, nodes):
+    if topology == "star":
+        return [(i, 0) for i in range(1, nodes)] #Tutti collegati al peer 0.
+    if topology == "chain":
+        return [(i, i - 1) for i in range(1, nodes)] #Ogni peer collegato al precedente.
+    return [(i, j) for i in range(nodes) for j in range(i)] #"mesh": tutti collegati con tutti.
+
+#Peer del benchmark di rete (eseguito in un processo separato): avvia un nodo headless, si connette ai peer indicati
+#dal processo principale, invia messaggi della dimensione e alla frequenza richieste e misura la latenza di quelli ricevuti.
+#Ogni messaggio porta l'istante di invio (time.time_ns), confrontabile tra processi della stessa macchina.
+def network_worker(index, pipe, config):
+    sys.path.insert(0, os.path.dirname(SCRIPT))
+    import p2pchat
+    latencies = array("d") #Latenze in secondi dei messaggi ricevuti durante la misura.
+    received = [0]
+    def on_event(event):
+        if event[0] == "message" and event[2] == "peer":
+            sent_at = int(event[1].split(": ", 1)[1].split(" ", 1)[0])
+            latencies.append((time.time_ns() - sent_at) / 1e9)
+            received[0] += 1
+    #Con la consegna affidabile ogni peer ha la sua coda dei messaggi su disco, in una cartella temporanea.
+    directory = tempfile.mkdtemp() if config["delivery"] else None
+    node = p2pchat.ChatNode(f"b{index}", "127.0.0.1", 0, on_event=on_event, gossip=config["gossip"], ttl=config["nodes"],
+                            queue_limit=config["queue_limit"], backpressure=config["backpressure"],
+                            encrypt=config["encrypt"],
+                            delivery=os.path.join(directory, "outbox.db") if directory else None).start()
+    pipe.send(node.port)
+    #Connessioni verso i peer indicati, poi attendo che l'handshake sia completo con tutti i vicini.
+    ports, degree = pipe.recv()
+    for port in ports:
+        node.connect("127.0.0.1", port).result()
+    while len(node.usernames) < degree:
+        time.sleep(0.01)
+    pipe.send("ready")
+    start = pipe.recv() #Istante di inizio comune a tutti i peer.
+    time.sleep(max(0, start - time.time()))
+    cpu = time.process_time()
+    padding = "x" * max(0, config["size"] - 20)
+    sent = 0
+    interval = 1 / config["rate"] if config["rate"] else 0
+    end = start + config["duration"]
+    while time.time() < end:
+        node.send(f"{time.time_ns()} {padding}")
+        sent += 1
+        if interval:
+            #Invio a frequenza costante, recuperando i ritardi (senza accumulare sleep troppo lunghi).
+            delay = start + sent * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+    time.sleep(config["settle"]) #Attendo la consegna dei messaggi ancora in viaggio.
+    result = {
+        "sent": sent,
+        "received": received[0],
+        "latencies": latencies.tobytes(),
+        "cpu_s": time.process_time() - cpu,
+        "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        "dropped": sum(stats["dropped"] for stats in node.queue_stats().values()),
+        "handshake": node.stats()["histograms"].get("handshake"),
+    }
+    node.stop()
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+    pipe.send(result)
+
+#Percentile (esatto) di una lista ordinata di valori.
+def percentile(values, fraction):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+#Esegue il benchmark di rete per una topologia: avvia i peer, li collega, misura e riassume i risultati.
+def benchmark_network(topology, config):
+    context = multiprocessing.get_context("spawn")
+    nodes = config["nodes"]
+    pipes, processes = [], []
+    for index in range(nodes):
+        parent, child = context.Pipe()
+        process = context.Process(target=network_worker, args=(index, child, config), daemon=True)
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+    ports = [pipe.recv() for pipe in pipes]
+    links = topology_links(topology, nodes)
+    for index, pipe in enumerate(pipes):
+        degree = sum(1 for link in links if index in link)
+        pipe.send(([ports[j] for i, j in links if i == index], degree))
+    for pipe in pipes:
+        pipe.recv()
+    start = time.time() + 0.5
+    for pipe in pipes:
+        pipe.send(start)
+    results = [pipe.recv() for pipe in pipes]
+    for process in processes:
+        process.join(timeout=10)
+    latencies = array("d")
+    for result in results:
+        latencies.frombytes(result.pop("latencies"))
+    latencies = sorted(latencies)
+    sent = sum(result["sent"] for result in results)
+    received = sum(result["received"] for result in results)
+    return {
+        "topology": topology,
+        "sent": sent,
+        "delivered": received,
+        "delivery_ratio": round(received / (sent * (nodes - 1)), 4) if sent else 0,
+        "sent_per_s": round(sent / config["duration"], 1),
+        "delivered_per_s": round(received / config["duration"], 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 3) if latencies else None,
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        "latency_max_ms": round(latencies[-1] * 1000, 3) if latencies else None,
+        "nodes": [dict(result, node=index) for index, result in enumerate(results)],
+    }
+
+#Costo della cifratura: esegue lo stesso benchmark di rete (mesh, ad alto carico) in chiaro e cifrato
+#e confronta throughput, latenza e CPU per messaggio consegnato. Finché entrambe le reti consegnano tutto il throughput
+#coincide con il carico inviato: il suo costo si misura solo a saturazione ("saturated"), ad esempio con --rate 0.
+def benchmark_encryption(config):
+    plain = benchmark_network("mesh", dict(config, encrypt=False))
+    encrypted = benchmark_network("mesh", dict(config, encrypt=True))
+    def cpu_per_message(report):
+        return sum(node["cpu_s"] for node in report["nodes"]) / max(1, report["delivered"])
+    def overhead(before, after):
+        return round((after - before) / before * 100, 1) if before else None
+    #Throughput perso rispetto a quello in chiaro: (in chiaro - cifrato) / in chiaro.
+    def cost(plain, encrypted):
+        return round((plain - encrypted) / plain * 100, 1) if plain else None
+    return {
+        "plain": plain,
+        "encrypted": encrypted,
+        "throughput_overhead_pct": cost(plain["delivered_per_s"], encrypted["delivered_per_s"]),
+        "latency_p50_overhead_pct": overhead(plain["latency_p50_ms"], encrypted["latency_p50_ms"]),
+        "cpu_per_message_overhead_pct": overhead(cpu_per_message(plain), cpu_per_message(encrypted)),
+        #A massima velocità (rate 0) chi invia attende le code dei peer: la rete è satura anche se consegna tutto.
+        "saturated": config["rate"] <= 0 or min(plain["delivery_ratio"], encrypted["delivery_ratio"]) < 0.99,
+    }
+
+#Benchmark del rendering della GUI: aggiunge messaggi alla vista virtualizzata a gruppi, come process_events,
+#poi la scorre dall'inizio alla fine; riporta i tempi di rendering misurati dalle metriche del nodo.
+def benchmark_ui(messages, batch):
+    sys.path.insert(0, os.path.dirname(SCRIPT))
+    import p2pchat
+    try:
+        p2pchat.load_gui()
+        root = p2pchat.ctk.CTk()
+    except Exception as e:
+        #Ad esempio customtkinter non installato o nessun display disponibile.
+        return {"error": f"{type(e).__name__}: {e}"}
+    root.geometry("800x900")
+    metrics = p2pchat.Metrics()
+    view = p2pchat.VirtualMessageView(root, metrics=metrics)
+    view.grid(row=0, column=0, sticky="nsew")
+    root.update()
+    started = time.perf_counter()
+    for first in range(0, messages, batch):
+        view.extend([(f"peer{i % 7}", f"messaggio {i} " + "testo " * (i % 40), "peer" if i % 3 else "own", "12:00")
+                     for i in range(first, min(first + batch, messages))])
+        root.update()
+    fill = time.perf_counter() - started
+    started = time.perf_counter()
+    for top in range(0, view.history.height(), view.canvas.winfo_height() or 500):
+        view.scroll_to(top)
+        root.update()
+    scroll = time.perf_counter() - started
+    root.destroy()
+    return {"messages": messages, "batch": batch, "fill_s": round(fill, 3), "scroll_s": round(scroll, 3),
+            "render": metrics.histograms["ui.render"].summary()}
+
+#Informazioni sull'ambiente del benchmark, per confrontare report di macchine o versioni diverse.
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(SCRIPT)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+#Legge le opzioni da riga di comando ed esegue il benchmark richiesto.
+def main(argv=None):
+    from p2pchat import BACKPRESSURE_POLICIES #Politiche accettate dai peer (solo il modulo, senza GUI né rete).
+    parser = argparse.ArgumentParser(description="Benchmark della Chat P2P.")
+    parser.add_argument("--output", default=None, help="file JSON in cui salvare il report")
+    commands = parser.add_subparsers(dest="command", required=True)
+    startup = commands.add_parser("startup", help="tempo fino al socket in ascolto e alla prima finestra")
+    startup.add_argument("--runs", type=int, default=5, help="numero di avvii da misurare")
+    startup.add_argument("--ip-service", default=None, metavar="URL", help="servizio dell'IP pubblico passato a p2pchat.py")
+    network = commands.add_parser("network", help="throughput e latenza con N peer headless locali")
+    network.add_argument("--nodes", type=int, default=5, help="numero di peer")
+    network.add_argument("--topology", choices=("star", "mesh", "chain", "all"), default="all", help="topologia della rete")
+    network.add_argument("--size", type=int, default=100, help="dimensione in byte di ogni messaggio")
+    network.add_argument("--rate", type=float, default=100, help="messaggi al secondo inviati da ogni peer (0 = massima velocità)")
+    network.add_argument("--duration", type=float, default=5, help="secondi di invio")
+    network.add_argument("--settle", type=float, default=2, help="secondi di attesa per i messaggi ancora in viaggio")
+    network.add_argument("--queue-limit", type=int, default=1024, help="limite delle code in uscita dei peer")
+    network.add_argument("--backpressure", choices=BACKPRESSURE_POLICIES, default="block",
+                         help="politica delle code piene (block evita perdite)")
+    network.add_argument("--encrypt", action="store_true", help="connessioni cifrate tra i peer")
+    network.add_argument("--delivery", action="store_true", help="consegna affidabile (coda su disco e ACK) dei messaggi")
+    encryption = commands.add_parser("encryption", help="costo della cifratura: rete mesh in chiaro e cifrata a confronto")
+    encryption.add_argument("--nodes", type=int, default=4, help="numero di peer")
+    encryption.add_argument("--size", type=int, default=100, help="dimensione in byte di ogni messaggio")
+    encryption.add_argument("--rate", type=float, default=2000,
+                            help="messaggi al secondo inviati da ogni peer (0 = massima velocità, per misurare il costo sul throughput)")
+    encryption.add_argument("--duration", type=float, default=5, help="secondi di invio")
+    encryption.add_argument("--settle", type=float, default=2, help="secondi di attesa per i messaggi ancora in viaggio")
+    ui = commands.add_parser("ui", help="tempi di rendering della vista dei messaggi (richiede un display)")
+    ui.add_argument("--messages", type=int, default=10000, help="numero di messaggi da aggiungere")
+    ui.add_argument("--batch", type=int, default=50, help="messaggi aggiunti per ogni ciclo")
+    args = parser.parse_args(argv)
+    if args.command == "startup":
+        extra_args = ["--ip-service", args.ip_service] if args.ip_service is not None else []
+        report = {"startup": benchmark_startup(args.runs, extra_args)}
+    elif args.command == "network":
+        topologies = ("star", "mesh", "chain") if args.topology == "all" else (args.topology,)
+        report = {"network": []}
+        for topology in topologies:
+            config = {"nodes": args.nodes, "size": args.size, "rate": args.rate, "duration": args.duration,
+                      "settle": args.settle, "queue_limit": args.queue_limit, "backpressure": args.backpressure,
+                      "encrypt": args.encrypt, "delivery": args.delivery,
+                      #Senza collegamenti diretti tra tutti i peer, i messaggi arrivano a tutti solo con l'inoltro gossip.
+                      "gossip": topology != "mesh"}
+            report["network"].append(dict(benchmark_network(topology, config), config=config))
+    elif args.command == "encryption":
+        config = {"nodes": args.nodes, "size": args.size, "rate": args.rate, "duration": args.duration,
+                  "settle": args.settle, "queue_limit": 1024, "backpressure": "block", "gossip": False, "delivery": False}
+        report = {"encryption": dict(benchmark_encryption(config), config=config)}
+    else:
+        report = {"ui": benchmark_ui(args.messages, args.batch)}
+    report["environment"] = environment()
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(text + "\n")
+
+#Se questo file è eseguito come script principale, avvia il benchmark.
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,2586 @@
 #LIBRERIE USATE
 import socket #Fornisce strumenti per comunicazioni di rete via socket TCP/IP.
 import threading #Permette di creare e thread per eseguire codice in parallelo (ad esempio, ascolto in background).
+import asyncio #Event loop unico che gestisce in modo asincrono il listener e tutte le connessioni ai peer.
+import queue #Coda thread-safe per passare gli eventi di rete dal thread asyncio alla GUI.
 from datetime import datetime #Per gestire date e orari, utile per il timestamp dei messaggi.
-import customtkinter as ctk #Libreria GUI basata su Tkinter ma con stile moderno e personalizzabile (per tema white/dark).
-from tkinter import simpledialog, messagebox #Dialoghi semplici per input utente e finestre di avviso.
-import tkinter as tk #Libreria standard GUI Tkinter per widget di base (Listbox, Label, Frame ed etc.).
-import platform #Fornisce informazioni sul sistema operativo in uso (per notifiche sonore diverse).
 import os #Interazioni con il sistema operativo.
 import sys #Accesso a variabili e funzioni di sistema, usata per controllare piattaforma in uso.
-import urllib.request #Per effettuare richieste HTTP (qui per ottenere IP pubblico tramite api ipify).
-
-# Controlla il sistema operativo in uso per definire una funzione di notifica sonora adatta.
-if sys.platform.startswith("darwin"):
-    #Se il sistema operativo è macOS (darwin).
-    import subprocess #Importa il modulo per eseguire comandi di sistema.
-    def notify():
-        #Riproduce il suono di sistema "Pop" tramite il comando 'afplay'.
-        subprocess.call(["afplay", "/System/Library/Sounds/Pop.aiff"])
-elif sys.platform.startswith("win"):
-    #Se il sistema operativo è Windows (win).
-    import winsound #Importa il modulo per generare suoni di sistema.
-    def notify():
-        #Emette il beep di sistema predefinito.
+import struct #Per impacchettare/spacchettare l'header binario dei frame del protocollo di rete.
+import json #Per serializzare i payload dei frame di controllo (ad esempio l'handshake).
+import argparse #Per leggere le opzioni da riga di comando (ad esempio la modalità --headless).
+import random #Per scegliere a caso i peer a cui inoltrare i messaggi in modalità gossip.
+from collections import OrderedDict, deque, Counter #Cache LRU dei messaggi già visti, code in uscita e campioni del profiler.
+import time #Per misurare il tempo speso a elaborare gli eventi in ogni ciclo della GUI.
+import bisect #Ricerca binaria sulle posizioni dei messaggi nella vista virtualizzata.
+from array import array #Array numerici compatti per lo storico dei messaggi.
+import hashlib #Per calcolare l'identificativo stabile dei trasferimenti di file (necessario per riprenderli).
+import zlib #Per il checksum CRC32 di ogni chunk dei file trasferiti.
+import sqlite3 #Database su disco per lo storico persistente dei messaggi.
+import ipaddress #Per riconoscere gli indirizzi pubblici tra quelli osservati dai peer.
+import tempfile #File temporanei con nome univoco, per salvare la rubrica in modo atomico.
+#urllib.request (IP pubblico) e i moduli per i suoni vengono importati solo quando servono, per un avvio più veloce.
+
+#Moduli grafici: vengono importati da load_gui() solo quando serve la GUI, così la modalità headless non li carica.
+ctk = None #Libreria GUI basata su Tkinter ma con stile moderno e personalizzabile (per tema white/dark).
+tk = None #Libreria standard GUI Tkinter per widget di base (Listbox, Label, Frame ed etc.).
+tkfont = None #Font Tkinter, usati per misurare l'altezza dei messaggi.
+simpledialog = None #Dialoghi semplici per input utente.
+messagebox = None #Finestre di avviso.
+filedialog = None #Finestra di selezione dei file da inviare.
+
+#Importa i moduli grafici e li rende disponibili a livello di modulo.
+def load_gui():
+    global ctk, tk, tkfont, simpledialog, messagebox, filedialog
+    import customtkinter as ctk
+    import tkinter as tk
+    import tkinter.font as tkfont
+    from tkinter import simpledialog, messagebox, filedialog
+
+#Primitive crittografiche del pacchetto opzionale "cryptography": vengono importate da load_crypto() solo se
+#la cifratura è attiva, così chi non la usa non deve installarlo.
+X25519PrivateKey = None #Scambio di chiavi Diffie-Hellman su curva X25519.
+X25519PublicKey = None
+AESGCM = None #Cifratura autenticata dei frame.
+HKDF = None #Derivazione delle chiavi di sessione.
+hashes = None
+InvalidTag = None #Errore di autenticazione di un frame cifrato.
+
+#Importa le primitive crittografiche e le rende disponibili a livello di modulo.
+def load_crypto():
+    global X25519PrivateKey, X25519PublicKey, AESGCM, HKDF, hashes, InvalidTag
+    try:
+        from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey, X25519PublicKey
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+        from cryptography.hazmat.primitives import hashes
+        from cryptography.exceptions import InvalidTag
+    except ImportError:
+        raise RuntimeError("La cifratura richiede il pacchetto 'cryptography' (pip install cryptography)") from None
+
+#Riproduce una notifica sonora adatta al sistema operativo in uso;
+#i moduli necessari vengono importati alla prima notifica, non all'avvio.
+def notify():
+    if sys.platform.startswith("darwin"):
+        #Se il sistema operativo è macOS (darwin), riproduce il suono di sistema "Pop" tramite il comando 'afplay',
+        #senza attendere la fine del suono (la GUI non si blocca).
+        import subprocess
+        subprocess.Popen(["afplay", "/System/Library/Sounds/Pop.aiff"])
+    elif sys.platform.startswith("win"):
+        #Se il sistema operativo è Windows (win), emette il beep di sistema predefinito.
+        import winsound
         winsound.MessageBeep()
-else:
-    #Per altri sistemi (linux, Unix, etc.).
-    def notify():
-        #Stampa un'emoji campanella e mesaggio di notifica sulla console.
+    else:
+        #Per altri sistemi (linux, Unix, etc.) stampa un'emoji campanella e mesaggio di notifica sulla console.
         print("🔔 Nuovo messaggio")
 
+#INDIRIZZI DEL NODO.
+IP_SERVICE = "https://api.ipify.org" #Servizio web che restituisce l'IP pubblico (configurabile con --ip-service).
+ADDRESS_CACHE = os.path.join(os.path.expanduser("~"), ".p2pchat", "address.json") #Cache su disco dell'IP pubblico.
+ADDRESS_TTL = 3600 #Secondi di validità dell'IP pubblico salvato in cache.
+
+#Restituisce l'IP locale dell'interfaccia usata per uscire verso Internet, senza interrogare il DNS:
+#il connect di un socket UDP non invia pacchetti, fa solo scegliere al sistema l'interfaccia di uscita.
+def local_address():
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("192.0.2.1", 80)) #Indirizzo di documentazione (TEST-NET-1), mai contattato davvero.
+            return probe.getsockname()[0]
+    except OSError:
+        return "127.0.0.1" #Nessuna rete disponibile.
+
+#Restituisce l'IP pubblico: dalla cache su disco se ancora valida, altrimenti chiedendolo al servizio indicato
+#(un URL qualsiasi che risponde con l'IP in chiaro, anche un servizio locale). Restituisce None se non disponibile.
+def public_address(service=IP_SERVICE, cache=ADDRESS_CACHE, ttl=ADDRESS_TTL):
+    try:
+        with open(cache) as file:
+            cached = json.load(file)
+        if cached["service"] == service and time.time() - cached["time"] < ttl:
+            return cached["ip"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass #Cache assente, illeggibile o di un altro servizio.
+    if not service:
+        return None #Ricerca dell'IP pubblico disattivata.
+    import urllib.request
+    try:
+        ip = urllib.request.urlopen(service, timeout=5).read().decode("utf8").strip()
+        ipaddress.ip_address(ip) #Scarto risposte che non sono un indirizzo IP.
+    except (OSError, ValueError):
+        return None
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        with open(cache, "w") as file:
+            json.dump({"service": service, "ip": ip, "time": time.time()}, file)
+    except OSError:
+        pass #La cache è solo un'ottimizzazione.
+    return ip
+
+#METRICHE.
+#Istogramma dei tempi a dimensione fissa: ogni durata viene contata in un bucket esponenziale
+#(il bucket b contiene le durate da 2^(b-1) a 2^b microsecondi), quindi la memoria non cresce con i campioni.
+class Histogram:
+    BUCKETS = 32 #Da 1 µs a circa 36 minuti.
+
+    #Inizializza l'istogramma vuoto.
+    def __init__(self):
+        self.counts = array("Q", bytes(8 * self.BUCKETS)) #Numero di campioni per bucket.
+        self.count = 0 #Numero totale di campioni.
+        self.total = 0.0 #Somma delle durate, in secondi.
+        self.max = 0.0 #Durata massima osservata, in secondi.
+
+    #Registra una durata in secondi.
+    def observe(self, seconds):
+        self.counts[min(int(seconds * 1000000).bit_length(), self.BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    #Percentile approssimato (per eccesso, al limite superiore del bucket), in secondi.
+    def percentile(self, fraction):
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min((1 << bucket) / 1000000, self.max)
+        return self.max
+
+    #Riepilogo dell'istogramma in millisecondi.
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0,
+            "p50_ms": round(self.percentile(0.5) * 1000, 3),
+            "p99_ms": round(self.percentile(0.99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+#Contatori e istogrammi del nodo. Ogni contatore e istogramma viene aggiornato da un solo thread
+#(il loop asyncio per la rete, la GUI per l'interfaccia), quindi non servono lock.
+class Metrics:
+    #Inizializza le metriche vuote.
+    def __init__(self):
+        self.started = time.time() #Istante di avvio, per calcolare l'uptime.
+        self.counters = {} #Contatori per nome (messaggi inviati e ricevuti, byte, connessioni, errori, ...).
+        self.histograms = {} #Istogrammi dei tempi per nome.
+        self.errors = deque(maxlen=20) #Ultimi errori registrati, con orario e punto in cui sono avvenuti.
+
+    #Incrementa un contatore.
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    #Registra una durata (in secondi) nell'istogramma indicato.
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    #Registra un errore gestito: conta il tipo di eccezione e ne conserva la descrizione.
+    def error(self, where, error):
+        self.count(f"errors.{type(error).__name__}")
+        self.errors.append(f"{datetime.now():%H:%M:%S} {where}: {type(error).__name__}: {error}")
+
+    #Copia delle metriche, pronta per essere serializzata in JSON.
+    def snapshot(self):
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "counters": dict(self.counters),
+            "histograms": {name: histogram.summary() for name, histogram in list(self.histograms.items())},
+            "errors": list(self.errors),
+        }
+
+#Profiler a campionamento: un thread registra a intervalli regolari la funzione (e la riga) in esecuzione
+#in ogni altro thread. Costa poco e si può attivare e disattivare mentre l'applicazione è in uso.
+class SamplingProfiler:
+    #Inizializza il profiler (fermo) con l'intervallo di campionamento in secondi.
+    def __init__(self, interval=0.005):
+        self.interval = interval #Secondi tra un campione e il successivo.
+        self.samples = Counter() #Numero di campioni per "file:funzione:riga".
+        self.rounds = 0 #Numero di campionamenti effettuati.
+        self.running = False #Se il profiler è attivo.
+
+    #Avvia il campionamento in un thread separato (se non è già attivo).
+    def start(self):
+        if not self.running:
+            self.running = True
+            threading.Thread(target=self.run, daemon=True).start()
+
+    #Ferma il campionamento (i campioni raccolti restano disponibili).
+    def stop(self):
+        self.running = False
+
+    #Raccoglie i campioni finché il profiler è attivo (eseguito nel thread del profiler).
+    def run(self):
+        me = threading.get_ident()
+        while self.running:
+            for ident, frame in sys._current_frames().items():
+                if ident != me:
+                    code = frame.f_code
+                    self.samples[f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}"] += 1
+            self.rounds += 1
+            time.sleep(self.interval)
+
+    #Punti del codice campionati più spesso.
+    def top(self, limit=20):
+        return {
+            "running": self.running,
+            "rounds": self.rounds,
+            "top": self.samples.most_common(limit),
+        }
+
+#PROTOCOLLO DI RETE.
+#Ogni messaggio viaggia in un frame: header binario di lunghezza fissa seguito dal payload.
+#Header (8 byte, big-endian): versione (1 byte), tipo (1 byte), flag (1 byte), riservato (1 byte), lunghezza del payload (4 byte).
+#Il flag dei frame di chat (e dei messaggi da confermare) indica l'eventuale codec di compressione del payload (vedi COMPRESSIONE).
+PROTOCOL_VERSION = 4
+FRAME_HEADER = struct.Struct("!BBBxI")
+MAX_FRAME_SIZE = 16 * 1024 * 1024 #Limite alla dimensione del payload, per non allocare buffer enormi su dati corrotti.
+
+#Tipi di frame: quelli di controllo (< 0x10) trasportano JSON, quelli di chat testo UTF-8.
+FRAME_HELLO = 0x01 #Handshake iniziale: username e porta di ascolto del peer (sostituisce "__username__:").
+FRAME_FILE_OFFER = 0x02 #Proposta di invio di un file: ID del trasferimento, nome e dimensione.
+FRAME_FILE_ACCEPT = 0x03 #Risposta del destinatario: offset da cui (ri)prendere l'invio del file.
+FRAME_FILE_DONE = 0x04 #Conferma del destinatario: file ricevuto per intero e verificato.
+FRAME_HANDSHAKE = 0x05 #Scambio di chiavi della connessione cifrata (in chiaro, prima di ogni altro frame).
+FRAME_TICKET = 0x06 #Ticket per riprendere la sessione cifrata alla prossima connessione (solo cifrato).
+FRAME_SUBSCRIBE = 0x07 #Stanze in cui il peer entra ("join") o da cui esce ("leave").
+FRAME_ACK = 0x08 #Conferma cumulativa dei messaggi consegnati: ricevuti tutti fino a "seq" ("gap" = ne manca uno, reinviare da lì).
+FRAME_FILE_DECLINE = 0x09 #Rifiuto di un file proposto (dall'utente, o perché troppo grande): il mittente rinuncia all'invio.
+FRAME_CHAT = 0x10 #Messaggio di chat: intestazione CHAT_HEADER seguita dal testo "username: contenuto".
+FRAME_DELIVER = 0x11 #Messaggio di chat da confermare: numero di sequenza (DELIVER_HEADER) seguito dal payload di un frame di chat (compresso come quelli di chat).
+FRAME_FILE_CHUNK = 0x20 #Porzione di un file: intestazione FILE_CHUNK_HEADER seguita dai dati binari.
+FRAME_SEALED = 0x30 #Gruppo di frame cifrati con AES-GCM: il payload decifrato è una sequenza di frame completi.
+
+#Intestazione dei frame di chat: ID univoco del messaggio (16 byte), ID del nodo di origine (8 byte),
+#TTL, cioè il numero di inoltri (hop) ancora consentiti in modalità gossip, e ID della stanza (8 byte).
+CHAT_HEADER = struct.Struct("!16s8sB8s")
+DEFAULT_TTL = 8 #Numero massimo di hop di un messaggio in modalità gossip.
+#Intestazione dei messaggi da confermare: numero di sequenza del messaggio precedente inviato allo stesso peer e numero di
+#sequenza del messaggio (8 byte ciascuno), crescenti ma non contigui (ogni peer riceve solo i messaggi delle sue stanze).
+#Il precedente permette al destinatario di accorgersi di un messaggio perso (ad esempio scartato da una coda piena).
+DELIVER_HEADER = struct.Struct("!QQ")
+SEAL_OVERHEAD = 16 #Byte aggiunti da AES-GCM (tag di autenticazione) a ogni gruppo di frame cifrato.
+#Dimensione massima (in byte, UTF-8) del testo di un messaggio: anche da confermare e cifrato, il suo frame resta entro MAX_FRAME_SIZE.
+MAX_MESSAGE_SIZE = MAX_FRAME_SIZE - SEAL_OVERHEAD - FRAME_HEADER.size - DELIVER_HEADER.size - CHAT_HEADER.size
+
+#STANZE.
+#Ogni messaggio appartiene a una stanza e arriva solo ai peer iscritti: i peer comunicano le proprie stanze nell'handshake
+#e le variazioni con FRAME_SUBSCRIBE. Nei frame la stanza è identificata da un hash del nome, di lunghezza fissa.
+DEFAULT_ROOM = "generale" #Stanza in cui entrano tutti i nodi, se non indicato diversamente.
+ALL_ROOMS = "*" #Iscrizione a tutte le stanze (ad esempio per un relay in modalità gossip).
+
+#Identificativo (8 byte) di una stanza dato il nome.
+def room_id(name):
+    return hashlib.sha256(name.encode()).digest()[:8]
+
+RECONNECT_BASE_DELAY = 0.2 #Attesa massima (secondi) prima del primo tentativo di riconnessione.
+RECONNECT_MAX_DELAY = 30 #Attesa massima (secondi) tra due tentativi di riconnessione.
+RECONNECT_ATTEMPTS = 12 #Tentativi di riconnessione prima di rinunciare.
+RECENT_PEERS_AGE = 7 * 24 * 3600 #Età massima (secondi) dei peer della rubrica a cui ricollegarsi all'avvio.
+ADDRESS_BOOK_SAVE_DELAY = 0.5 #Secondi entro cui gli aggiornamenti della rubrica vengono salvati su disco (in un'unica scrittura).
+
+#Intestazione dei chunk di file: ID del trasferimento (16 byte), offset dei dati nel file (8 byte), CRC32 dei dati (4 byte).
+FILE_CHUNK_HEADER = struct.Struct("!16sQI")
+FILE_CHUNK_SIZE = 256 * 1024 #Dimensione dei chunk letti dal disco e inviati in un singolo frame.
+#Risposta ai file proposti dai peer: "ask" chiede all'utente (evento "file_offer"), "all" li accetta tutti, "none" li rifiuta.
+FILE_POLICIES = ("ask", "all", "none")
+MAX_FILE_SIZE = 4 * 1024 ** 3 #Dimensione massima (byte) dei file accettati; quelli più grandi vengono rifiutati.
+MAX_FILE_OFFERS = 32 #Proposte di file in attesa di risposta al massimo (le successive vengono rifiutate).
+PART_FILE_AGE = 7 * 24 * 3600 #Età massima (secondi) dei file parziali ".part" di trasferimenti interrotti e mai ripresi.
+
+#Eccezione sollevata quando lo stream ricevuto non rispetta il protocollo.
+class ProtocolError(Exception):
+    pass
+
+#Costruisce un frame completo (header + payload) pronto da inviare con sendall.
+def encode_frame(ftype, payload=b"", flags=0):
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Payload troppo grande: {len(payload)} byte")
+    return FRAME_HEADER.pack(PROTOCOL_VERSION, ftype, flags, len(payload)) + payload
+
+#Costruisce un frame di controllo serializzando i campi in JSON compatto.
+def encode_control(ftype, **fields):
+    return encode_frame(ftype, json.dumps(fields, separators=(",", ":")).encode())
+
+#Costruisce un frame di chat con ID del messaggio, nodo di origine, TTL, ID della stanza e testo già codificato in UTF-8.
+def encode_chat(msg_id, origin, ttl, room, text):
+    return encode_frame(FRAME_CHAT, CHAT_HEADER.pack(msg_id, origin, ttl, room) + text)
+
+#Separa il payload di un frame di chat in (ID messaggio, nodo di origine, TTL, ID della stanza, testo in byte).
+def decode_chat(payload):
+    if len(payload) < CHAT_HEADER.size:
+        raise ProtocolError("Frame di chat troppo corto")
+    msg_id, origin, ttl, room = CHAT_HEADER.unpack_from(payload)
+    return msg_id, origin, ttl, room, payload[CHAT_HEADER.size:]
+
+#COMPRESSIONE.
+#Il byte flags dei frame di chat indica il codec con cui è compresso il payload (0 = non compresso).
+#I codec supportati vengono annunciati nell'handshake: si comprime verso un peer solo con un codec che conosce.
+
+#Dizionario condiviso per zlib: frammenti frequenti nei messaggi di chat, così anche i messaggi brevi si comprimono.
+#Non va mai modificato (i peer devono usare lo stesso): un dizionario diverso richiede un nuovo codec.
+CHAT_ZDICT = (b"https://www. .com .it .html http:// the and that this with for you are have not what "
+              b"grazie ciao come stai bene anche sono questo quello perch\xc3\xa8 per che non una della "
+              b"messaggio file peer connesso chat domani oggi allora va bene ok ahah :) ")
+
+#Codec di compressione basato su zlib, con dizionario condiviso opzionale.
+#threshold è la dimensione minima (in byte) del payload da cui iniziare a comprimere.
+class ZlibCodec:
+    #Inizializza il codec con il suo id (valore del byte flags), il nome annunciato nell'handshake e i parametri di zlib.
+    def __init__(self, codec_id, name, threshold, level=6, zdict=None):
+        self.codec_id = codec_id
+        self.name = name
+        self.threshold = threshold
+        self.level = level
+        self.zdict = zdict
+
+    #Comprime i dati.
+    def compress(self, data):
+        if self.zdict is None:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        return compressor.compress(data) + compressor.flush()
+
+    #Decomprime i dati, fermandosi a max_length byte (protezione da payload che si espandono a dismisura).
+    def decompress(self, data, max_length):
+        decompressor = zlib.decompressobj(zdict=self.zdict) if self.zdict is not None else zlib.decompressobj()
+        result = decompressor.decompress(data, max_length)
+        if decompressor.unconsumed_tail:
+            raise ProtocolError("Payload compresso troppo grande")
+        return result
+
+#Codec di compressione registrati, per nome; altri codec (con codec_id, name, threshold, compress e decompress)
+#si aggiungono con register_codec.
+CODECS = {}
+
+#Registra un codec di compressione.
+def register_codec(codec):
+    if not 0 < codec.codec_id < 256 or any(other.codec_id == codec.codec_id for other in CODECS.values() if other.name != codec.name):
+        raise ValueError(f"Id del codec non valido o già in uso: {codec.codec_id}")
+    CODECS[codec.name] = codec
+
+register_codec(ZlibCodec(1, "zlib", threshold=512))
+register_codec(ZlibCodec(2, "zlib-dict", threshold=64, zdict=CHAT_ZDICT))
+DEFAULT_CODECS = ("zlib-dict", "zlib") #Codec preferiti, in ordine di preferenza.
+
+#Compressione dei frame in uscita con un codec, con statistiche e soglia adattiva: ogni WINDOW frame di dimensione
+#vicina alla soglia, se la compressione ha fatto risparmiare poco la soglia raddoppia, se ha reso molto si dimezza.
+class Compressor:
+    WINDOW = 64 #Frame vicini alla soglia osservati prima di adattarla.
+    MAX_THRESHOLD = 16 * 1024 #Soglia massima.
+    MIN_SAVING = 0.1 #Risparmio minimo (frazione) perché valga la pena inviare il frame compresso.
+
+    #Inizializza il compressore per il codec indicato.
+    def __init__(self, codec):
+        self.codec = codec
+        self.threshold = codec.threshold #Dimensione minima del payload da comprimere (adattiva).
+        self.frames = 0 #Frame inviati compressi.
+        self.skipped = 0 #Frame non compressi (sotto soglia o con risparmio insufficiente).
+        self.raw_bytes = 0 #Byte dei payload compressi, prima della compressione.
+        self.compressed_bytes = 0 #Byte dei payload compressi, dopo la compressione.
+        self.seconds = 0.0 #Tempo di CPU speso a comprimere.
+        self.window = [0, 0, 0] #Frame, byte originali e byte risparmiati vicino alla soglia (per adattarla).
+
+    #Restituisce il frame compresso con il codec, oppure il frame originale se non conviene comprimerlo.
+    def encode(self, frame):
+        flags, data = self.compress(memoryview(frame)[FRAME_HEADER.size:])
+        if not flags:
+            return frame
+        return FRAME_HEADER.pack(frame[0], frame[1], flags, len(data)) + data
+
+    #Comprime un payload con il codec: restituisce (flag del frame, cioè l'id del codec, e payload compresso),
+    #oppure (0, payload originale) se non conviene comprimerlo.
+    def compress(self, payload):
+        size = len(payload)
+        if size < self.threshold:
+            self.skipped += 1
+            return 0, payload
+        started = time.perf_counter()
+        data = self.codec.compress(payload)
+        self.seconds += time.perf_counter() - started
+        saved = size - len(data)
+        if size < 2 * self.threshold:
+            self.adapt(size, max(0, saved))
+        if saved < size * self.MIN_SAVING:
+            self.skipped += 1
+            return 0, payload
+        self.frames += 1
+        self.raw_bytes += size
+        self.compressed_bytes += len(data)
+        return self.codec.codec_id, data
+
+    #Aggiorna la finestra di osservazione e, quando è piena, adatta la soglia.
+    def adapt(self, size, saved):
+        window = self.window
+        window[0] += 1
+        window[1] += size
+        window[2] += saved
+        if window[0] >= self.WINDOW:
+            ratio = window[2] / window[1]
+            if ratio < self.MIN_SAVING:
+                self.threshold = min(self.MAX_THRESHOLD, self.threshold * 2)
+            elif ratio > 3 * self.MIN_SAVING:
+                self.threshold = max(self.codec.threshold, self.threshold // 2)
+            self.window = [0, 0, 0]
+
+    #Statistiche del compressore (rapporto di compressione, tempo di CPU, soglia attuale).
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "raw_bytes": self.raw_bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "ratio": round(self.compressed_bytes / self.raw_bytes, 3) if self.raw_bytes else None,
+            "cpu_ms": round(self.seconds * 1000, 3),
+            "threshold": self.threshold,
+        }
+
+#CIFRATURA.
+#Scambio di chiavi in stile Noise: ogni nodo ha una chiave statica X25519 (la sua identità, salvata su disco) e per ogni
+#connessione genera una chiave effimera. Chi apre la connessione (initiator) invia per primo le sue chiavi pubbliche,
+#l'altro (responder) risponde con le proprie; le chiavi di sessione derivano, tramite HKDF, da tre Diffie-Hellman
+#(effimera-effimera, statica-effimera, effimera-statica), quindi solo chi possiede le chiavi statiche annunciate
+#può derivarle. Dopo l'handshake ogni gruppo di frame viaggia cifrato con AES-GCM, con una chiave per direzione.
+#Il responder consegna all'initiator un ticket monouso: alla riconnessione basta il Diffie-Hellman effimero,
+#combinato con il segreto del ticket.
+IDENTITY_FILE = os.path.join(os.path.expanduser("~"), ".p2pchat", "identity.key") #Chiave statica del nodo.
+HANDSHAKE_TIMEOUT = 10 #Secondi concessi al peer per completare l'handshake cifrato.
+TICKET_LIFETIME = 24 * 3600 #Secondi di validità dei ticket di ripresa della sessione.
+MAX_TICKETS = 1024 #Ticket emessi conservati al massimo.
+
+#Identità crittografica del nodo: chiave statica X25519, letta da path (o creata e salvata, leggibile solo dall'utente);
+#senza path la chiave è temporanea, valida solo per questa esecuzione.
+class Identity:
+    #Carica o crea la chiave statica.
+    def __init__(self, path=None):
+        load_crypto()
+        self.key = None
+        if path and os.path.exists(path):
+            with open(path, "rb") as file:
+                self.key = X25519PrivateKey.from_private_bytes(file.read())
+        if self.key is None:
+            self.key = X25519PrivateKey.generate()
+            if path:
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(descriptor, "wb") as file:
+                    file.write(self.key.private_bytes_raw())
+        self.public = self.key.public_key().public_bytes_raw() #Chiave pubblica (32 byte), annunciata nell'handshake.
+
+#Impronta breve di una chiave pubblica, da mostrare all'utente e salvare nella rubrica.
+def fingerprint(public):
+    return hashlib.sha256(public).hexdigest()[:32]
+
+#Deriva le chiavi di sessione dal materiale segreto e dalla trascrizione dell'handshake (i due messaggi in ordine):
+#chiave initiator -> responder, chiave responder -> initiator e segreto per il ticket di ripresa.
+def derive_session_keys(material, transcript):
+    okm = HKDF(algorithm=hashes.SHA256(), length=96, salt=hashlib.sha256(transcript).digest(),
+               info=b"p2pchat session v1").derive(material)
+    return okm[:32], okm[32:64], okm[64:]
+
+#Sessione cifrata di una connessione: AES-GCM con una chiave per direzione e nonce a contatore
+#(il TCP consegna i frame in ordine, quindi i contatori dei due capi restano allineati senza trasmetterli).
+class SecureSession:
+    #Inizializza la sessione con le chiavi di invio e ricezione e il segreto per i ticket.
+    def __init__(self, send_key, receive_key, resumption, peer_public, resumed=False):
+        self.sender = AESGCM(send_key)
+        self.receiver = AESGCM(receive_key)
+        self.resumption = resumption #Segreto da associare al ticket di ripresa.
+        self.peer_public = peer_public #Chiave statica del peer (la sua identità).
+        self.resumed = resumed #Se la sessione è stata ripresa con un ticket (handshake ridotto).
+        self.sent = 0 #Contatore dei gruppi cifrati inviati.
+        self.received = 0 #Contatore dei gruppi cifrati ricevuti.
+
+    #Cifra un gruppo di frame.
+    def seal(self, data):
+        nonce = struct.pack("!4xQ", self.sent)
+        self.sent += 1
+        return self.sender.encrypt(nonce, data, None)
+
+    #Decifra un gruppo di frame; i dati alterati (o cifrati con altre chiavi) sono un errore di protocollo.
+    def open(self, data):
+        nonce = struct.pack("!4xQ", self.received)
+        self.received += 1
+        try:
+            return self.receiver.decrypt(nonce, data, None)
+        except InvalidTag:
+            raise ProtocolError("Frame cifrato non autentico") from None
+
+#Handshake di una connessione cifrata, lato initiator o responder.
+class Handshake:
+    #Prepara l'handshake generando la chiave effimera; l'initiator può passare un ticket (id, segreto, chiave del peer)
+    #per riprendere la sessione precedente con il responder.
+    def __init__(self, identity, ticket=None):
+        self.identity = identity
+        self.ticket = ticket
+        self.ephemeral = X25519PrivateKey.generate()
+        self.message = None #Frame di handshake inviato da questo lato (per la trascrizione).
+
+    #Frame di handshake di questo lato, con le chiavi pubbliche statica ed effimera e gli eventuali campi aggiuntivi.
+    def encode(self, **fields):
+        self.message = encode_control(FRAME_HANDSHAKE, static=self.identity.public.hex(),
+                                      ephemeral=self.ephemeral.public_key().public_bytes_raw().hex(), **fields)
+        return self.message
+
+    #Messaggio dell'initiator, con l'ID dell'eventuale ticket.
+    def initiate(self):
+        if self.ticket is not None:
+            return self.encode(ticket=self.ticket[0].hex())
+        return self.encode()
+
+    #Lato responder: elabora il messaggio dell'initiator e restituisce (risposta da inviare, sessione).
+    #ticket è (segreto, chiave del peer) del ticket presentato, se valido: la sessione viene ripresa senza
+    #i Diffie-Hellman con le chiavi statiche; altrimenti (None) l'handshake è completo.
+    def respond(self, payload, ticket=None):
+        info = json.loads(payload)
+        peer_static = bytes.fromhex(info["static"])
+        peer_ephemeral = X25519PublicKey.from_public_bytes(bytes.fromhex(info["ephemeral"]))
+        self.encode(resumed=ticket is not None)
+        material = self.ephemeral.exchange(peer_ephemeral)
+        if ticket is not None:
+            material = ticket[0] + material
+            peer_static = ticket[1]
+        else:
+            material += self.ephemeral.exchange(X25519PublicKey.from_public_bytes(peer_static))
+            material += self.identity.key.exchange(peer_ephemeral)
+        initiator_key, responder_key, resumption = derive_session_keys(material, encode_frame(FRAME_HANDSHAKE, payload) + self.message)
+        return self.message, SecureSession(responder_key, initiator_key, resumption, peer_static, ticket is not None)
+
+    #Lato initiator: elabora la risposta del responder e restituisce la sessione.
+    def complete(self, payload):
+        info = json.loads(payload)
+        peer_static = bytes.fromhex(info["static"])
+        peer_ephemeral = X25519PublicKey.from_public_bytes(bytes.fromhex(info["ephemeral"]))
+        resumed = bool(info.get("resumed")) and self.ticket is not None
+        material = self.ephemeral.exchange(peer_ephemeral)
+        if resumed:
+            material = self.ticket[1] + material
+            peer_static = self.ticket[2]
+        else:
+            material += self.identity.key.exchange(peer_ephemeral)
+            material += self.ephemeral.exchange(X25519PublicKey.from_public_bytes(peer_static))
+        initiator_key, responder_key, resumption = derive_session_keys(material, self.message + encode_frame(FRAME_HANDSHAKE, payload))
+        return SecureSession(initiator_key, responder_key, resumption, peer_static, resumed)
+
+#Insieme limitato degli ID dei messaggi già visti, per scartare i duplicati in modalità gossip.
+#Tiene al massimo capacity ID e dimentica quelli più vecchi di window secondi (LRU con finestra temporale).
+class SeenCache:
+    #Inizializza la cache vuota.
+    def __init__(self, capacity=65536, window=600):
+        self.capacity = capacity #Numero massimo di ID ricordati.
+        self.window = window #Secondi dopo i quali un ID viene dimenticato.
+        self.entries = OrderedDict() #ID del messaggio -> istante in cui è stato visto, dal più vecchio al più recente.
+
+    #Registra un ID; restituisce True se è nuovo, False se era già stato visto (duplicato).
+    def add(self, msg_id):
+        now = time.monotonic()
+        #Elimino gli ID scaduti o in eccesso, partendo dai più vecchi.
+        while self.entries and (len(self.entries) >= self.capacity or next(iter(self.entries.values())) < now - self.window):
+            self.entries.popitem(last=False)
+        if msg_id in self.entries:
+            return False
+        self.entries[msg_id] = now
+        return True
+
+#Legge dal file il chunk che inizia a offset direttamente nel buffer del frame da inviare (header compresi),
+#senza caricare il file in memoria né copiare i dati; restituisce il frame o None se il file è finito.
+#Va eseguita in un thread separato (run_in_executor), perché la lettura dal disco è bloccante.
+def read_file_chunk(file, transfer_id, offset, size):
+    data_start = FRAME_HEADER.size + FILE_CHUNK_HEADER.size
+    frame = bytearray(data_start + size)
+    view = memoryview(frame)
+    file.seek(offset)
+    read = file.readinto(view[data_start:])
+    if not read:
+        return None
+    if read < size:
+        #Il file si è accorciato durante l'invio: spedisco solo i byte letti.
+        del view
+        del frame[data_start + read:]
+        view = memoryview(frame)
+    FRAME_HEADER.pack_into(frame, 0, PROTOCOL_VERSION, FRAME_FILE_CHUNK, 0, FILE_CHUNK_HEADER.size + read)
+    FILE_CHUNK_HEADER.pack_into(frame, FRAME_HEADER.size, transfer_id, offset, zlib.crc32(view[data_start:]))
+    return frame
+
+#Politiche applicate quando la coda in uscita di un peer è piena:
+#"drop_oldest" scarta il frame più vecchio, "disconnect" chiude la connessione al peer lento, "block" fa attendere chi invia.
+#Le politiche valgono solo per i frame di chat: quelli di controllo non vengono mai scartati (vedi Outbox).
+BACKPRESSURE_POLICIES = ("drop_oldest", "disconnect", "block")
+
+#Coda limitata dei frame in uscita verso un singolo peer, svuotata da un task dedicato.
+#Lo stesso oggetto bytes di un frame viene accodato a tutti i peer, senza copie per ogni connessione.
+#I chunk dei file viaggiano in una coda separata (bulk): a ogni giro il task scrive prima i frame di chat
+#e controllo in attesa e poi un solo chunk, così i messaggi non restano bloccati dietro un trasferimento.
+#I frame di controllo (handshake, stanze, conferme dei file e dei messaggi, ticket) hanno una corsia a parte, senza limite
+#e scritta per prima: sono pochi e piccoli, e perderne uno desincronizzerebbe i due peer (ad esempio l'indice delle stanze).
+#Sulle connessioni cifrate ogni gruppo di frame scritto insieme viene cifrato con una sola operazione (FRAME_SEALED),
+#diviso in più gruppi se supererebbe MAX_FRAME_SIZE.
+class Outbox:
+    BATCH_BYTES = 256 * 1024 #Byte massimi scritti sul transport prima di attendere il drain.
+    BULK_LIMIT = 8 #Chunk di file al massimo in coda per peer (chi li produce attende che si liberi spazio).
+
+    #Inizializza la coda per la connessione di un peer (PeerStream; va creata nel thread del loop).
+    def __init__(self, writer, limit=1024, policy="drop_oldest", metrics=None):
+        self.writer = writer #Connessione su cui scrivere i frame.
+        self.limit = limit #Numero massimo di frame in coda.
+        self.policy = policy #Politica di backpressure (vedi BACKPRESSURE_POLICIES).
+        self.metrics = metrics #Metriche del nodo (tempo di drain del socket ed errori di scrittura).
+        self.session = None #Sessione cifrata della connessione (None = in chiaro).
+        self.frames = deque() #Frame in attesa di essere scritti.
+        self.control = deque() #Frame di controllo in attesa di essere scritti (mai scartati).
+        self.bulk = deque() #Chunk di file in attesa di essere scritti.
+        self.queued_bytes = 0 #Byte in attesa di essere scritti.
+        self.sent_frames = 0 #Frame scritti sul transport.
+        self.sent_bytes = 0 #Byte scritti sul transport.
+        self.dropped = 0 #Frame scartati per coda piena.
+        self.max_depth = 0 #Profondità massima raggiunta dalla coda.
+        self.closed = False #True quando la connessione è chiusa: la coda non accetta più frame.
+        self.ready = asyncio.Event() #Segnala al task di scrittura che ci sono frame in coda.
+        self.space = asyncio.Event() #Segnala a chi è in attesa (politica "block") che si è liberato spazio.
+        self.space.set()
+        self.bulk_space = asyncio.Event() #Segnala ai trasferimenti di file in attesa che si è liberato spazio.
+        self.bulk_space.set()
+
+    #Accoda un frame applicando la politica di backpressure (solo ai frame di chat); restituisce False se il frame
+    #non è stato accodato.
+    async def put(self, frame):
+        if frame[1] < FRAME_CHAT:
+            if self.closed:
+                return False
+            self.control.append(frame)
+            self.queued_bytes += len(frame)
+            self.ready.set()
+            return True
+        while len(self.frames) >= self.limit and not self.closed:
+            if self.policy == "drop_oldest":
+                #Scarto il frame più vecchio per fare spazio a quello nuovo.
+                self.queued_bytes -= len(self.frames.popleft())
+                self.dropped += 1
+            elif self.policy == "disconnect":
+                #Il peer non riesce a stare al passo: chiudo la connessione invece di accumulare dati.
+                self.dropped += 1
+                self.writer.transport.abort()
+                self.close()
+            else:
+                #Politica "block": attendo che il task di scrittura liberi spazio.
+                self.space.clear()
+                await self.space.wait()
+        if self.closed:
+            return False
+        self.frames.append(frame)
+        self.queued_bytes += len(frame)
+        self.max_depth = max(self.max_depth, len(self.frames))
+        self.ready.set()
+        return True
+
+    #Accoda un chunk di file, attendendo se la coda bulk è piena; restituisce False se la connessione è chiusa.
+    async def put_bulk(self, frame):
+        while len(self.bulk) >= self.BULK_LIMIT and not self.closed:
+            self.bulk_space.clear()
+            await self.bulk_space.wait()
+        if self.closed:
+            return False
+        self.bulk.append(frame)
+        self.queued_bytes += len(frame)
+        self.ready.set()
+        return True
+
+    #Scrive sul transport i frame in coda, a blocchi, rispettando il flow control del socket (drain).
+    async def run(self):
+        try:
+            while not self.closed:
+                await self.ready.wait()
+                self.ready.clear()
+                while self.control or self.frames or self.bulk:
+                    batch = list(self.control)
+                    size = sum(len(frame) for frame in batch)
+                    self.control.clear()
+                    while self.frames and size < self.BATCH_BYTES:
+                        frame = self.frames.popleft()
+                        batch.append(frame)
+                        size += len(frame)
+                    self.space.set()
+                    #Dopo i frame di chat, un solo chunk di file per giro.
+                    if self.bulk:
+                        frame = self.bulk.popleft()
+                        batch.append(frame)
+                        size += len(frame)
+                        self.bulk_space.set()
+                    self.queued_bytes -= size
+                    self.sent_frames += len(batch)
+                    self.sent_bytes += size
+                    if self.session is not None:
+                        batch = self.seal(batch)
+                    self.writer.writelines(batch)
+                    started = time.perf_counter()
+                    await self.writer.drain()
+                    if self.metrics is not None:
+                        self.metrics.observe("net.drain", time.perf_counter() - started)
+        except (ConnectionError, OSError) as e:
+            if self.metrics is not None:
+                self.metrics.error("invio", e)
+            self.close() #La connessione è caduta: la chiusura viene gestita dal task di ricezione.
+
+    #Cifra un gruppo di frame in uno o più FRAME_SEALED, ciascuno entro MAX_FRAME_SIZE (il gruppo può superarlo, ad esempio
+    #con molti frame di controllo o un messaggio grande insieme a un chunk). Un frame che da solo non ci sta (inoltrato da un
+    #peer in chiaro) non può essere cifrato e viene scartato.
+    def seal(self, batch):
+        sealed = []
+        group = []
+        size = SEAL_OVERHEAD
+        for frame in batch:
+            if len(frame) + SEAL_OVERHEAD > MAX_FRAME_SIZE:
+                self.dropped += 1
+                if self.metrics is not None:
+                    self.metrics.error("invio", ProtocolError(f"Frame troppo grande da cifrare: {len(frame)} byte"))
+                continue
+            if size + len(frame) > MAX_FRAME_SIZE:
+                sealed.append(encode_frame(FRAME_SEALED, self.session.seal(b"".join(group))))
+                group = []
+                size = SEAL_OVERHEAD
+            group.append(frame)
+            size += len(frame)
+        if group:
+            sealed.append(encode_frame(FRAME_SEALED, self.session.seal(b"".join(group))))
+        return sealed
+
+    #Attende che nella coda ci sia posto per un frame (o che si chiuda), qualunque sia la politica di backpressure:
+    #la consegna affidabile la usa per non far scartare i suoi frame, che dovrebbe poi reinviare.
+    async def wait_space(self):
+        while len(self.frames) >= self.limit and not self.closed:
+            self.space.clear()
+            await self.space.wait()
+
+    #Chiude la coda e sblocca eventuali mittenti in attesa.
+    def close(self):
+        self.closed = True
+        self.frames.clear()
+        self.control.clear()
+        self.bulk.clear()
+        self.queued_bytes = 0
+        self.space.set()
+        self.bulk_space.set()
+        self.ready.set()
+
+    #Statistiche della coda (profondità attuale e massima, byte in attesa, frame inviati e scartati).
+    def stats(self):
+        return {
+            "depth": len(self.frames),
+            "control_depth": len(self.control),
+            "bulk_depth": len(self.bulk),
+            "max_depth": self.max_depth,
+            "queued_bytes": self.queued_bytes,
+            "sent_frames": self.sent_frames,
+            "sent_bytes": self.sent_bytes,
+            "dropped": self.dropped,
+        }
+
+#Buffer di ricezione riutilizzabile per una connessione: accumula i byte letti dal socket
+#ed estrae i frame completi, senza copiare ogni chunk ricevuto in un nuovo oggetto.
+class FrameBuffer:
+    #Inizializza il buffer con una capacità iniziale (cresce solo se arriva un frame più grande).
+    def __init__(self, size=64 * 1024):
+        self.buffer = bytearray(size) #Memoria preallocata in cui il socket scrive direttamente (recv_into).
+        self.view = memoryview(self.buffer) #Vista sul buffer, per slicing senza copie.
+        self.start = 0 #Inizio dei dati ancora da consumare.
+        self.end = 0 #Fine dei dati validi ricevuti.
+
+    #Restituisce la porzione libera del buffer in cui scrivere almeno min_free byte (per recv_into).
+    def writable(self, min_free=4096):
+        if len(self.buffer) - self.end < min_free:
+            self._reserve(self.end - self.start + min_free)
+        return self.view[self.end:]
+
+    #Segnala che n byte sono stati scritti nella porzione restituita da writable().
+    def commit(self, n):
+        self.end += n
+
+    #Copia nel buffer dati ricevuti già come oggetto bytes (alternativa a writable/commit).
+    def feed(self, data):
+        size = len(data)
+        self.writable(size)[:size] = data
+        self.commit(size)
+
+    #Estrae tutti i frame completi presenti nel buffer come tuple (tipo, flag, payload).
+    def frames(self):
+        while self.end - self.start >= FRAME_HEADER.size:
+            version, ftype, flags, length = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError(f"Versione del protocollo non supportata: {version}")
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame troppo grande: {length} byte")
+            frame_end = self.start + FRAME_HEADER.size + length
+            if frame_end > self.end:
+                #Frame incompleto: mi assicuro che ci sia spazio per riceverlo tutto e attendo altri dati.
+                self._reserve(FRAME_HEADER.size + length)
+                break
+            payload = bytes(self.view[self.start + FRAME_HEADER.size:frame_end])
+            self.start = frame_end
+            yield ftype, flags, payload
+        if self.start == self.end:
+            #Buffer svuotato: riparto dall'inizio senza spostare dati.
+            self.start = self.end = 0
+
+    #Garantisce che il buffer possa contenere almeno size byte a partire dai dati pendenti.
+    def _reserve(self, size):
+        pending = self.end - self.start
+        if size > len(self.buffer):
+            #Alloco un buffer più grande e ci copio solo i dati non ancora consumati.
+            new_buffer = bytearray(max(size, 2 * len(self.buffer)))
+            new_buffer[:pending] = self.view[self.start:self.end]
+            self.view.release()
+            self.buffer = new_buffer
+            self.view = memoryview(new_buffer)
+        elif self.start:
+            #Compatto i dati pendenti all'inizio del buffer (memmove, nessuna nuova allocazione).
+            self.view[:pending] = self.view[self.start:self.end]
+        self.start, self.end = 0, pending
+
+#Connessione TCP con un peer, come protocollo asyncio con buffer: il transport scrive i byte ricevuti direttamente
+#nel FrameBuffer della connessione (get_buffer/buffer_updated), senza creare un oggetto bytes per ogni chunk letto.
+#Per la scrittura offre le stesse operazioni di uno stream writer (write, writelines, drain, close, get_extra_info).
+class PeerStream(asyncio.BufferedProtocol):
+    READ_LIMIT = 4 * 1024 * 1024 #Byte ricevuti e non ancora elaborati oltre cui si sospende la lettura dal socket.
+
+    #Inizializza la connessione; on_connect viene chiamata quando il transport è pronto (connessioni in entrata).
+    def __init__(self, on_connect=None):
+        self.on_connect = on_connect
+        self.buffer = FrameBuffer() #Buffer di ricezione, riutilizzato per tutta la durata della connessione.
+        self.transport = None #Transport TCP, assegnato in connection_made.
+        self.received = 0 #Byte ricevuti e non ancora segnalati da receive().
+        self.eof = False #Se il peer ha chiuso la connessione.
+        self.waiter = None #Future su cui receive() attende nuovi dati.
+        self.reading_paused = False #Se la lettura dal socket è sospesa (troppi dati non ancora elaborati).
+        self.can_write = asyncio.Event() #Chiaro mentre il buffer di scrittura del transport è pieno (vedi drain).
+        self.can_write.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        if self.on_connect is not None:
+            self.on_connect(self)
+
+    #Il transport riceve direttamente nella porzione libera del buffer (recv_into).
+    def get_buffer(self, sizehint):
+        return self.buffer.writable()
+
+    def buffer_updated(self, nbytes):
+        self.buffer.commit(nbytes)
+        self.received += nbytes
+        if not self.reading_paused and self.buffer.end - self.buffer.start > self.READ_LIMIT:
+            self.reading_paused = True
+            self.transport.pause_reading()
+        self.wake()
+
+    def eof_received(self):
+        self.eof = True
+        self.wake()
+
+    def connection_lost(self, exc):
+        self.eof = True
+        self.wake()
+        self.can_write.set()
+
+    def pause_writing(self):
+        self.can_write.clear()
+
+    def resume_writing(self):
+        self.can_write.set()
+
+    #Sveglia receive(), se sta attendendo.
+    def wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    #Attende nuovi dati nel buffer e restituisce quanti byte sono arrivati dall'ultima chiamata (0 = connessione chiusa).
+    #Va chiamata dopo aver elaborato i frame completi del buffer: se la lettura era sospesa, riprende.
+    async def receive(self):
+        if self.reading_paused:
+            self.reading_paused = False
+            self.transport.resume_reading()
+        if not self.received and not self.eof:
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+        received, self.received = self.received, 0
+        return received
+
+    def write(self, data):
+        self.transport.write(data)
+
+    def writelines(self, data):
+        self.transport.writelines(data)
+
+    #Attende che il buffer di scrittura del transport si svuoti sotto la soglia (flow control).
+    async def drain(self):
+        if self.transport.is_closing():
+            raise ConnectionResetError("Connessione chiusa")
+        await self.can_write.wait()
+
+    def close(self):
+        self.transport.close()
+
+    def get_extra_info(self, name, default=None):
+        return self.transport.get_extra_info(name, default)
+
+#Stato di un file in uscita verso un peer: resta registrato finché il destinatario non conferma la ricezione,
+#così dopo una disconnessione l'invio riprende dall'offset indicato dal destinatario.
+class OutgoingFile:
+    #Inizializza il trasferimento del file path verso il nodo target (identificativo del nodo).
+    def __init__(self, path, target):
+        stat = os.stat(path)
+        self.path = path #Percorso del file da inviare.
+        self.name = os.path.basename(path) #Nome con cui il file viene proposto al destinatario.
+        self.size = stat.st_size #Dimensione del file in byte.
+        self.target = target #Identificativo del nodo destinatario.
+        #ID stabile: lo stesso file (percorso, dimensione, data di modifica) verso lo stesso nodo ha sempre lo stesso ID.
+        key = f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode()
+        self.transfer_id = hashlib.sha256(target + key).digest()[:16]
+        self.task = None #Task che sta inviando i chunk (None se l'invio è fermo).
+
+#Stato di un file in arrivo da un peer: i dati vengono scritti in un file ".part" nella cartella di download,
+#che resta su disco dopo una disconnessione e permette di riprendere il trasferimento.
+class IncomingFile:
+    #Apre (o riapre, per riprendere) il file parziale del trasferimento.
+    def __init__(self, conn, transfer_id, name, size, directory):
+        self.conn = conn #Connessione da cui arrivano i chunk.
+        self.transfer_id = transfer_id #ID del trasferimento.
+        self.name = os.path.basename(name) or "file" #Nome proposto dal mittente (senza percorsi, per sicurezza).
+        self.size = size #Dimensione attesa in byte.
+        self.directory = directory #Cartella in cui salvare il file.
+        self.part_path = os.path.join(directory, f".{transfer_id.hex()}.part") #File parziale, legato all'ID.
+        os.makedirs(directory, exist_ok=True)
+        self.file = open(self.part_path, "ab") #In append: i dati già ricevuti restano e si riprende dalla fine.
+        self.offset = self.file.tell() #Byte già ricevuti e verificati.
+        if self.offset > size:
+            #File parziale incoerente (più lungo del file atteso): ricomincio da zero.
+            self.file.truncate(0)
+            self.offset = 0
+
+    #Chiude il file parziale e lo rinomina col nome definitivo (senza sovrascrivere file esistenti).
+    def finish(self):
+        self.file.close()
+        base, ext = os.path.splitext(self.name)
+        path = os.path.join(self.directory, self.name)
+        counter = 1
+        while os.path.exists(path):
+            path = os.path.join(self.directory, f"{base} ({counter}){ext}")
+            counter += 1
+        os.replace(self.part_path, path)
+        return path
+
+#Elimina dalla cartella di download i file parziali non più aggiornati da max_age secondi; restituisce quanti ne ha eliminati.
+def expire_part_files(directory, max_age=PART_FILE_AGE):
+    limit = time.time() - max_age
+    removed = 0
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return 0 #Cartella non ancora creata (nessun file ricevuto).
+    for entry in entries:
+        if entry.name.startswith(".") and entry.name.endswith(".part") and entry.is_file():
+            try:
+                if entry.stat().st_mtime < limit:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                pass #File appena ripreso o già rimosso.
+    return removed
+
+#Storico persistente dei messaggi su SQLite, in modalità WAL (le letture non bloccano le scritture).
+#I messaggi vengono accodati e scritti a gruppi, in un'unica transazione, da un thread dedicato;
+#un indice full-text (FTS5, se disponibile) permette di cercare anche tra milioni di messaggi.
+class HistoryStore:
+    PAGE_SIZE = 200 #Messaggi caricati per ogni pagina dello storico.
+    BATCH_SIZE = 1000 #Messaggi massimi scritti in una singola transazione.
+
+    #Apre (o crea) il database e avvia il thread di scrittura.
+    def __init__(self, path):
+        self.path = path #Percorso del file del database.
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.pending = queue.Queue() #Messaggi in attesa di essere scritti (None = chiusura).
+        #Connessione usata per le letture dal thread del chiamante (GUI o console), protetta da un lock.
+        self.db = self.connect()
+        self.lock = threading.Lock()
+        self.db.execute(f"""CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY, created REAL NOT NULL, peer TEXT NOT NULL,
+            sender TEXT NOT NULL, tag TEXT NOT NULL, body TEXT NOT NULL, room TEXT NOT NULL DEFAULT '{DEFAULT_ROOM}')""")
+        #Gli storici creati prima delle stanze non hanno la colonna room: i loro messaggi finiscono nella stanza predefinita.
+        if "room" not in [column[1] for column in self.db.execute("PRAGMA table_info(messages)")]:
+            self.db.execute(f"ALTER TABLE messages ADD COLUMN room TEXT NOT NULL DEFAULT '{DEFAULT_ROOM}'")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_room ON messages (room, id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_peer ON messages (peer, created)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_sender ON messages (sender, created)")
+        try:
+            #Indice full-text aggiornato da un trigger: lo storico è solo in aggiunta, quindi basta l'inserimento.
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(body, content='messages', content_rowid='id')")
+            self.db.execute("""CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+                INSERT INTO messages_fts (rowid, body) VALUES (new.id, new.body); END""")
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False #SQLite compilato senza FTS5: la ricerca ripiega su LIKE (più lenta).
+        self.db.commit()
+        #ID del primo messaggio di questa sessione: quelli precedenti sono lo storico da mostrare all'avvio.
+        self.session_start = self.db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM messages").fetchone()[0]
+        self.writer = threading.Thread(target=self.run, daemon=True)
+        self.writer.start()
+
+    #Apre una connessione al database in modalità WAL.
+    def connect(self):
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL") #In WAL basta sincronizzare il disco ai checkpoint.
+        return db
+
+    #Accoda un messaggio da salvare (da qualsiasi thread, senza attendere la scrittura).
+    def add(self, peer, sender, tag, body, created=None, room=DEFAULT_ROOM):
+        self.pending.put((created or time.time(), peer, sender, tag, body, room))
+
+    #Scrive i messaggi accodati a gruppi, finché non riceve None (eseguito nel thread di scrittura).
+    def run(self):
+        db = self.connect()
+        running = True
+        while running:
+            batch = [self.pending.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                running = False
+                batch = [item for item in batch if item is not None]
+            if batch:
+                with db:
+                    db.executemany("INSERT INTO messages (created, peer, sender, tag, body, room) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        db.close()
+
+    #Restituisce (in ordine cronologico) l'ultima pagina di messaggi con id minore di before (tutti se None),
+    #della stanza indicata (di tutte se None), come righe (id, created, peer, sender, tag, body).
+    def page(self, before=None, limit=None, room=None):
+        before = before if before is not None else sys.maxsize
+        with self.lock:
+            if room is None:
+                rows = self.db.execute("SELECT id, created, peer, sender, tag, body FROM messages WHERE id < ? ORDER BY id DESC LIMIT ?",
+                                       (before, limit or self.PAGE_SIZE)).fetchall()
+            else:
+                rows = self.db.execute("""SELECT id, created, peer, sender, tag, body FROM messages
+                    WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?""", (room, before, limit or self.PAGE_SIZE)).fetchall()
+        rows.reverse()
+        return rows
+
+    #Cerca i messaggi che contengono tutte le parole di query, dal più recente.
+    def search(self, query, limit=50):
+        words = query.split()
+        if not words:
+            return []
+        with self.lock:
+            if self.fts:
+                #Ogni parola viene passata tra virgolette, così i caratteri speciali della sintassi FTS5 non danno errori.
+                match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+                return self.db.execute("""SELECT m.id, m.created, m.peer, m.sender, m.tag, m.body FROM messages_fts f
+                    JOIN messages m ON m.id = f.rowid WHERE messages_fts MATCH ? ORDER BY f.rowid DESC LIMIT ?""",
+                                       (match, limit)).fetchall()
+            condition = " AND ".join("body LIKE ?" for _ in words)
+            return self.db.execute(f"SELECT id, created, peer, sender, tag, body FROM messages WHERE {condition} ORDER BY id DESC LIMIT ?",
+                                   [f"%{word}%" for word in words] + [limit]).fetchall()
+
+    #Scrive i messaggi ancora in coda e chiude il database.
+    def close(self):
+        self.pending.put(None)
+        self.writer.join()
+        self.db.close()
+
+#Converte una riga dello storico nel formato (header, corpo, tipo, timestamp) della vista dei messaggi;
+#per i messaggi dei giorni precedenti il timestamp include anche la data.
+def history_message(row):
+    created, sender, tag, body = row[1], row[3], row[4], row[5]
+    moment = datetime.fromtimestamp(created)
+    timestamp = moment.strftime("%H:%M" if moment.date() == datetime.now().date() else "%d/%m/%Y %H:%M")
+    return sender, body, tag, timestamp
+
+#CONSEGNA AFFIDABILE (store-and-forward).
+#I messaggi inviati restano su disco finché ogni destinatario (i peer iscritti alla stanza, anche se offline) non ne
+#conferma la ricezione; alla riconnessione vengono ritrasmessi in ordine, a finestre di DELIVERY_WINDOW messaggi.
+DELIVERY_FILE = os.path.join(os.path.expanduser("~"), ".p2pchat", "outbox.db") #Database dei messaggi da consegnare.
+DELIVERY_WINDOW = 256 #Messaggi inviati a un peer e non ancora confermati, al massimo.
+MAX_PENDING = 10000 #Messaggi in attesa conservati al massimo per destinatario (oltre, si scartano i più vecchi).
+RECIPIENT_MAX_AGE = 30 * 24 * 3600 #Secondi dopo cui un destinatario mai più visto viene dimenticato, con i suoi messaggi.
+DELIVERY_COMMIT_DELAY = 0.05 #Secondi entro cui le modifiche al database vengono scritte su disco (in un'unica transazione).
+DELIVERY_ACK_DELAY = 0.02 #Secondi di attesa prima di inviare un ACK, per confermare con un solo ACK tutti i messaggi arrivati nel frattempo.
+DELIVERY_TIMEOUT = 10 #Secondi senza ACK (con messaggi non confermati) dopo cui si reinvia dall'ultimo messaggio confermato.
+
+#Coda persistente dei messaggi da consegnare, su SQLite: ogni messaggio viene salvato una sola volta (outbox) e per ogni
+#destinatario resta una riga (pending) finché questo non conferma la ricezione con un ACK cumulativo (il numero di sequenza,
+#cioè l'ID nell'outbox, dell'ultimo messaggio ricevuto). Per ogni peer conosciuto salva anche le stanze a cui è iscritto,
+#così i messaggi vengono accodati anche per chi è offline, e l'ultimo numero di sequenza ricevuto da lui (per scartare i duplicati).
+#Il database viene aperto in modo esclusivo: due istanze non possono usare la stessa coda (avrebbero lo stesso ID del nodo).
+#Viene usato solo dal thread del loop asyncio.
+class DeliveryStore:
+    #Apre (o crea) il database; solleva sqlite3.OperationalError se è già in uso da un'altra istanza.
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=0.1, check_same_thread=False)
+        self.db.execute("PRAGMA locking_mode=EXCLUSIVE") #Il lock resta al processo fino alla chiusura.
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, msg_id BLOB NOT NULL, payload BLOB NOT NULL, created REAL NOT NULL,
+            evicted INTEGER NOT NULL DEFAULT 0)""")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pending (
+            recipient BLOB NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (recipient, id)) WITHOUT ROWID""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS pending_id ON pending (id)")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS recipients (
+            node BLOB PRIMARY KEY, username TEXT NOT NULL, rooms TEXT NOT NULL,
+            acked INTEGER NOT NULL DEFAULT 0, received INTEGER NOT NULL DEFAULT 0, last_seen REAL NOT NULL)""")
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'node'").fetchone()
+        if row is None:
+            row = (os.urandom(8),)
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('node', ?)", row)
+        self.node_id = row[0] #ID del nodo, stabile tra un avvio e l'altro (i peer lo usano per confermare i messaggi).
+        #Dimentico i destinatari che non si fanno vivi da troppo tempo, con i messaggi ancora in attesa per loro.
+        expired = time.time() - RECIPIENT_MAX_AGE
+        self.db.execute("DELETE FROM pending WHERE recipient IN (SELECT node FROM recipients WHERE last_seen < ?)", (expired,))
+        self.db.execute("DELETE FROM recipients WHERE last_seen < ?", (expired,))
+        self.db.commit() #Prima scrittura: da qui il database è di questo processo.
+        #Destinatari conosciuti, per ID del nodo: nome, stanze (ID, None = tutte), ultimo ACK, ultimo messaggio ricevuto
+        #e numero di messaggi in attesa. Sono pochi (i peer conosciuti), quindi stanno in memoria; i messaggi no.
+        self.recipients = {}
+        self.room_index = {} #Indice dei destinatari per stanza (None = iscritti a tutte).
+        counts = dict(self.db.execute("SELECT recipient, COUNT(*) FROM pending GROUP BY recipient"))
+        for node, username, rooms, acked, received in self.db.execute(
+                "SELECT node, username, rooms, acked, received FROM recipients"):
+            self.recipients[node] = {"username": username, "rooms": set(), "acked": acked, "received": received,
+                                     "pending": counts.get(node, 0)}
+            self.set_rooms(node, {None if room == ALL_ROOMS else bytes.fromhex(room) for room in json.loads(rooms)}, save=False)
+        self.evicted = 0 #Messaggi scartati perché la coda di un destinatario era piena.
+        self.dirty = False #Se ci sono modifiche non ancora scritte su disco.
+
+    #Registra (o aggiorna) un destinatario quando si collega, con il suo nome utente e le stanze a cui è iscritto.
+    def remember(self, node, username, rooms):
+        recipient = self.recipients.get(node)
+        if recipient is None:
+            recipient = self.recipients[node] = {"username": username, "rooms": set(), "acked": 0, "received": 0, "pending": 0}
+            self.db.execute("INSERT INTO recipients (node, username, rooms, last_seen) VALUES (?, ?, '[]', ?)",
+                            (node, username, time.time()))
+        else:
+            recipient["username"] = username
+            self.db.execute("UPDATE recipients SET username = ?, last_seen = ? WHERE node = ?", (username, time.time(), node))
+        self.set_rooms(node, rooms)
+
+    #Aggiorna le stanze a cui è iscritto un destinatario (e l'indice per stanza).
+    def set_rooms(self, node, rooms, save=True):
+        recipient = self.recipients[node]
+        for room in recipient["rooms"] - rooms:
+            self.room_index[room].discard(node)
+            if not self.room_index[room]:
+                del self.room_index[room]
+        for room in rooms - recipient["rooms"]:
+            self.room_index.setdefault(room, set()).add(node)
+        recipient["rooms"] = set(rooms)
+        if save:
+            names = [ALL_ROOMS if room is None else room.hex() for room in rooms]
+            self.db.execute("UPDATE recipients SET rooms = ? WHERE node = ?", (json.dumps(names), node))
+            self.dirty = True
+
+    #Salva un messaggio per tutti i destinatari iscritti alla stanza, tranne exclude (il nodo stesso); restituisce
+    #il numero di sequenza assegnato (None se non c'è nessuno a cui consegnarlo), i destinatari e gli ID dei messaggi
+    #scartati per fare posto che non attendono più nessun altro destinatario (completati: vedi ack).
+    def enqueue(self, msg_id, room, payload, exclude=None):
+        nodes = self.room_index.get(room, set()) | self.room_index.get(None, set())
+        nodes.discard(exclude)
+        if not nodes:
+            return None, (), []
+        evicted = []
+        seq = self.db.execute("INSERT INTO outbox (msg_id, payload, created) VALUES (?, ?, ?)",
+                              (msg_id, payload, time.time())).lastrowid
+        self.db.executemany("INSERT INTO pending (recipient, id) VALUES (?, ?)", [(node, seq) for node in nodes])
+        for node in nodes:
+            recipient = self.recipients[node]
+            recipient["pending"] += 1
+            if recipient["pending"] > MAX_PENDING:
+                #Coda piena: scarto il messaggio più vecchio del destinatario (per lui non verrà più consegnato).
+                oldest = self.db.execute("SELECT MIN(id) FROM pending WHERE recipient = ?", (node,)).fetchone()[0]
+                self.db.execute("DELETE FROM pending WHERE recipient = ? AND id = ?", (node, oldest))
+                self.db.execute("UPDATE outbox SET evicted = 1 WHERE id = ?", (oldest,))
+                recipient["pending"] -= 1
+                self.evicted += 1
+                if self.db.execute("SELECT 1 FROM pending WHERE id = ?", (oldest,)).fetchone() is None:
+                    evicted += [msg_id for msg_id, in self.db.execute("SELECT msg_id FROM outbox WHERE id = ?", (oldest,))]
+                    self.db.execute("DELETE FROM outbox WHERE id = ?", (oldest,))
+        self.dirty = True
+        return seq, nodes, evicted
+
+    #Restituisce (in ordine) fino a limit messaggi in attesa per un destinatario con numero di sequenza maggiore di after,
+    #come coppie (numero di sequenza, payload del frame di chat).
+    def fetch(self, node, after, limit):
+        return self.db.execute("""SELECT p.id, o.payload FROM pending p JOIN outbox o ON o.id = p.id
+            WHERE p.recipient = ? AND p.id > ? ORDER BY p.id LIMIT ?""", (node, after, limit)).fetchall()
+
+    #Registra l'ACK cumulativo di un destinatario (ricevuti tutti i messaggi fino a seq) e rimuove i messaggi che non
+    #attendono più nessuno (solo quelli fino a seq: gli altri non sono cambiati, e i destinatari offline di altri messaggi
+    #non li trattengono). Restituisce gli ID dei messaggi completati: (consegnati a tutti, scartati per qualcuno).
+    def ack(self, node, seq):
+        recipient = self.recipients.get(node)
+        if recipient is None or seq <= recipient["acked"]:
+            return [], [] #ACK già ricevuto (ad esempio ripetuto dopo una riconnessione).
+        removed = self.db.execute("DELETE FROM pending WHERE recipient = ? AND id <= ?", (node, seq)).rowcount
+        recipient["pending"] -= removed
+        recipient["acked"] = seq
+        self.db.execute("UPDATE recipients SET acked = ?, last_seen = ? WHERE node = ?", (seq, time.time(), node))
+        self.dirty = True
+        if not removed:
+            return [], []
+        condition = "id <= ? AND NOT EXISTS (SELECT 1 FROM pending p WHERE p.id = outbox.id)"
+        rows = self.db.execute(f"SELECT msg_id, evicted FROM outbox WHERE {condition}", (seq,)).fetchall()
+        self.db.execute(f"DELETE FROM outbox WHERE {condition}", (seq,))
+        return [msg_id for msg_id, evicted in rows if not evicted], [msg_id for msg_id, evicted in rows if evicted]
+
+    #Ultimo numero di sequenza ricevuto da un nodo (0 se sconosciuto).
+    def received(self, node):
+        recipient = self.recipients.get(node)
+        return recipient["received"] if recipient is not None else 0
+
+    #Salva l'ultimo numero di sequenza ricevuto da un nodo (già confermato con un ACK).
+    def set_received(self, node, seq):
+        recipient = self.recipients.get(node)
+        if recipient is not None and seq > recipient["received"]:
+            recipient["received"] = seq
+            self.db.execute("UPDATE recipients SET received = ? WHERE node = ?", (seq, node))
+            self.dirty = True
+
+    #Scrive su disco le modifiche accumulate, in un'unica transazione.
+    def commit(self):
+        if self.dirty:
+            self.db.commit()
+            self.dirty = False
+
+    #Statistiche della coda: messaggi in attesa per destinatario (solo quelli con messaggi in attesa) e scartati.
+    def stats(self):
+        return {
+            "pending": {recipient["username"]: recipient["pending"] for recipient in self.recipients.values() if recipient["pending"]},
+            "recipients": len(self.recipients),
+            "evicted": self.evicted,
+        }
+
+    #Scrive le ultime modifiche e chiude il database.
+    def close(self):
+        self.commit()
+        self.db.close()
+
+#Rubrica dei peer conosciuti, costruita dagli handshake: per ogni indirizzo di ascolto ("host:porta")
+#salva nome utente, identificativo del nodo, ultimo contatto e (dalle connessioni cifrate) l'impronta della chiave del peer.
+#Con un percorso viene salvata su disco in JSON.
+class AddressBook:
+    MAX_ENTRIES = 256 #Peer conservati al massimo (i contatti più vecchi vengono dimenticati).
+
+    #Carica la rubrica dal file indicato (se esiste); senza percorso resta solo in memoria.
+    def __init__(self, path=None):
+        self.path = path #File JSON della rubrica (None = solo in memoria).
+        self.peers = {} #Voci della rubrica per indirizzo "host:porta".
+        if path:
+            try:
+                with open(path) as file:
+                    self.peers = json.load(file)
+            except (OSError, ValueError):
+                self.peers = {} #Rubrica assente o illeggibile: riparto da zero.
+
+    #Aggiorna (o aggiunge) il peer in ascolto su host:port. L'impronta già salvata non viene mai sostituita: per accettare
+    #una nuova chiave il peer va prima rimosso dalla rubrica (forget).
+    def update(self, host, port, username, node_id, identity=None):
+        address = f"{host}:{port}"
+        identity = self.peers.get(address, {}).get("identity") or identity
+        self.peers[address] = {"host": host, "port": port, "username": username,
+                               "node": node_id.hex(), "identity": identity, "last_seen": time.time()}
+        if len(self.peers) > self.MAX_ENTRIES:
+            oldest = min(self.peers, key=lambda address: self.peers[address]["last_seen"])
+            del self.peers[oldest]
+
+    #Restituisce (indirizzo, voce) della rubrica che vincola a un'altra chiave il peer in ascolto su host:port o con l'ID
+    #del nodo node_id, qualunque nome utente annunci; None se nessuna impronta salvata è in conflitto con identity.
+    def conflict(self, host, port, node_id, identity):
+        own = f"{host}:{port}"
+        node = node_id.hex()
+        for address, entry in self.peers.items():
+            if (address == own or entry.get("node") == node) and entry.get("identity") not in (None, identity):
+                return address, entry
+        return None
+
+    #Rimuove dalla rubrica il peer in ascolto all'indirizzo "host:porta" (con la sua impronta); restituisce True se c'era.
+    def forget(self, address):
+        return self.peers.pop(address, None) is not None
+
+    #Peer contattati negli ultimi max_age secondi, dal più recente.
+    def recent(self, max_age):
+        limit = time.time() - max_age
+        return sorted((entry for entry in self.peers.values() if entry["last_seen"] >= limit),
+                      key=lambda entry: entry["last_seen"], reverse=True)
+
+    #Salva la rubrica su disco (scrittura su un file temporaneo con nome univoco, nella stessa cartella, e rinomina);
+    #va eseguita in un thread separato.
+    def save(self, peers):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(dir=directory or None, prefix=os.path.basename(self.path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                json.dump(peers, file, indent=2)
+            os.replace(temp, self.path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+#SCOPERTA DEI PEER IN RETE LOCALE.
+#Ogni nodo annuncia periodicamente la propria presenza con un beacon UDP multicast di pochi byte (identificativo del nodo,
+#porta di ascolto, nome utente). L'intervallo tra i beacon cresce con il numero di nodi visti, così il traffico totale
+#sul segmento resta intorno a BEACON_BUDGET beacon al secondo anche con centinaia di nodi; ogni beacon riporta il proprio
+#intervallo, e un nodo viene dimenticato quando ne salta DISCOVERY_EXPIRY di fila.
+DISCOVERY_GROUP = "239.255.42.99" #Gruppo multicast dei beacon (ambito locale dell'organizzazione).
+DISCOVERY_PORT = 47474 #Porta UDP dei beacon.
+BEACON = struct.Struct("!4sB8sHHB") #Beacon: magic, versione, ID del nodo, porta TCP, intervallo (decimi di s), flag; poi il nome utente.
+BEACON_MAGIC = b"P2PB"
+BEACON_ENCRYPTED = 0x01 #Flag del beacon: il nodo accetta solo connessioni cifrate.
+BEACON_INTERVAL = 5 #Secondi minimi tra due beacon dello stesso nodo.
+BEACON_MAX_INTERVAL = 60 #Secondi massimi tra due beacon dello stesso nodo.
+BEACON_BUDGET = 20 #Beacon al secondo, in totale, a cui tendere sul segmento di rete.
+DISCOVERY_EXPIRY = 3 #Beacon mancati dopo cui un nodo viene dimenticato.
+MAX_DISCOVERED = 512 #Nodi scoperti conservati al massimo.
+
+#Servizio di scoperta in rete locale di un ChatNode (eseguito nel thread del loop): invia i beacon, tiene la tabella
+#dei nodi scoperti e, se richiesto, mantiene le connessioni verso un numero limitato di essi.
+class LanDiscovery(asyncio.DatagramProtocol):
+    #Inizializza il servizio per il nodo; interface è l'IP dell'interfaccia da usare ("0.0.0.0" = scelta dal sistema).
+    #Con connect > 0 il nodo si collega da solo a nodi scoperti scelti a caso, finché ha meno di connect peer.
+    def __init__(self, node, group=DISCOVERY_GROUP, port=DISCOVERY_PORT, interface="0.0.0.0", connect=0):
+        self.node = node #Nodo di cui annunciare la presenza.
+        self.group = group #Gruppo multicast dei beacon.
+        self.port = port #Porta UDP dei beacon.
+        self.interface = interface #Interfaccia su cui inviare e ricevere i beacon.
+        self.connect = connect #Numero di peer a cui tendere con le connessioni automatiche (0 = nessuna).
+        self.peers = {} #Nodi scoperti per ID: nome utente, host, porta, flag e scadenza.
+        self.connecting = set() #Indirizzi a cui è in corso una connessione automatica.
+        self.transport = None #Transport UDP, creato in start().
+        self.task = None #Task che invia periodicamente i beacon.
+        self.sent = 0 #Beacon inviati.
+        self.received = 0 #Beacon validi ricevuti da altri nodi.
+        self.dropped = 0 #Nodi ignorati perché la tabella era piena.
+
+    #Apre il socket UDP del gruppo multicast; più nodi sulla stessa macchina condividono la porta.
+    def open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(("", self.port))
+        interface = socket.inet_aton(self.interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(self.group) + interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, interface)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1) #I beacon non escono dal segmento locale.
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1) #Altri nodi sulla stessa macchina li ricevono.
+        sock.setblocking(False)
+        return sock
+
+    #Mette in ascolto il socket e avvia l'invio dei beacon; restituisce False (con un errore) se la rete non lo consente.
+    async def start(self):
+        try:
+            sock = self.open_socket()
+        except OSError as e:
+            self.node.metrics.error("scoperta", e)
+            self.node.emit("error", f"Scoperta dei peer in rete locale non disponibile: {e}")
+            return False
+        self.transport, _ = await self.node.loop.create_datagram_endpoint(lambda: self, sock=sock)
+        self.task = self.node.loop.create_task(self.run())
+        return True
+
+    #Intervallo attuale tra i beacon: cresce con i nodi scoperti per restare nel budget del segmento.
+    def interval(self):
+        return min(BEACON_MAX_INTERVAL, max(BEACON_INTERVAL, (len(self.peers) + 1) / BEACON_BUDGET))
+
+    #Codifica il beacon del nodo (al massimo qualche decina di byte).
+    def beacon(self, interval):
+        flags = BEACON_ENCRYPTED if self.node.identity is not None else 0
+        return BEACON.pack(BEACON_MAGIC, 1, self.node.node_id, self.node.port, int(interval * 10), flags) + \
+            self.node.username.encode()[:32]
+
+    #Invia i beacon a intervalli casuali intorno all'intervallo attuale (così i nodi non trasmettono tutti insieme),
+    #dimentica i nodi scaduti e completa le connessioni automatiche.
+    async def run(self):
+        while True:
+            interval = self.interval()
+            try:
+                self.transport.sendto(self.beacon(interval), (self.group, self.port))
+                self.sent += 1
+            except OSError as e:
+                self.node.metrics.error("beacon", e) #Rete momentaneamente non disponibile: riprovo al prossimo giro.
+            self.expire()
+            self.fill()
+            await asyncio.sleep(interval * random.uniform(0.5, 1.5))
+
+    #Elabora un beacon ricevuto: aggiorna la tabella e, per un nodo nuovo, lo notifica e valuta la connessione.
+    def datagram_received(self, data, addr):
+        if len(data) < BEACON.size:
+            return
+        magic, version, node_id, port, interval, flags = BEACON.unpack_from(data)
+        if magic != BEACON_MAGIC or version != 1 or node_id == self.node.node_id or not port:
+            return #Datagramma estraneo, versione sconosciuta o il mio stesso beacon.
+        self.received += 1
+        entry = self.peers.get(node_id)
+        if entry is None and len(self.peers) >= MAX_DISCOVERED:
+            self.expire()
+            if len(self.peers) >= MAX_DISCOVERED:
+                self.dropped += 1
+                return
+        username = data[BEACON.size:].decode(errors="replace")
+        expires = time.monotonic() + DISCOVERY_EXPIRY * max(interval / 10, BEACON_INTERVAL)
+        self.peers[node_id] = {"username": username, "host": addr[0], "port": port, "flags": flags, "expires": expires}
+        if entry is None or (entry["host"], entry["port"], entry["username"]) != (addr[0], port, username):
+            self.node.emit("discovered", self.entries())
+            self.fill(node_id)
+
+    #Dimentica i nodi da cui non arrivano beacon da troppo tempo.
+    def expire(self):
+        now = time.monotonic()
+        expired = [node_id for node_id, entry in self.peers.items() if entry["expires"] < now]
+        for node_id in expired:
+            del self.peers[node_id]
+        if expired:
+            self.node.emit("discovered", self.entries())
+
+    #Se il nodo ha meno di connect peer, si collega ai nodi scoperti non ancora connessi: a quello appena scoperto
+    #(first) oppure a nodi scelti a caso, così le connessioni si distribuiscono su tutta la rete locale.
+    def fill(self, first=None):
+        missing = self.connect - len(self.node.peers) - len(self.connecting)
+        if missing <= 0:
+            return
+        connected_ids = set(self.node.node_ids.values())
+        connected = set(self.node.listen_addrs.values()) | self.connecting
+        #Solo nodi con la mia stessa impostazione di cifratura (gli altri rifiuterebbero la connessione).
+        encrypted = BEACON_ENCRYPTED if self.node.identity is not None else 0
+        candidates = [node_id for node_id, entry in self.peers.items()
+                      if node_id not in connected_ids and (entry["host"], entry["port"]) not in connected
+                      and entry["flags"] & BEACON_ENCRYPTED == encrypted]
+        if first in candidates:
+            chosen = [first]
+        else:
+            chosen = random.sample(candidates, min(missing, len(candidates)))
+        for node_id in chosen:
+            address = (self.peers[node_id]["host"], self.peers[node_id]["port"])
+            self.connecting.add(address)
+            task = self.node.loop.create_task(self.node.open_peer(*address, quiet=True))
+            task.add_done_callback(lambda task, address=address: self.connecting.discard(address))
+
+    #Nodi scoperti come tuple (nome utente, host, porta), in ordine di nome.
+    def entries(self):
+        return sorted((entry["username"], entry["host"], entry["port"]) for entry in self.peers.values())
+
+    #Statistiche del servizio di scoperta.
+    def stats(self):
+        return {"peers": len(self.peers), "interval_s": round(self.interval(), 1), "beacons_sent": self.sent,
+                "beacons_received": self.received, "dropped": self.dropped}
+
+    #Ferma l'invio dei beacon e chiude il socket.
+    def close(self):
+        if self.task is not None:
+            self.task.cancel()
+        if self.transport is not None:
+            self.transport.close()
+
+#Nodo della chat senza interfaccia grafica: gestisce listener, peer connessi e messaggi.
+#Può essere usato da solo (bot, relay, script) oppure come motore della GUI.
+#Gli eventi prodotti sono tuple il cui primo elemento ne indica il tipo:
+#("message", testo, tag, timestamp[, stanza]) (la stanza solo per i messaggi di chat), ("peers", lista_nomi), ("error", testo),
+#("transfer", nome_file, byte_trasferiti, byte_totali) per l'avanzamento dei file in arrivo,
+#("file_offer", nome_peer, ID del trasferimento, nome_file, byte_totali) per un file proposto da un peer, a cui rispondere con answer_file,
+#("address", tipo, ip) quando è noto un indirizzo del nodo ("local" o "public"),
+#("discovered", lista di (nome utente, host, porta)) quando cambiano i nodi scoperti in rete locale.
+#Le metriche del nodo (self.metrics) si leggono con stats(); con stats_port vengono esposte in HTTP su 127.0.0.1,
+#con stats_file salvate in JSON ogni stats_interval secondi; profile avvia subito il profiler a campionamento.
+#I peer conosciuti finiscono nella rubrica (address_book: percorso del file JSON, None = solo in memoria): se una connessione
+#aperta da questo nodo cade, viene ripristinata in background; con autoconnect all'avvio ci si ricollega ai peer recenti.
+#compression è la lista dei codec (nomi in CODECS) da usare, in ordine di preferenza (vuota = nessuna compressione).
+#Con encrypt=True tutte le connessioni sono cifrate (richiede il pacchetto "cryptography"): identity è il file della chiave
+#statica del nodo (None = chiave temporanea). Nella rubrica resta l'impronta della chiave di ogni peer: se lo stesso peer
+#si ripresenta con un'altra chiave la connessione viene rifiutata.
+#Con discovery=True il nodo si annuncia e scopre gli altri nodi in rete locale con beacon UDP multicast (discovery_group,
+#discovery_port); con discovery_connect > 0 si collega da solo fino ad avere quel numero di peer.
+#rooms sono le stanze in cui il nodo entra all'avvio (ALL_ROOMS = tutte): i messaggi di una stanza vengono inviati (e inoltrati)
+#solo ai peer iscritti, trovati con un indice degli iscritti per stanza; gli eventi dei messaggi di chat riportano la stanza.
+#I file proposti dai peer vengono ricevuti secondo accept_files (vedi FILE_POLICIES) e solo fino a max_file_size byte;
+#all'avvio vengono eliminati i file parziali (".part") di download_dir più vecchi di PART_FILE_AGE.
+#Se history è il percorso di un database, i messaggi inviati e ricevuti vengono salvati nello storico persistente.
+#Se delivery è il percorso di un database (DeliveryStore), i messaggi inviati restano su disco finché ogni peer iscritto alla
+#stanza, anche se al momento offline, non ne conferma la ricezione; alla riconnessione gli vengono ritrasmessi in ordine.
+#L'evento ("delivery", stato, lista di ID dei messaggi) segnala i messaggi consegnati a tutti ("delivered"), quelli scartati
+#per qualche destinatario perché la sua coda era piena ("evicted") e quelli senza destinatari ("unsent").
+class ChatNode:
+    #Inizializza lo stato del nodo; la rete parte solo con start().
+    #Con gossip=True i messaggi ricevuti vengono inoltrati (fino a ttl hop) a un massimo di fanout peer (None = tutti).
+    #Ogni peer ha una coda in uscita di al massimo queue_limit frame, gestita secondo la politica backpressure.
+    def __init__(self, username, host='0.0.0.0', port=0, on_event=None, gossip=False, ttl=DEFAULT_TTL, fanout=None,
+                 queue_limit=1024, backpressure="drop_oldest", download_dir=None, history=None,
+                 stats_port=None, stats_file=None, stats_interval=10, profile=False, address_book=None, autoconnect=False,
+                 compression=DEFAULT_CODECS, encrypt=False, identity=None, discovery=False, discovery_group=DISCOVERY_GROUP,
+                 discovery_port=DISCOVERY_PORT, discovery_connect=0, rooms=(DEFAULT_ROOM,), delivery=None,
+                 accept_files="ask", max_file_size=MAX_FILE_SIZE):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"Politica di backpressure sconosciuta: {backpressure}")
+        if accept_files not in FILE_POLICIES:
+            raise ValueError(f"Politica dei file in arrivo sconosciuta: {accept_files}")
+        self.username = username #Nome utente con cui il nodo si presenta ai peer.
+        self.node_id = os.urandom(8) #Identificativo casuale del nodo, usato come origine dei messaggi.
+        self.host = host #Indirizzo IP su cui mettere in ascolto il server (di default imposto '0.0.0.0' per tutte le interfacce).
+        self.port = port #Porta su cui ascoltare (0 significa che il sistema deciderà automaticamente una porta disponibile).
+        #Lo stato delle connessioni è accessibile solo dal thread dell'event loop asyncio.
+        self.peers = {} #Dizionario per memorizzare gli stream writer verso i peer connessi e il loro indirizzo.
+        self.usernames = {} #Dizionario per associare a ogni connessione il nome utente del peer.
+        self.node_ids = {} #Dizionario per associare a ogni connessione l'identificativo del nodo del peer.
+        self.gossip = gossip #Se True i messaggi vengono inoltrati anche ai peer non collegati direttamente all'origine.
+        self.ttl = ttl #Hop consentiti ai messaggi inviati da questo nodo in modalità gossip.
+        self.fanout = fanout #Numero massimo di peer a cui inoltrare ogni messaggio (None = tutti).
+        self.seen = SeenCache() #ID dei messaggi già visti, per consegnare e inoltrare ogni messaggio una sola volta.
+        self.outboxes = {} #Dizionario per associare a ogni connessione la sua coda di frame in uscita.
+        self.queue_limit = queue_limit #Numero massimo di frame nella coda in uscita di ogni peer.
+        self.backpressure = backpressure #Politica applicata quando la coda di un peer è piena.
+        #Con la politica "block" al massimo queue_limit invii in corso: oltre, send() attende, invece di accumulare
+        #nel loop invii bloccati (e i loro frame) senza limite.
+        self.publishing = threading.BoundedSemaphore(queue_limit) if backpressure == "block" else None
+        #Cartella in cui salvare i file ricevuti.
+        self.download_dir = download_dir or os.path.join(os.path.expanduser("~"), "Downloads", "P2PChat")
+        self.outgoing = {} #Trasferimenti in uscita non ancora confermati, per (ID trasferimento, nodo destinatario).
+        self.incoming = {} #Trasferimenti in arrivo, per (connessione, ID trasferimento).
+        self.accept_files = accept_files #Risposta ai file proposti dai peer (vedi FILE_POLICIES).
+        self.max_file_size = max_file_size #Dimensione massima (byte) dei file accettati.
+        self.file_offers = {} #Proposte in attesa della risposta dell'utente (connessione, nodo, nome, dimensione), per ID esadecimale.
+        self.accepted_files = set() #Trasferimenti accettati (nodo del mittente, ID): se riproposti riprendono senza chiedere.
+        self.history = HistoryStore(history) if history else None #Storico persistente dei messaggi (None = disattivato).
+        self.observed_ip = None #IP pubblico del nodo come lo vedono i peer (comunicato nell'handshake).
+        self.metrics = Metrics() #Contatori e istogrammi dei tempi del nodo.
+        self.profiler = SamplingProfiler() #Profiler a campionamento, attivabile a richiesta.
+        self.bytes_in = {} #Byte ricevuti da ogni connessione.
+        self.stats_port = stats_port #Porta dell'endpoint HTTP delle statistiche (None = disattivato, 0 = automatica).
+        self.stats_file = stats_file #File in cui salvare periodicamente le statistiche in JSON (None = disattivato).
+        self.stats_interval = stats_interval #Secondi tra un salvataggio delle statistiche e il successivo.
+        self.stats_server = None #Server dell'endpoint delle statistiche.
+        self.stats_task = None #Task che salva periodicamente le statistiche.
+        if profile:
+            self.profiler.start()
+        self.address_book = AddressBook(address_book) #Rubrica dei peer conosciuti.
+        self.address_book_dirty = False #Se la rubrica ha modifiche non ancora salvate su disco.
+        self.save_task = None #Task che salva la rubrica su disco (uno solo alla volta).
+        self.autoconnect = autoconnect #Se all'avvio ricollegarsi ai peer contattati di recente.
+        self.dialed = set() #Connessioni aperte da questo nodo (le uniche che il nodo ripristina se cadono).
+        self.listen_addrs = {} #Indirizzo di ascolto (host, porta) di ogni peer, noto dopo l'handshake.
+        self.replaced = set() #Connessioni chiuse perché duplicate: alla chiusura non vanno segnalate né ripristinate.
+        self.reconnecting = {} #Task di riconnessione in corso, per indirizzo di ascolto.
+        self.stopping = False #Se il nodo si sta chiudendo (niente più riconnessioni).
+        for name in compression:
+            if name not in CODECS:
+                raise ValueError(f"Codec di compressione sconosciuto: {name}")
+        self.compressors = {name: Compressor(CODECS[name]) for name in compression} #Compressori, in ordine di preferenza.
+        self.codecs = {} #Codec negoziato con ogni peer (assente = nessuna compressione).
+        self.identity = Identity(identity) if encrypt else None #Chiave statica del nodo (None = connessioni in chiaro).
+        self.tickets = {} #Ticket ricevuti per riprendere la sessione cifrata, per indirizzo a cui connettersi.
+        self.issued_tickets = OrderedDict() #Ticket emessi (segreto, chiave del peer, scadenza), per ID.
+        #Scoperta dei peer in rete locale (None = disattivata); i beacon escono dall'interfaccia su cui il nodo è in ascolto.
+        interface = host if host not in ("", "0.0.0.0") else "0.0.0.0"
+        self.discovery = LanDiscovery(self, discovery_group, discovery_port, interface, discovery_connect) if discovery else None
+        self.rooms = {room_id(name): name for name in rooms if name != ALL_ROOMS} #Stanze del nodo, per ID.
+        self.all_rooms = ALL_ROOMS in rooms #Se il nodo riceve i messaggi di tutte le stanze.
+        self.room_names = dict(self.rooms) #Nomi delle stanze note (anche quelle dei peer), per ID.
+        self.subscribers = {} #Indice degli iscritti: connessioni dei peer per ID della stanza (None = iscritti a tutte).
+        self.peer_rooms = {} #Stanze (ID, None = tutte) a cui è iscritto ogni peer, per aggiornare l'indice alla disconnessione.
+        self.events = queue.Queue() #Eventi di rete (messaggi, lista peer, errori) per chi usa il nodo, ad esempio la GUI.
+        self.on_event = on_event #Callback opzionale chiamata nel thread del loop al posto della coda.
+        self.loop = None #Event loop asyncio, creato in start().
+        self.listener = None #Server asyncio in ascolto, creato in start().
+        self.tasks = set() #Task in background (ricezione delle connessioni in uscita, ACK, ...): riferimenti forti, per non perderli.
+        self.store = None #Coda persistente dei messaggi da consegnare (None = consegna senza conferme).
+        if delivery:
+            try:
+                self.store = DeliveryStore(delivery)
+                self.node_id = self.store.node_id #L'ID del nodo deve restare lo stesso, perché i peer confermano i messaggi a lui.
+            except sqlite3.OperationalError as e:
+                self.emit("error", f"Coda dei messaggi non disponibile ({e}): forse è già in uso da un'altra istanza.")
+        self.deliveries = {} #Stato della consegna verso ogni connessione (ultimo inviato, in attesa di ACK, ...).
+        self.delivery_conns = {} #Connessione attiva di ogni destinatario, per ID del nodo.
+        self.received_seqs = {} #Ultimo numero di sequenza ricevuto da ogni nodo (senza coda persistente).
+        self.delivery_gaps = set() #Nodi da cui manca un messaggio, già segnalato con un ACK "gap" (in attesa del reinvio).
+        self.acks_due = {} #Connessioni a cui inviare un ACK (uno solo per i messaggi arrivati insieme), con il flag "gap".
+        self.commit_handle = None #Scrittura su disco programmata della coda persistente.
+
+    #Avvia l'event loop in un thread in background e mette il server in ascolto.
+    def start(self):
+        expire_part_files(self.download_dir)
+        #Creo l'event loop asyncio e lo eseguo in un unico thread in background, senza bloccare il chiamante.
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True).start()
+        #Avvio il server TCP nel loop e attendo che sia in ascolto.
+        self.listener = asyncio.run_coroutine_threadsafe(self.start_server(), self.loop).result()
+        #Aggiorno la porta assegnata (utile se era 0 e il sistema ha assegnato una porta disponibile).
+        self.port = self.listener.sockets[0].getsockname()[1]
+        asyncio.run_coroutine_threadsafe(self.start_stats(), self.loop).result()
+        if self.discovery is not None:
+            asyncio.run_coroutine_threadsafe(self.discovery.start(), self.loop).result()
+        if self.autoconnect:
+            #Mi ricollego in background ai peer contattati nell'ultima settimana, senza segnalare quelli non raggiungibili.
+            for entry in self.address_book.recent(RECENT_PEERS_AGE):
+                asyncio.run_coroutine_threadsafe(self.open_peer(entry["host"], entry["port"], quiet=True), self.loop)
+        return self
+
+    #Chiude listener e connessioni nel loop asyncio, poi ferma il loop.
+    def stop(self):
+        try:
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result(timeout=2)
+        except Exception as e:
+            self.metrics.error("chiusura", e) #In chiusura non blocco per errori o timeout: il processo sta terminando.
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.history is not None:
+            self.history.close() #Scrive su disco gli ultimi messaggi dello storico.
+
+    #Consegna un evento a chi usa il nodo: alla callback se presente, altrimenti nella coda.
+    def emit(self, *event):
+        if self.on_event is not None:
+            self.on_event(event)
+        else:
+            self.events.put(event)
+
+    #Crea il server asyncio che accetta le connessioni in entrata (eseguito nel thread del loop).
+    async def start_server(self):
+        #reuse_address permette il riutilizzo immediato della porta se il programma viene riavviato.
+        return await self.loop.create_server(lambda: PeerStream(self.accept_connection), self.host, self.port,
+                                             reuse_address=True, backlog=256)
+
+    #Gestisce una nuova connessione in entrata: invio l'handshake e ricevo i messaggi del peer (in un task separato).
+    def accept_connection(self, stream):
+        addr = stream.get_extra_info("peername")[:2] #Indirizzo IP e porta del peer.
+        self.metrics.count("connections.accepted")
+        self.spawn(self.run_peer(stream, addr))
+
+    #Avvia (da qualsiasi thread) la connessione a un peer nel loop asyncio; restituisce un future
+    #che si completa quando la connessione è stabilita (o fallita), mentre la ricezione prosegue in background.
+    def connect(self, ip, port):
+        return asyncio.run_coroutine_threadsafe(self.open_peer(ip, port), self.loop)
+
+    #Stabilisce una connessione a un peer e inizia la ricezione dei messaggi; restituisce True se la connessione è riuscita.
+    #Con quiet un fallimento non viene notificato come errore (tentativi automatici di riconnessione).
+    async def open_peer(self, ip, port, quiet=False):
+        if (ip, port) in self.listen_addrs.values():
+            return True #Connessione già attiva verso questo peer: la riuso invece di aprirne un'altra.
+        try:
+            _, writer = await self.loop.create_connection(PeerStream, ip, port) #Provo a connettermi al peer specificato.
+        except OSError as e:
+            #La connessione è fallita: l'errore viene notificato come evento.
+            self.metrics.count("connections.failed")
+            if not quiet:
+                self.emit("error", f"Formato non valido o connessione fallita: {e}")
+            return False
+        self.metrics.count("connections.opened")
+        self.dialed.add(writer)
+        #Segnalo con un messaggio di sistema che la connessione è riuscita.
+        self.emit("message", f"Connesso a {ip}:{port}", "system", "")
+        #La ricezione dei messaggi continua in un task separato, tenuto in self.tasks finché è attivo.
+        self.spawn(self.run_peer(writer, (ip, port)))
+        return True
+
+    #Avvia un task nel loop, tenendone un riferimento forte (in self.tasks) finché è attivo.
+    def spawn(self, coro):
+        task = self.loop.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    #Ripristina in background una connessione caduta, con backoff esponenziale e jitter: l'attesa prima di ogni tentativo
+    #è casuale tra 0 e RECONNECT_BASE_DELAY * 2^tentativo (al massimo RECONNECT_MAX_DELAY), così dopo una breve
+    #interruzione la connessione torna in meno di un secondo e i peer di una rete non si riconnettono tutti insieme.
+    async def reconnect(self, host, port, name):
+        try:
+            for attempt in range(RECONNECT_ATTEMPTS):
+                await asyncio.sleep(random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** attempt)))
+                if self.stopping or (host, port) in self.listen_addrs.values():
+                    return #Nodo in chiusura, oppure il peer si è già ricollegato.
+                self.metrics.count("connections.reconnect_attempts")
+                if await self.open_peer(host, port, quiet=True):
+                    self.metrics.count("connections.reconnected")
+                    return
+            self.emit("message", f"[INFO] Impossibile ricollegarsi a '{name}' ({host}:{port}).", "system", "")
+        finally:
+            self.reconnecting.pop((host, port), None)
+    #Esegue l'handshake cifrato di una nuova connessione e restituisce la sessione. Chi ha aperto la connessione parla
+    #per primo e, se ha un ticket valido di questo peer, chiede di riprendere la sessione precedente (handshake ridotto).
+    async def secure(self, writer):
+        started = time.perf_counter()
+        if writer in self.dialed:
+            ticket = self.tickets.pop(self.peers[writer], None) #I ticket si usano una volta sola.
+            if ticket is not None and ticket[3] < time.time():
+                ticket = None
+            handshake = Handshake(self.identity, ticket and ticket[:3])
+            writer.write(handshake.initiate())
+            session = handshake.complete(await self.read_handshake(writer))
+        else:
+            payload = await self.read_handshake(writer)
+            ticket_id = json.loads(payload).get("ticket")
+            ticket = self.issued_tickets.pop(bytes.fromhex(ticket_id), None) if ticket_id else None
+            if ticket is not None and ticket[2] < time.time():
+                ticket = None
+            reply, session = Handshake(self.identity).respond(payload, ticket and ticket[:2])
+            writer.write(reply)
+        self.metrics.count("handshakes.resumed" if session.resumed else "handshakes.full")
+        self.metrics.observe("handshake", time.perf_counter() - started)
+        return session
+
+    #Attende il frame di handshake del peer e ne restituisce il payload; i frame successivi restano nel buffer.
+    async def read_handshake(self, stream):
+        while True:
+            for ftype, flags, payload in stream.buffer.frames():
+                if ftype != FRAME_HANDSHAKE:
+                    raise ProtocolError("Il peer non usa la cifratura")
+                return payload
+            if not await stream.receive():
+                raise ConnectionError("Connessione chiusa durante l'handshake")
+
+    #Emette un ticket per riprendere la sessione indicata e restituisce il frame che lo consegna al peer.
+    def issue_ticket(self, session):
+        ticket_id = os.urandom(16)
+        self.issued_tickets[ticket_id] = (session.resumption, session.peer_public, time.time() + TICKET_LIFETIME)
+        if len(self.issued_tickets) > MAX_TICKETS:
+            self.issued_tickets.popitem(last=False) #Dimentico il ticket più vecchio.
+        return encode_control(FRAME_TICKET, id=ticket_id.hex(), lifetime=TICKET_LIFETIME)
+
+    #Invia al peer il frame di handshake con il mio username e la porta di ascolto.
+    #Nell'handshake comunico anche l'IP con cui vedo il peer: come un server STUN, permette al peer di conoscere
+    #il proprio indirizzo pubblico senza interrogare servizi esterni.
+    async def send_hello(self, writer):
+        observed = (writer.get_extra_info("peername") or ("",))[0]
+        await self.outboxes[writer].put(encode_control(FRAME_HELLO, username=self.username, port=self.port,
+                                                      node=self.node_id.hex(), observed=observed, codecs=list(CODECS),
+                                                      rooms=self.room_list()))
+
+    #Scopre in background (in un thread separato) gli indirizzi locale e pubblico del nodo e li notifica come eventi.
+    def discover_addresses(self, service=IP_SERVICE, cache=ADDRESS_CACHE, ttl=ADDRESS_TTL):
+        def run():
+            self.emit("address", "local", local_address())
+            ip = public_address(service, cache, ttl)
+            #Se un peer ha già comunicato l'IP pubblico osservato, la risposta del servizio è superflua.
+            if ip is not None or self.observed_ip is None:
+                self.emit("address", "public", ip)
+        threading.Thread(target=run, daemon=True).start()
+
+    #Invia (da qualsiasi thread) un messaggio di chat ai peer iscritti alla stanza; restituisce il messaggio completo,
+    #o None (con un evento "error") se il testo supera MAX_MESSAGE_SIZE.
+    #Con la politica "block", se ci sono già queue_limit invii in attesa dei peer lenti, send() attende che uno si concluda.
+    #msg_id (16 byte, None = casuale) permette a chi invia di riconoscere il messaggio negli eventi "delivery".
+    def send(self, content, room=DEFAULT_ROOM, msg_id=None):
+        full_msg = f"{self.username}: {content}"  #Prepara il messaggio completo da inviare.
+        text = full_msg.encode()
+        if len(text) > MAX_MESSAGE_SIZE:
+            self.emit("error", f"Messaggio troppo grande ({len(text)} byte, massimo {MAX_MESSAGE_SIZE}): invialo come file.")
+            return None
+        msg_id = msg_id or os.urandom(16) #ID univoco del messaggio, per riconoscerne i duplicati nella rete.
+        #Senza gossip il TTL è 0: i peer consegnano il messaggio ma non lo inoltrano.
+        ttl = self.ttl if self.gossip else 0
+        #Codifico il frame una sola volta e lo invio a tutti i peer connessi dal thread del loop.
+        frame = encode_chat(msg_id, self.node_id, ttl, room_id(room), text)
+        if self.publishing is not None:
+            self.publishing.acquire()
+        future = asyncio.run_coroutine_threadsafe(self.publish(msg_id, frame, time.perf_counter(), room_id(room)), self.loop)
+        if self.publishing is not None:
+            future.add_done_callback(lambda future: self.publishing.release())
+        self.record("", full_msg, "own", room)
+        return full_msg
+
+    #Salva un messaggio nello storico persistente (se attivo), separando il mittente dal contenuto.
+    def record(self, peer, msg, tag, room=DEFAULT_ROOM):
+        if self.history is not None:
+            sender, _, body = msg.partition(": ")
+            self.history.add(peer, sender, tag, body, room=room)
+
+    #Registra come già visto un messaggio generato da questo nodo e lo invia ai peer iscritti alla stanza (eseguito nel thread del loop).
+    #started è l'istante (perf_counter) della chiamata a send(), per misurare la latenza fino all'accodamento a tutti i peer.
+    async def publish(self, msg_id, frame, started=None, room=None):
+        self.seen.add(msg_id) #Così le copie che tornano indietro tramite altri peer vengono scartate.
+        if self.store is not None:
+            await self.deliver(msg_id, frame[FRAME_HEADER.size:], room or room_id(DEFAULT_ROOM))
+        else:
+            await self.broadcast(frame, self.room_peers(room or room_id(DEFAULT_ROOM)))
+        self.metrics.count("messages.sent")
+        if started is not None:
+            self.metrics.observe("send.latency", time.perf_counter() - started)
+
+    #Salva un messaggio nella coda persistente per tutti i destinatari iscritti alla stanza e lo invia subito a quelli
+    #collegati che non sono rimasti indietro; gli altri lo riceveranno dal database, in ordine, appena possibile.
+    async def deliver(self, msg_id, payload, room):
+        seq, nodes, evicted = self.store.enqueue(msg_id, room, payload, self.node_id)
+        if evicted:
+            self.emit("delivery", "evicted", evicted)
+        if seq is None:
+            self.emit("delivery", "unsent", [msg_id]) #Nessun peer conosciuto è iscritto alla stanza.
+            return
+        self.schedule_commit()
+        variants = {} #Payload da inviare per codec (flag e dati): la compressione avviene una sola volta per codec.
+        for node in nodes:
+            conn = self.delivery_conns.get(node)
+            state = self.deliveries.get(conn)
+            if state is None:
+                continue #Destinatario offline: il messaggio resta su disco.
+            if state["behind"] or len(state["ready"]) + len(state["inflight"]) >= DELIVERY_WINDOW:
+                #Finestra piena: da qui in poi i messaggi per questo peer vengono letti dal database.
+                state["behind"] = True
+                state["ready"].clear()
+            else:
+                codec = self.codecs.get(conn)
+                if codec not in variants:
+                    variants[codec] = self.compressors[codec].compress(payload) if codec is not None else (0, payload)
+                state["ready"].append((seq, *variants[codec]))
+            self.wake(conn)
+
+    #Avvia l'invio dei messaggi in attesa verso un peer, se non è già in corso: c'è un solo task di invio per peer,
+    #che invia anche i messaggi accodati mentre è attivo.
+    def wake(self, conn):
+        state = self.deliveries.get(conn)
+        if state is not None and not state["busy"]:
+            state["busy"] = True
+            self.spawn(self.pump(conn, state))
+
+    #Invia a un peer, in ordine, i messaggi in attesa: prima quelli appena accodati, poi (se è rimasto indietro, ad esempio
+    #dopo una riconnessione) quelli letti dal database a blocchi, senza mai superare DELIVERY_WINDOW messaggi non confermati.
+    #Prima di ogni frame attende che la coda in uscita abbia posto, così nessun frame viene scartato per coda piena.
+    async def pump(self, conn, state):
+        try:
+            outbox = self.outboxes[conn]
+            while len(state["inflight"]) < DELIVERY_WINDOW:
+                await outbox.wait_space()
+                if not state["ready"]:
+                    if not state["behind"]:
+                        break
+                    limit = DELIVERY_WINDOW - len(state["inflight"])
+                    rows = self.store.fetch(state["node"], state["cursor"], limit)
+                    state["behind"] = len(rows) == limit
+                    compressor = self.compressors.get(self.codecs.get(conn))
+                    for seq, payload in rows:
+                        state["ready"].append((seq, *compressor.compress(payload)) if compressor else (seq, 0, payload))
+                    if not rows:
+                        break
+                    continue
+                seq, flags, payload = state["ready"].popleft()
+                if seq <= state["cursor"]:
+                    continue #Già inviato (letto dal database mentre veniva anche accodato).
+                frame = encode_frame(FRAME_DELIVER, DELIVER_HEADER.pack(state["cursor"], seq) + payload, flags)
+                state["inflight"].append(seq)
+                state["cursor"] = seq
+                if not await outbox.put(frame):
+                    return #Connessione chiusa: i messaggi non confermati verranno reinviati alla riconnessione.
+                if state["timer"] is None:
+                    state["timer"] = self.loop.call_later(DELIVERY_TIMEOUT, self.retransmit, conn)
+        finally:
+            state["busy"] = False
+
+    #Riparte dal messaggio successivo a seq: quelli inviati e non confermati verranno reinviati (go-back-N).
+    def rewind(self, conn, state, seq):
+        self.metrics.count("delivery.retransmissions")
+        state["cursor"] = seq
+        state["inflight"].clear()
+        state["ready"].clear()
+        state["behind"] = True
+        if state["timer"] is not None:
+            state["timer"].cancel()
+            state["timer"] = None
+        self.wake(conn)
+
+    #Nessun ACK per DELIVERY_TIMEOUT secondi (frame o ACK persi): reinvio dall'ultimo messaggio confermato.
+    def retransmit(self, conn):
+        state = self.deliveries.get(conn)
+        if state is not None:
+            state["timer"] = None
+            if state["inflight"]:
+                self.rewind(conn, state, self.store.recipients[state["node"]]["acked"])
+
+    #Gestisce l'ACK cumulativo di un peer: i messaggi fino a seq sono consegnati e si liberano posti nella finestra.
+    #Con gap il peer segnala che gli manca il messaggio successivo a seq: l'invio riparte da lì (go-back-N).
+    def acknowledge(self, conn, seq, gap):
+        state = self.deliveries.get(conn)
+        if state is None:
+            return
+        while state["inflight"] and state["inflight"][0] <= seq:
+            state["inflight"].popleft()
+        delivered, evicted = self.store.ack(state["node"], seq)
+        if delivered:
+            self.metrics.count("delivery.delivered", len(delivered))
+            self.emit("delivery", "delivered", delivered)
+        if evicted:
+            self.emit("delivery", "evicted", evicted)
+        self.schedule_commit()
+        if gap:
+            self.rewind(conn, state, seq)
+            return
+        if seq > state["cursor"]:
+            state["cursor"] = seq #Confermati anche messaggi inviati su una connessione precedente.
+        #Il timeout riparte da ogni ACK, finché restano messaggi non confermati.
+        if state["timer"] is not None:
+            state["timer"].cancel()
+            state["timer"] = None
+        if state["inflight"]:
+            state["timer"] = self.loop.call_later(DELIVERY_TIMEOUT, self.retransmit, conn)
+        self.wake(conn)
+
+    #Riceve un messaggio da confermare: lo consegna come un messaggio di chat solo se è il successivo dell'ultimo ricevuto
+    #dallo stesso nodo, scarta i duplicati (ad esempio reinviati dopo una riconnessione) e programma l'ACK.
+    async def receive_delivery(self, conn, payload):
+        sender = self.node_ids.get(conn)
+        if sender is None:
+            raise ProtocolError("Messaggio ricevuto prima dell'handshake")
+        previous, seq = DELIVER_HEADER.unpack_from(payload)
+        last = self.received_seqs.get(sender, 0)
+        if seq <= last:
+            self.metrics.count("delivery.duplicates")
+        elif previous > last:
+            #Manca almeno un messaggio: scarto i successivi e chiedo il reinvio una sola volta (fino al prossimo messaggio in ordine).
+            if sender in self.delivery_gaps:
+                return
+            self.metrics.count("delivery.gaps")
+            self.delivery_gaps.add(sender)
+            self.schedule_ack(conn, gap=True)
+            return
+        else:
+            self.received_seqs[sender] = seq
+            self.delivery_gaps.discard(sender)
+            await self.handle_frame(conn, FRAME_CHAT, 0, payload[DELIVER_HEADER.size:])
+        self.schedule_ack(conn)
+
+    #Programma l'invio di un ACK al peer: ne parte uno solo, dopo DELIVERY_ACK_DELAY secondi, per tutti i messaggi arrivati nel frattempo.
+    def schedule_ack(self, conn, gap=False):
+        if conn not in self.acks_due:
+            self.spawn(self.send_ack(conn))
+        self.acks_due[conn] = self.acks_due.get(conn, False) or gap
+
+    #Invia l'ACK cumulativo con l'ultimo numero di sequenza ricevuto dal peer, dopo averlo salvato su disco
+    #(così un messaggio confermato non viene mai accettato di nuovo dopo un riavvio).
+    async def send_ack(self, conn):
+        await asyncio.sleep(DELIVERY_ACK_DELAY)
+        gap = self.acks_due.pop(conn, False)
+        sender = self.node_ids.get(conn)
+        outbox = self.outboxes.get(conn)
+        if sender is None or outbox is None:
+            return
+        seq = self.received_seqs.get(sender, 0)
+        if self.store is not None:
+            self.store.set_received(sender, seq)
+            self.commit_store()
+        await outbox.put(encode_control(FRAME_ACK, seq=seq, gap=gap))
+
+    #Programma il salvataggio della rubrica su disco: un solo task scrive, e raccoglie in un'unica scrittura gli
+    #aggiornamenti arrivati nel frattempo (ad esempio da molti handshake contemporanei).
+    def schedule_save(self):
+        self.address_book_dirty = True
+        if self.save_task is None:
+            self.save_task = self.spawn(self.save_address_book())
+
+    #Salva la rubrica finché ci sono modifiche; un errore di scrittura viene registrato, senza toccare le connessioni.
+    async def save_address_book(self):
+        try:
+            while self.address_book_dirty:
+                await asyncio.sleep(ADDRESS_BOOK_SAVE_DELAY)
+                self.address_book_dirty = False
+                try:
+                    await self.loop.run_in_executor(None, self.address_book.save, dict(self.address_book.peers))
+                except OSError as e:
+                    self.metrics.error("rubrica", e)
+        finally:
+            self.save_task = None
+
+    #Programma la scrittura su disco della coda persistente: le modifiche di DELIVERY_COMMIT_DELAY secondi finiscono
+    #in un'unica transazione.
+    def schedule_commit(self):
+        if self.commit_handle is None:
+            self.commit_handle = self.loop.call_later(DELIVERY_COMMIT_DELAY, self.commit_store)
+
+    #Scrive su disco le modifiche alla coda persistente.
+    def commit_store(self):
+        if self.commit_handle is not None:
+            self.commit_handle.cancel()
+            self.commit_handle = None
+        try:
+            self.store.commit()
+        except sqlite3.Error as e:
+            self.metrics.error("coda dei messaggi", e)
+
+    #Accoda un frame già codificato per le connessioni indicate, o per tutte (eseguito nel thread del loop).
+    #Lo stesso oggetto frame è condiviso da tutte le code: la codifica, e la compressione con ciascun codec negoziato,
+    #avvengono una sola volta per broadcast. Si comprimono solo i frame di chat: gli altri il destinatario non li decomprime.
+    async def broadcast(self, frame, targets=None):
+        variants = {None: frame} #Frame da inviare per codec.
+        compress = frame[1] == FRAME_CHAT
+        for writer in list(self.peers) if targets is None else targets:
+            outbox = self.outboxes.get(writer)
+            if outbox is not None:
+                codec = self.codecs.get(writer) if compress else None
+                if codec not in variants:
+                    variants[codec] = self.compressors[codec].encode(frame)
+                await outbox.put(variants[codec])
+
+    #Connessioni dei peer iscritti a una stanza (o a tutte), dall'indice degli iscritti: nessuna scansione di tutti i peer.
+    #Restituisce una copia, perché l'indice può cambiare mentre l'invio attende le code dei peer.
+    def room_peers(self, room):
+        peers = self.subscribers.get(room, set())
+        everything = self.subscribers.get(None)
+        return list(peers | everything if everything else peers)
+
+    #Entra (da qualsiasi thread) in una stanza: da quel momento i peer inviano al nodo anche i suoi messaggi.
+    def join(self, room):
+        asyncio.run_coroutine_threadsafe(self.subscribe([room], []), self.loop).result()
+
+    #Esce (da qualsiasi thread) da una stanza: i peer smettono di inviare al nodo i suoi messaggi.
+    def leave(self, room):
+        asyncio.run_coroutine_threadsafe(self.subscribe([], [room]), self.loop).result()
+
+    #Aggiorna le stanze del nodo e comunica le variazioni a tutti i peer (eseguito nel thread del loop).
+    async def subscribe(self, join, leave):
+        for name in join:
+            if name == ALL_ROOMS:
+                self.all_rooms = True
+            else:
+                self.rooms[room_id(name)] = self.room_names[room_id(name)] = name
+        for name in leave:
+            if name == ALL_ROOMS:
+                self.all_rooms = False
+            else:
+                self.rooms.pop(room_id(name), None)
+        await self.broadcast(encode_control(FRAME_SUBSCRIBE, join=list(join), leave=list(leave)))
+
+    #Nomi delle stanze del nodo, come annunciati ai peer.
+    def room_list(self):
+        return list(self.rooms.values()) + ([ALL_ROOMS] if self.all_rooms else [])
+
+    #Aggiorna l'indice degli iscritti con le stanze in cui un peer entra o da cui esce.
+    def update_subscriptions(self, conn, join=(), leave=()):
+        rooms = self.peer_rooms.setdefault(conn, set())
+        for name in join:
+            room = None if name == ALL_ROOMS else room_id(name)
+            if room is not None:
+                self.room_names.setdefault(room, name)
+            rooms.add(room)
+            self.subscribers.setdefault(room, set()).add(conn)
+        for name in leave:
+            room = None if name == ALL_ROOMS else room_id(name)
+            rooms.discard(room)
+            self.unsubscribe(conn, room)
+
+    #Toglie un peer dagli iscritti di una stanza (e la stanza dall'indice quando resta senza iscritti).
+    def unsubscribe(self, conn, room):
+        peers = self.subscribers.get(room)
+        if peers is not None:
+            peers.discard(conn)
+            if not peers:
+                del self.subscribers[room]
+
+    #Restituisce (da qualsiasi thread) le statistiche della coda in uscita di ogni peer connesso, per nome.
+    def queue_stats(self):
+        return asyncio.run_coroutine_threadsafe(self.collect_queue_stats(), self.loop).result()
+
+    #Raccoglie le statistiche delle code in uscita (eseguito nel thread del loop).
+    async def collect_queue_stats(self):
+        return {self.peer_name(writer): outbox.stats() for writer, outbox in self.outboxes.items()}
+
+    #Restituisce (da qualsiasi thread) tutte le statistiche del nodo: metriche, peer e profiler.
+    def stats(self):
+        return asyncio.run_coroutine_threadsafe(self.collect_stats(), self.loop).result()
+
+    #Raccoglie tutte le statistiche del nodo (eseguito nel thread del loop).
+    async def collect_stats(self):
+        stats = self.metrics.snapshot()
+        stats["peers"] = {self.peer_name(writer): dict(outbox.stats(), bytes_in=self.bytes_in.get(writer, 0))
+                          for writer, outbox in self.outboxes.items()}
+        stats["compression"] = {name: compressor.stats() for name, compressor in self.compressors.items()}
+        stats["rooms"] = {self.room_names.get(room, ALL_ROOMS if room is None else room.hex()): len(peers)
+                          for room, peers in self.subscribers.items()}
+        if self.discovery is not None:
+            stats["discovery"] = self.discovery.stats()
+        if self.store is not None:
+            stats["delivery"] = dict(self.store.stats(), in_flight={self.peer_name(conn): len(state["inflight"])
+                                                                    for conn, state in self.deliveries.items()})
+        stats["profiler"] = self.profiler.top()
+        return stats
+
+    #Avvia l'endpoint delle statistiche (solo su localhost) e il salvataggio periodico, se richiesti (eseguito nel thread del loop).
+    async def start_stats(self):
+        if self.stats_port is not None:
+            self.stats_server = await asyncio.start_server(self.serve_stats, "127.0.0.1", self.stats_port, reuse_address=True)
+            #Aggiorno la porta effettiva, come per il listener (utile se era 0).
+            self.stats_port = self.stats_server.sockets[0].getsockname()[1]
+        if self.stats_file:
+            self.stats_task = self.loop.create_task(self.dump_stats())
+
+    #Endpoint HTTP minimo delle statistiche: GET / restituisce le statistiche in JSON,
+    #GET /profile/start e /profile/stop attivano e disattivano il profiler a campionamento.
+    async def serve_stats(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), timeout=5)
+            path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+            if path == "/profile/start":
+                self.profiler.start()
+            elif path == "/profile/stop":
+                self.profiler.stop()
+            body = json.dumps(await self.collect_stats(), indent=2).encode()
+            writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError, UnicodeDecodeError) as e:
+            self.metrics.error("statistiche", e)
+        writer.close()
+
+    #Salva periodicamente le statistiche in JSON su stats_file (scrittura su file temporaneo e rinomina, in un thread).
+    async def dump_stats(self):
+        def write(data):
+            with open(self.stats_file + ".tmp", "w") as file:
+                file.write(data)
+            os.replace(self.stats_file + ".tmp", self.stats_file)
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            try:
+                await self.loop.run_in_executor(None, write, json.dumps(await self.collect_stats(), indent=2))
+            except OSError as e:
+                self.metrics.error("salvataggio statistiche", e)
+
+    #Invia (da qualsiasi thread) un file al peer con il nome indicato, o a tutti i peer se peer è None.
+    #Il file viene letto e spedito a chunk, senza caricarlo in memoria; restituisce un future.
+    def send_file(self, path, peer=None):
+        return asyncio.run_coroutine_threadsafe(self.offer_file(path, peer), self.loop)
+
+    #Registra il trasferimento per ogni destinatario e propone il file (eseguito nel thread del loop).
+    async def offer_file(self, path, peer=None):
+        for conn in list(self.peers):
+            if conn not in self.node_ids or (peer is not None and self.peer_name(conn) != peer):
+                continue #Serve l'identificativo del nodo (ricevuto con l'handshake) per poter riprendere il file.
+            try:
+                transfer = OutgoingFile(path, self.node_ids[conn])
+            except OSError as e:
+                self.emit("error", f"Impossibile inviare il file: {e}")
+                return
+            self.outgoing[(transfer.transfer_id, transfer.target)] = transfer
+            await self.send_offer(conn, transfer)
+            self.emit("message", f"📁 Invio di '{transfer.name}' a {self.peer_name(conn)}...", "system", "")
+
+    #Propone un file a un peer: il peer risponde con l'offset da cui iniziare (o riprendere) l'invio.
+    async def send_offer(self, conn, transfer):
+        await self.outboxes[conn].put(encode_control(FRAME_FILE_OFFER, id=transfer.transfer_id.hex(),
+                                                     name=transfer.name, size=transfer.size))
+
+    #Invia i chunk del file da offset in poi, leggendoli dal disco in un thread separato.
+    async def stream_file(self, conn, transfer, offset):
+        outbox = self.outboxes.get(conn)
+        if outbox is None:
+            return
+        with open(transfer.path, "rb") as file:
+            while offset < transfer.size:
+                size = min(FILE_CHUNK_SIZE, transfer.size - offset)
+                frame = await self.loop.run_in_executor(None, read_file_chunk, file, transfer.transfer_id, offset, size)
+                if frame is None or not await outbox.put_bulk(frame):
+                    return #File finito prima del previsto o connessione chiusa: l'invio riprenderà alla riconnessione.
+                offset += len(frame) - FRAME_HEADER.size - FILE_CHUNK_HEADER.size
+
+    #Risponde (da qualsiasi thread) a un file proposto da un peer, indicato dall'ID dell'evento "file_offer"; restituisce un future.
+    def answer_file(self, transfer_id, accept):
+        return asyncio.run_coroutine_threadsafe(self.reply_offer(transfer_id, accept), self.loop)
+
+    #Accetta o rifiuta un file proposto (eseguito nel thread del loop). Se il peer si è disconnesso nel frattempo,
+    #l'accettazione resta valida per quando ripropone il file.
+    async def reply_offer(self, transfer_id, accept):
+        offer = self.file_offers.pop(transfer_id, None)
+        if offer is None:
+            self.emit("error", f"Nessun file proposto con ID {transfer_id}.")
+            return
+        conn, node, name, size = offer
+        if accept and conn in self.outboxes:
+            await self.accept_file(conn, node, bytes.fromhex(transfer_id), name, size)
+        elif accept:
+            self.accepted_files.add((node, bytes.fromhex(transfer_id)))
+        elif conn in self.outboxes:
+            await self.outboxes[conn].put(encode_control(FRAME_FILE_DECLINE, id=transfer_id))
+
+    #Apre (o riapre) il file parziale di un trasferimento accettato e risponde con l'offset da cui iniziare o riprendere.
+    async def accept_file(self, conn, node, transfer_id, name, size):
+        self.accepted_files.add((node, transfer_id))
+        previous = self.incoming.pop((conn, transfer_id), None)
+        if previous is not None:
+            previous.file.close()
+        transfer = IncomingFile(conn, transfer_id, name, size, self.download_dir)
+        self.incoming[(conn, transfer_id)] = transfer
+        if transfer.offset:
+            self.emit("message", f"📁 Ripresa di '{transfer.name}' da {self.peer_name(conn)} ({transfer.offset}/{transfer.size} byte)...", "system", "")
+        else:
+            self.emit("message", f"📁 Ricezione di '{transfer.name}' da {self.peer_name(conn)} ({transfer.size} byte)...", "system", "")
+        await self.outboxes[conn].put(encode_control(FRAME_FILE_ACCEPT, id=transfer_id.hex(), offset=transfer.offset))
+        if transfer.offset >= transfer.size:
+            #Il file era già stato ricevuto per intero prima della disconnessione.
+            await self.receive_chunk(conn, FILE_CHUNK_HEADER.pack(transfer_id, transfer.offset, zlib.crc32(b"")))
+
+    #Riceve un chunk di file: lo verifica col CRC32 e lo scrive su disco, nell'ordine atteso.
+    async def receive_chunk(self, conn, payload):
+        transfer_id, offset, crc = FILE_CHUNK_HEADER.unpack_from(payload)
+        transfer = self.incoming.get((conn, transfer_id))
+        if transfer is None or offset != transfer.offset:
+            return #Chunk di un trasferimento sconosciuto o fuori sequenza (ad esempio dopo una richiesta di reinvio).
+        data = memoryview(payload)[FILE_CHUNK_HEADER.size:]
+        if zlib.crc32(data) != crc:
+            #Chunk corrotto: chiedo al mittente di ripartire dall'ultimo offset verificato.
+            await self.outboxes[conn].put(encode_control(FRAME_FILE_ACCEPT, id=transfer_id.hex(), offset=transfer.offset))
+            return
+        await self.loop.run_in_executor(None, transfer.file.write, data)
+        transfer.offset += len(data)
+        now = time.monotonic()
+        if transfer.offset >= transfer.size:
+            #File completo: lo rinomino e confermo la ricezione al mittente.
+            del self.incoming[(conn, transfer_id)]
+            path = await self.loop.run_in_executor(None, transfer.finish)
+            await self.outboxes[conn].put(encode_control(FRAME_FILE_DONE, id=transfer_id.hex()))
+            self.emit("transfer", transfer.name, transfer.size, transfer.size)
+            self.emit("message", f"📁 File ricevuto da {self.peer_name(conn)}: {path}", "system", "")
+        elif now - getattr(transfer, "reported", 0) >= 0.5:
+            #Avanzamento notificato al massimo due volte al secondo.
+            transfer.reported = now
+            self.emit("transfer", transfer.name, transfer.offset, transfer.size)
+
+    #Inoltra un messaggio ricevuto ad altri peer, con TTL decrementato (modalità gossip).
+    async def forward(self, source, msg_id, origin, ttl, room, text):
+        #Tra gli iscritti alla stanza escludo il peer da cui è arrivato il messaggio e il nodo che lo ha generato.
+        targets = [conn for conn in self.room_peers(room) if conn is not source and self.node_ids.get(conn) != origin]
+        if self.fanout is not None and len(targets) > self.fanout:
+            targets = random.sample(targets, self.fanout)
+        if targets:
+            await self.broadcast(encode_chat(msg_id, origin, ttl - 1, room, text), targets)
+            self.metrics.count("messages.forwarded")
+
+    #Registra la connessione (PeerStream), invia l'handshake e riceve i messaggi di un singolo peer fino alla disconnessione.
+    async def run_peer(self, writer, addr):
+        self.peers[writer] = addr #Salvo la connessione nel dizionario peers.
+        #Creo la coda in uscita del peer e il task che la svuota sul socket; la coda viene registrata (e riceve frame)
+        #solo dopo l'eventuale handshake cifrato, così nessun frame parte in chiaro.
+        outbox = Outbox(writer, self.queue_limit, self.backpressure, self.metrics)
+        sender = self.loop.create_task(outbox.run())
+        buffer = writer.buffer #Buffer di ricezione, in cui il transport scrive direttamente i byte letti dal socket.
+        sealed = FrameBuffer() #Buffer dei frame decifrati (solo per le connessioni cifrate).
+        self.bytes_in[writer] = 0
+        metrics = self.metrics
+        #Loop per ricevere messaggi dal peer finché la connessione resta aperta.
+        try:
+            if self.identity is not None:
+                outbox.session = await asyncio.wait_for(self.secure(writer), HANDSHAKE_TIMEOUT)
+            self.outboxes[writer] = outbox
+            if outbox.session is not None and writer not in self.dialed:
+                await outbox.put(self.issue_ticket(outbox.session))
+            await self.send_hello(writer) #Invio al peer il mio utente e porta con il frame di handshake.
+            self.post_peer_list()
+            while True:
+                #Una lettura può contenere più frame oppure solo una parte di uno: elaboro solo quelli completi
+                #(anche quelli arrivati insieme all'handshake).
+                for ftype, flags, payload in buffer.frames():
+                    if outbox.session is None:
+                        await self.process_frame(writer, ftype, flags, payload)
+                    elif ftype == FRAME_SEALED:
+                        sealed.feed(outbox.session.open(payload))
+                        for inner_type, inner_flags, inner_payload in sealed.frames():
+                            await self.process_frame(writer, inner_type, inner_flags, inner_payload)
+                    else:
+                        raise ProtocolError("Frame in chiaro su una connessione cifrata")
+                received = await writer.receive()
+                if not received:
+                    break #Se la connessione si chiude (nessun dato), esce dal loop.
+                metrics.count("bytes.in", received)
+                self.bytes_in[writer] += received
+        except (OSError, ProtocolError, ValueError, KeyError, struct.error, zlib.error, asyncio.TimeoutError) as e:
+            #In caso di errore di rete o di protocollo (anche frame malformati), registro l'errore e chiudo la connessione.
+            metrics.error(f"ricezione da {self.peer_name(writer)}", e)
+            if self.identity is not None and outbox.session is None:
+                #Handshake cifrato fallito: lo segnalo come errore invece che come disconnessione di un peer.
+                self.emit("error", f"Connessione cifrata con {addr[0]}:{addr[1]} non riuscita: {e}")
+                self.replaced.add(writer)
+        metrics.count("connections.closed")
+        #Quando il peer si disconnette, segnalo l'evento con un messaggio informativo
+        #(non per le connessioni duplicate chiuse di proposito: il peer resta collegato con l'altra).
+        name = self.usernames.get(writer, "sconosciuto")
+        replaced = writer in self.replaced
+        self.replaced.discard(writer)
+        if not replaced:
+            if self.backpressure == "disconnect" and outbox.closed and outbox.dropped:
+                self.emit("message", f"[INFO] Il peer '{name}' è stato disconnesso perché troppo lento.", "system", "")
+            else:
+                self.emit("message", f"[INFO] Il peer '{name}' si è disconnesso.", "system", "")
+        #I file in arrivo da questo peer restano su disco come ".part", pronti per essere ripresi.
+        for key in [key for key in self.incoming if key[0] is writer]:
+            self.incoming.pop(key).file.close()
+        #Chiudo la coda in uscita (sbloccando eventuali mittenti e trasferimenti in attesa) e la connessione.
+        outbox.close()
+        sender.cancel()
+        self.outboxes.pop(writer, None)
+        writer.close()
+        #Rimuove la connessione dai dizionari peers ed usernames.
+        self.peers.pop(writer, None)
+        self.usernames.pop(writer, None)
+        self.node_ids.pop(writer, None)
+        self.bytes_in.pop(writer, None)
+        self.codecs.pop(writer, None)
+        for room in self.peer_rooms.pop(writer, ()):
+            self.unsubscribe(writer, room)
+        #I messaggi non confermati restano nella coda persistente: verranno reinviati alla riconnessione.
+        state = self.deliveries.pop(writer, None)
+        if state is not None:
+            if state["timer"] is not None:
+                state["timer"].cancel()
+            if self.delivery_conns.get(state["node"]) is writer:
+                del self.delivery_conns[state["node"]]
+        self.acks_due.pop(writer, None)
+        listen_addr = self.listen_addrs.pop(writer, None)
+        dialed = writer in self.dialed
+        self.dialed.discard(writer)
+        self.post_peer_list() #Aggiorna la lista dei peer connessi.
+        #Se la connessione l'avevo aperta io (e non è un duplicato né una chiusura voluta), la ripristino in background.
+        #Solo chi ha aperto la connessione la ripristina, così i due peer non si ricollegano a vicenda.
+        if dialed and listen_addr is not None and not replaced and not self.stopping and listen_addr not in self.reconnecting:
+            self.reconnecting[listen_addr] = self.loop.create_task(self.reconnect(*listen_addr, name))
+
+    #Elabora un frame ricevuto (decomprimendolo se necessario) e ne misura il tempo di gestione.
+    async def process_frame(self, conn, ftype, flags, payload):
+        started = time.perf_counter()
+        if flags and ftype == FRAME_CHAT:
+            payload = self.decompress(flags, payload)
+        elif flags and ftype == FRAME_DELIVER:
+            #Dei messaggi da confermare è compresso solo il payload di chat, non il numero di sequenza.
+            payload = bytes(payload[:DELIVER_HEADER.size]) + self.decompress(flags, payload[DELIVER_HEADER.size:])
+        await self.handle_frame(conn, ftype, flags, payload)
+        self.metrics.observe("frame.handle", time.perf_counter() - started)
+
+    #Gestisce un frame completo ricevuto da un peer in base al suo tipo.
+    async def handle_frame(self, conn, ftype, flags, payload):
+        if ftype == FRAME_HELLO:
+            info = json.loads(payload)
+            node_id = bytes.fromhex(info["node"])
+            if not self.accept_hello(conn, node_id):
+                return #Connessione verso me stesso o duplicata: chiusa.
+            #Indirizzo di ascolto del peer: quello a cui mi sono connesso, oppure il suo IP con la porta annunciata.
+            host = self.peers[conn][0]
+            session = self.outboxes[conn].session
+            identity = fingerprint(session.peer_public) if session is not None else None
+            if not self.check_identity(conn, host, info["port"], node_id, info["username"], identity):
+                return #Il peer si presenta con una chiave diversa da quella già nota: connessione chiusa.
+            #Handshake: salvo "username@porta" del peer nel dizionario usernames.
+            self.usernames[conn] = f"{info['username']}@{info['port']}"
+            self.node_ids[conn] = node_id
+            self.listen_addrs[conn] = (host, info["port"])
+            #Scelgo il primo dei miei codec (in ordine di preferenza) che anche il peer sa decomprimere.
+            supported = set(info.get("codecs", ()))
+            codec = next((name for name in self.compressors if name in supported), None)
+            if codec is not None:
+                self.codecs[conn] = codec
+            self.update_subscriptions(conn, info.get("rooms", ()))
+            if self.store is not None:
+                #Il peer diventa (o torna) un destinatario: riprendo l'invio dall'ultimo messaggio che ha confermato.
+                self.store.remember(node_id, self.usernames[conn], self.peer_rooms[conn])
+                self.delivery_conns[node_id] = conn
+                self.deliveries[conn] = {"node": node_id, "cursor": self.store.recipients[node_id]["acked"], "inflight": deque(),
+                                         "ready": deque(), "behind": True, "busy": False, "timer": None}
+                self.schedule_commit()
+                self.wake(conn)
+            self.received_seqs.setdefault(node_id, self.store.received(node_id) if self.store is not None else 0)
+            self.delivery_gaps.discard(node_id)
+            self.address_book.update(host, info["port"], info["username"], node_id, identity)
+            self.schedule_save()
+            self.post_peer_list() #Aggiorna la lista dei peer connessi.
+            if session is not None:
+                resumed = ", sessione ripresa" if session.resumed else ""
+                self.emit("message", f"🔒 Connessione cifrata con {self.peer_name(conn)} (impronta {identity}{resumed})", "system", "")
+            #IP con cui il peer mi vede: se è pubblico (peer fuori dalla rete locale) lo notifico come mio IP pubblico.
+            try:
+                observed = ipaddress.ip_address(info.get("observed", ""))
+            except ValueError:
+                observed = None
+            if observed is not None and observed.is_global and str(observed) != self.observed_ip:
+                self.observed_ip = str(observed)
+                self.emit("address", "public", self.observed_ip)
+            #Se avevo file in sospeso verso questo nodo, li ripropongo: l'invio riprende da dove si era interrotto.
+            for transfer in list(self.outgoing.values()):
+                if transfer.target == self.node_ids[conn]:
+                    await self.send_offer(conn, transfer)
+        elif ftype == FRAME_SUBSCRIBE:
+            info = json.loads(payload)
+            self.update_subscriptions(conn, info.get("join", ()), info.get("leave", ()))
+            if conn in self.deliveries:
+                self.store.set_rooms(self.node_ids[conn], self.peer_rooms[conn])
+                self.schedule_commit()
+        elif ftype == FRAME_ACK:
+            info = json.loads(payload)
+            self.acknowledge(conn, int(info["seq"]), bool(info.get("gap")))
+        elif ftype == FRAME_DELIVER:
+            await self.receive_delivery(conn, payload)
+        elif ftype == FRAME_TICKET:
+            #Ticket per riprendere la sessione: vale solo sulle connessioni cifrate aperte da me (sono io a riconnettermi).
+            session = self.outboxes[conn].session
+            if session is not None and conn in self.dialed:
+                info = json.loads(payload)
+                expires = time.time() + min(int(info["lifetime"]), TICKET_LIFETIME)
+                self.tickets[self.peers[conn]] = (bytes.fromhex(info["id"]), session.resumption, session.peer_public, expires)
+        elif ftype == FRAME_FILE_OFFER:
+            #Proposta di un file: lo accetto solo se l'utente lo ha già accettato (è una ripresa) o se la politica lo consente.
+            info = json.loads(payload)
+            transfer_id = bytes.fromhex(info["id"])
+            name = os.path.basename(info["name"]) or "file"
+            size = int(info["size"])
+            node = self.node_ids.get(conn)
+            if not 0 <= size <= self.max_file_size:
+                self.emit("message", f"📁 Rifiutato '{name}' da {self.peer_name(conn)}: {size} byte, oltre il limite di {self.max_file_size}.", "system", "")
+                await self.outboxes[conn].put(encode_control(FRAME_FILE_DECLINE, id=info["id"]))
+            elif (node, transfer_id) in self.accepted_files or self.accept_files == "all":
+                await self.accept_file(conn, node, transfer_id, name, size)
+            elif info["id"] in self.file_offers:
+                #Proposta ripetuta (ad esempio dopo una riconnessione) mentre l'utente deve ancora rispondere.
+                self.file_offers[info["id"]] = (conn, node, name, size)
+            elif self.accept_files == "none" or len(self.file_offers) >= MAX_FILE_OFFERS:
+                self.emit("message", f"📁 Rifiutato '{name}' da {self.peer_name(conn)}: ricezione dei file disattivata.", "system", "")
+                await self.outboxes[conn].put(encode_control(FRAME_FILE_DECLINE, id=info["id"]))
+            else:
+                self.file_offers[info["id"]] = (conn, node, name, size)
+                self.emit("file_offer", self.peer_name(conn), info["id"], name, size)
+        elif ftype == FRAME_FILE_ACCEPT:
+            #Il destinatario indica da dove inviare: (ri)avvio il task di invio da quell'offset.
+            info = json.loads(payload)
+            transfer = self.outgoing.get((bytes.fromhex(info["id"]), self.node_ids.get(conn)))
+            if transfer is not None:
+                if transfer.task is not None:
+                    transfer.task.cancel()
+                transfer.task = self.loop.create_task(self.stream_file(conn, transfer, int(info["offset"])))
+        elif ftype == FRAME_FILE_DECLINE:
+            #Il destinatario non vuole il file: rinuncio all'invio (anche alle prossime riconnessioni).
+            info = json.loads(payload)
+            transfer = self.outgoing.pop((bytes.fromhex(info["id"]), self.node_ids.get(conn)), None)
+            if transfer is not None:
+                if transfer.task is not None:
+                    transfer.task.cancel()
+                self.emit("message", f"📁 File '{transfer.name}' rifiutato da {self.peer_name(conn)}.", "system", "")
+        elif ftype == FRAME_FILE_DONE:
+            #Il destinatario ha ricevuto e verificato il file: il trasferimento è concluso.
+            info = json.loads(payload)
+            transfer = self.outgoing.pop((bytes.fromhex(info["id"]), self.node_ids.get(conn)), None)
+            if transfer is not None:
+                self.emit("message", f"📁 File '{transfer.name}' consegnato a {self.peer_name(conn)}.", "system", "")
+        elif ftype == FRAME_FILE_CHUNK:
+            await self.receive_chunk(conn, payload)
+        elif ftype == FRAME_CHAT:
+            msg_id, origin, ttl, room, text = decode_chat(payload)
+            if not self.seen.add(msg_id):
+                self.metrics.count("messages.duplicate")
+                return #Duplicato già consegnato (e già inoltrato): lo scarto.
+            if room not in self.rooms and not self.all_rooms:
+                self.metrics.count("messages.unsubscribed")
+                return #Stanza da cui sono appena uscito: il peer non aveva ancora ricevuto la mia uscita.
+            self.metrics.count("messages.received")
+            #Messaggi normali vengono notificati con il timestamp di ricezione e la stanza.
+            timestamp = datetime.now().strftime("%H:%M")
+            msg = text.decode()
+            name = self.room_names.get(room, room.hex())
+            self.emit("message", msg, "peer", timestamp, name)
+            self.record(self.peer_name(conn), msg, "peer", name)
+            if self.gossip and ttl > 0:
+                await self.forward(conn, msg_id, origin, ttl, room, text)
+        #I tipi di frame sconosciuti vengono ignorati, per compatibilità con versioni future.
+
+    #Controlla l'handshake di una connessione: chiude le connessioni verso me stesso e, se con lo stesso nodo esiste già
+    #un'altra connessione (ad esempio aperta da entrambi i lati insieme), ne tiene una sola. Entrambi i nodi tengono quella
+    #aperta dal nodo con l'identificativo minore, così la scelta è la stessa ai due capi. Restituisce False se conn è stata chiusa.
+    def accept_hello(self, conn, node_id):
+        if node_id == self.node_id:
+            self.replaced.add(conn)
+            conn.close()
+            return False
+        existing = next((other for other, other_id in self.node_ids.items() if other_id == node_id and other is not conn), None)
+        if existing is None:
+            return True
+        self.metrics.count("connections.duplicate")
+        keep_dialed = self.node_id < node_id #Tengo la connessione aperta da me se il mio identificativo è il minore.
+        if (conn in self.dialed) == (existing in self.dialed) or (conn in self.dialed) != keep_dialed:
+            drop = conn #Stessa direzione (connessione ripetuta) o direzione da scartare: chiudo la nuova.
+        else:
+            drop = existing
+        self.replaced.add(drop)
+        drop.close()
+        return drop is not conn
+
+    #Verifica l'identità di un peer (trust on first use): se nella rubrica lo stesso indirizzo di ascolto o lo stesso ID del
+    #nodo hanno un'impronta diversa, qualunque sia il nome utente annunciato, la connessione viene chiusa e segnalata come
+    #possibile intercettazione. Restituisce False se chiusa.
+    def check_identity(self, conn, host, port, node_id, username, identity):
+        conflict = self.address_book.conflict(host, port, node_id, identity) if identity is not None else None
+        if conflict is None:
+            return True
+        address, known = conflict
+        self.metrics.count("connections.identity_mismatch")
+        self.emit("error", f"⚠️ '{username}' ({host}:{port}) si presenta con la chiave {identity}, ma nella rubrica {address} "
+                           f"('{known['username']}') ha la chiave {known['identity']}: connessione rifiutata. Se il peer ha "
+                           f"davvero una nuova chiave, riavvia con --forget-peer {address}.")
+        self.replaced.add(conn)
+        conn.close()
+        return False
+
+    #Decomprime il payload di un frame compresso con il codec indicato dal byte flags.
+    def decompress(self, codec_id, payload):
+        codec = next((codec for codec in CODECS.values() if codec.codec_id == codec_id), None)
+        if codec is None:
+            raise ProtocolError(f"Codec di compressione sconosciuto: {codec_id}")
+        started = time.perf_counter()
+        payload = codec.decompress(payload, MAX_FRAME_SIZE)
+        self.metrics.observe("decompress", time.perf_counter() - started)
+        return payload
+
+    #Nome con cui mostrare un peer: nome utente se noto, altrimenti IP:PORTA.
+    def peer_name(self, conn):
+        addr = self.peers.get(conn, ("?", "?"))
+        return self.usernames.get(conn, f"{addr[0]}:{addr[1]}")
+
+    #Notifica una copia della lista dei peer connessi (nome utente o IP:PORTA).
+    def post_peer_list(self):
+        self.emit("peers", [self.peer_name(conn) for conn in self.peers])
+
+    #Chiude il server e tutte le connessioni ai peer (eseguito nel thread del loop).
+    async def shutdown(self):
+        self.stopping = True
+        for task in list(self.reconnecting.values()):
+            task.cancel()
+        self.listener.close() #Chiude il socket in ascolto.
+        if self.stats_server is not None:
+            self.stats_server.close()
+        if self.stats_task is not None:
+            self.stats_task.cancel()
+        self.profiler.stop()
+        if self.discovery is not None:
+            self.discovery.close()
+        for writer in list(self.peers):
+            writer.close()
+        #Attendo che i task ancora attivi (ricezione e code in uscita) terminino, così il loop si ferma pulito.
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        if tasks:
+            await asyncio.wait(tasks, timeout=1)
+        if self.address_book_dirty:
+            #Salvataggio ancora in attesa: lo eseguo subito, prima che il loop si fermi.
+            if self.save_task is not None:
+                self.save_task.cancel()
+            self.address_book_dirty = False
+            try:
+                self.address_book.save(dict(self.address_book.peers))
+            except OSError as e:
+                self.metrics.error("rubrica", e)
+        if self.store is not None:
+            self.commit_store()
+            self.store.close()
+
 #Classe per creare i tooltip informativi al passaggio del mouse su un widget.
 class ToolTip:
     #Inizializza il tooltip associandolo a un widget e al testo da mostrare.
@@ -42,8 +2594,8 @@ class ToolTip:
 
     #Fa vedere il tooltip quando il mouse entra nel widget.
     def show_tip(self, event=None):
-        #Se il tooltip è già mostrato, non faccio nulla.
-        if self.tip_window:
+        #Se il tooltip è già mostrato (o non c'è testo da mostrare), non faccio nulla.
+        if self.tip_window or not self.text:
             return
         #Ottengo la posizione attuale del cursore nel widget (bbox "insert" tipicamente per Text o Entry).
         x, y, _, _ = self.widget.bbox("insert")
@@ -77,45 +2629,383 @@ class ToolTip:
             self.tip_window.destroy()
         self.tip_window = None #Resetto la variabile della finestra del tooltip a None.
 
+#Restituisce colori e allineamento di un messaggio in base al suo tipo e al tema.
+def bubble_style(tag, is_dark):
+    if tag == "own":
+        #Messaggi inviati dall'utente stesso (allineati a destra, colori chiari o scuri).
+        bg_color = "#dcf8c6" if not is_dark else "#3a5f3a"
+        fg_color = "black" if not is_dark else "white"
+        anchor = "e"   #Ancora (allineamento) a destra.
+        justify = "right" #Giustifica il testo a destra.
+    elif tag == "system":
+        #Messaggi di sistema (allineati al centro, con colore diverso per evidenziare).
+        bg_color = "#ffe0b2" if not is_dark else "#44475a"
+        fg_color = "black" if not is_dark else "white"
+        anchor = "center"
+        justify = "center"
+    else:
+        #Messaggi ricevuti dai peer (allineati a siistra).
+        bg_color = "#ffffff" if not is_dark else "#2c2f33"
+        fg_color = "black" if not is_dark else "white"
+        anchor = "w"
+        justify = "left"
+    return bg_color, fg_color, anchor, justify
+
+#Divide un messaggio in header (ad esempio l'username) e corpo, nel formato usato dalla vista dei messaggi.
+def split_message(msg, tag, timestamp):
+    parts = msg.split(": ", 1)
+    if tag == "system" or len(parts) < 2:
+        #I messaggi di sistema (o senza mittente) vengono mostrati per intero.
+        return msg, "", tag, timestamp
+    return parts[0], parts[1], tag, timestamp
+
+#Storico completo dei messaggi della sessione in forma compatta, indipendente dai widget:
+#testi in liste parallele (stringhe ripetute condivise con sys.intern), tipo e posizioni verticali in array numerici.
+class MessageHistory:
+    TAGS = ("peer", "own", "system") #Tipi di messaggio, salvati come indice in un array di byte.
+
+    #Inizializza lo storico vuoto.
+    def __init__(self):
+        self.headers = [] #Mittente del messaggio (o testo completo per i messaggi di sistema).
+        self.bodies = [] #Corpo del messaggio.
+        self.timestamps = [] #Orario del messaggio.
+        self.tags = array("B") #Tipo del messaggio (indice in TAGS).
+        self.offsets = array("L", [0]) #Posizioni verticali cumulative: il messaggio i occupa [offsets[i], offsets[i+1]).
+
+    #Numero di messaggi nello storico.
+    def __len__(self):
+        return len(self.tags)
+
+    #Aggiunge un messaggio in coda, con l'altezza in pixel che occuperà nella vista.
+    def append(self, header, body, tag, timestamp, height):
+        self.headers.append(sys.intern(header))
+        self.bodies.append(body)
+        self.timestamps.append(sys.intern(timestamp))
+        self.tags.append(self.TAGS.index(tag))
+        self.offsets.append(self.offsets[-1] + height)
+
+    #Aggiunge in testa un gruppo di messaggi (header, corpo, tipo, timestamp, altezza) più vecchi di quelli presenti.
+    def prepend(self, messages):
+        added = array("L", [0])
+        for header, body, tag, timestamp, height in messages:
+            added.append(added[-1] + height)
+        shift = added.pop()
+        self.headers[:0] = [sys.intern(message[0]) for message in messages]
+        self.bodies[:0] = [message[1] for message in messages]
+        self.timestamps[:0] = [sys.intern(message[3]) for message in messages]
+        self.tags[:0] = array("B", [self.TAGS.index(message[2]) for message in messages])
+        self.offsets = added + array("L", (offset + shift for offset in self.offsets))
+        return shift
+
+    #Corregge l'altezza del messaggio i-esimo spostando i messaggi successivi; restituisce la differenza rispetto a prima.
+    def resize(self, index, height):
+        delta = height - (self.offsets[index + 1] - self.offsets[index])
+        if delta:
+            self.offsets[index + 1:] = array("L", (offset + delta for offset in self.offsets[index + 1:]))
+        return delta
+
+    #Restituisce il messaggio i-esimo come tupla (header, corpo, tipo, timestamp).
+    def get(self, index):
+        return self.headers[index], self.bodies[index], self.TAGS[self.tags[index]], self.timestamps[index]
+
+    #Altezza totale in pixel di tutti i messaggi.
+    def height(self):
+        return self.offsets[-1]
+
+    #Indice del messaggio che si trova alla posizione verticale y (ricerca binaria).
+    def index_at(self, y):
+        return max(0, bisect.bisect_right(self.offsets, y) - 1)
+
+#Widget riutilizzabile che mostra un singolo messaggio nella vista virtualizzata.
+class MessageBubble:
+    #Crea il contenitore e le label del messaggio, inserendolo nel canvas della vista.
+    def __init__(self, view):
+        #"Bubble" contenitore con background colorato.
+        self.frame = tk.Frame(view.canvas, padx=10, pady=6, bd=0, relief="flat", highlightthickness=0)
+        #Label per il nome del mittente, in grassetto.
+        self.sender = tk.Label(self.frame, font=view.fonts["sender"])
+        #Label per il contenuto del messaggio.
+        self.content = tk.Label(self.frame, wraplength=view.WRAP_LENGTH)
+        #Label per il timestamp del messaggio, in grigio chiaro.
+        self.timestamp = tk.Label(self.frame, font=view.fonts["timestamp"], fg="lightgray")
+        #Tooltip che mostra il timestamp completo al passaggio del mouse (il testo cambia a ogni riuso).
+        self.tooltip = ToolTip(self.frame, "")
+        #Elemento del canvas che contiene il bubble: viene spostato invece di ricreare i widget.
+        self.item = view.canvas.create_window(0, 0, window=self.frame, anchor="nw", state="hidden")
+        #Anche la rotella del mouse sopra il messaggio deve scorrere la vista.
+        for widget in (self.frame, self.sender, self.content, self.timestamp):
+            view.bind_wheel(widget)
+
+    #Configura il bubble per mostrare un messaggio dello storico.
+    def show(self, view, header, body, tag, timestamp):
+        bg_color, fg_color, anchor, justify = bubble_style(tag, view.theme == "dark")
+        labels = (self.sender, self.content, self.timestamp)
+        for label in labels:
+            label.pack_forget()
+        if tag != "system":
+            #Per messaggi normali, mittente, contenuto e orario allineati in base al tipo.
+            self.frame.configure(bg=bg_color, padx=10, pady=6)
+            self.sender.configure(text=header, fg=fg_color, bg=bg_color, anchor=anchor, justify=justify)
+            self.content.configure(text=body, font=view.fonts["body"], fg=fg_color, bg=bg_color, justify=justify)
+            self.timestamp.configure(text=timestamp, bg=bg_color, anchor=anchor, justify=justify)
+            for label in labels:
+                label.pack(anchor=anchor)
+            self.tooltip.text = f"Inviato alle {timestamp}"
+        else:
+            #Per messaggi di sistema, solo il testo, centrato, in corsivo.
+            self.frame.configure(bg=bg_color, padx=10, pady=5)
+            self.content.configure(text=header, font=view.fonts["system"], fg=fg_color, bg=bg_color, justify="center")
+            self.content.pack(anchor="center")
+            self.tooltip.text = ""
+
+#Vista dei messaggi virtualizzata: solo i messaggi visibili (più un margine) hanno dei widget,
+#che vengono riciclati durante lo scorrimento; lo storico completo resta in MessageHistory.
+class VirtualMessageView:
+    WRAP_LENGTH = 600 #Larghezza massima del testo dei messaggi prima di andare a capo.
+    MARGIN = 300 #Pixel renderizzati sopra e sotto l'area visibile, per uno scorrimento fluido.
+    SCROLL_STEP = 40 #Pixel di scorrimento per ogni scatto della rotella del mouse.
+    SPACING = 4 #Spazio verticale sopra e sotto ogni messaggio.
+
+    #Crea il canvas, la scrollbar e i font usati per misurare i messaggi.
+    def __init__(self, parent, theme="light", metrics=None):
+        self.theme = theme #Tema corrente (light/dark), usato per i colori dei messaggi.
+        self.metrics = metrics #Metriche in cui registrare i tempi di rendering (None = nessuna misura).
+        self.history = MessageHistory() #Storico completo dei messaggi.
+        self.top = 0 #Posizione verticale (in pixel) del bordo superiore dell'area visibile.
+        self.visible = {} #Bubble attualmente mostrati, indicizzati per indice del messaggio.
+        self.free = [] #Bubble nascosti, pronti per essere riutilizzati.
+        self.on_top = None #Funzione chiamata quando l'utente scorre fino all'inizio (per caricare i messaggi più vecchi).
+        self.first = 0 #Messaggi inseriti in testa con prepend(): di tanto sono aumentati gli indici dei messaggi già presenti.
+        #Font dei messaggi: servono sia alle label sia a stimare l'altezza di ogni messaggio.
+        self.fonts = {
+            "sender": tkfont.Font(family="Segoe UI", size=9, weight="bold"),
+            "body": tkfont.Font(family="Segoe UI", size=11),
+            "timestamp": tkfont.Font(family="Segoe UI", size=8),
+            "system": tkfont.Font(family="Segoe UI", size=10, slant="italic"),
+        }
+        #Numero di caratteri che stanno sicuramente in una riga per ogni font (misurato sul carattere "W").
+        self.short_line = {name: self.WRAP_LENGTH // font.measure("W") for name, font in self.fonts.items()}
+        #Contenitore con angoli arrotondati, canvas per i messaggi e scrollbar verticale.
+        self.frame = ctk.CTkFrame(parent, corner_radius=10, fg_color=self.background())
+        self.frame.rowconfigure(0, weight=1)
+        self.frame.columnconfigure(0, weight=1)
+        self.canvas = tk.Canvas(self.frame, height=550, bg=self.background(), bd=0, highlightthickness=0)
+        self.canvas.grid(row=0, column=0, sticky="nsew", padx=(5, 0), pady=5)
+        self.scrollbar = ctk.CTkScrollbar(self.frame, command=self.on_scrollbar)
+        self.scrollbar.grid(row=0, column=1, sticky="ns", pady=5)
+        #Ridisegno i messaggi visibili quando cambia la dimensione dell'area.
+        self.canvas.bind("<Configure>", lambda event: self.render())
+        self.bind_wheel(self.canvas)
+
+    #Posiziona la vista nella griglia del widget padre.
+    def grid(self, **kwargs):
+        self.frame.grid(**kwargs)
+
+    #Nasconde la vista (i messaggi restano nello storico della vista, pronti per quando torna visibile).
+    def grid_remove(self):
+        self.frame.grid_remove()
+
+    #Distrugge i widget della vista.
+    def destroy(self):
+        self.frame.destroy()
+
+    #Colore di sfondo dell'area messaggi in base al tema.
+    def background(self):
+        return "#f5f5f5" if self.theme == "light" else "#1e1e1e"
+
+    #Collega la rotella del mouse di un widget allo scorrimento della vista (Windows/macOS e Linux).
+    def bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", self.on_wheel)
+        widget.bind("<Button-4>", self.on_wheel)
+        widget.bind("<Button-5>", self.on_wheel)
+
+    #Stima l'altezza in pixel di un messaggio, con gli stessi font e la stessa larghezza usati per mostrarlo.
+    def measure(self, header, body, tag):
+        if tag == "system":
+            lines = self.count_lines(header, "system")
+            return lines * self.fonts["system"].metrics("linespace") + 2 * 5 + 4 + 2 * self.SPACING
+        lines = self.count_lines(body, "body")
+        return (self.fonts["sender"].metrics("linespace") + lines * self.fonts["body"].metrics("linespace")
+                + self.fonts["timestamp"].metrics("linespace") + 2 * 6 + 3 * 4 + 2 * self.SPACING)
+
+    #Conta le righe occupate da un testo, scritto con il font indicato, dopo il ritorno a capo automatico.
+    def count_lines(self, text, font_name):
+        font = self.fonts[font_name]
+        lines = 0
+        for line in text.split("\n"):
+            #Le righe ASCII abbastanza corte da stare in una riga anche con il carattere più largo non vengono misurate.
+            if len(line) <= self.short_line[font_name] and line.isascii():
+                lines += 1
+            else:
+                lines += max(1, -(-font.measure(line) // self.WRAP_LENGTH))
+        return lines
+
+    #Aggiunge un messaggio allo storico e ridisegna la vista.
+    def append(self, header, body, tag, timestamp):
+        self.extend([(header, body, tag, timestamp)])
+
+    #Aggiunge in un solo passaggio un gruppo di messaggi (header, corpo, tipo, timestamp), ridisegnando una volta sola;
+    #se la vista era in fondo (o tra i messaggi ce n'è uno proprio) resta in fondo.
+    def extend(self, messages):
+        follow = self.top + self.canvas.winfo_height() >= self.history.height() - self.SPACING
+        for header, body, tag, timestamp in messages:
+            self.history.append(header, body, tag, timestamp, self.measure(header, body, tag))
+            follow = follow or tag == "own"
+        if follow:
+            self.top = self.history.height() #Il valore viene limitato al fondo in render().
+        self.render()
+
+    #Inserisce in testa un gruppo di messaggi più vecchi, mantenendo fermi i messaggi che l'utente sta guardando.
+    def prepend(self, messages):
+        shift = self.history.prepend([(header, body, tag, timestamp, self.measure(header, body, tag))
+                                      for header, body, tag, timestamp in messages])
+        #Gli indici dei bubble visibili aumentano del numero di messaggi inseriti, la posizione verticale dell'altezza aggiunta.
+        self.visible = {index + len(messages): bubble for index, bubble in self.visible.items()}
+        self.first += len(messages)
+        self.top += shift
+        self.render()
+
+    #Cambia il timestamp di un messaggio, indicato con la sua posizione al momento dell'aggiunta (senza i messaggi inseriti
+    #in testa dopo), e lo ridisegna se è visibile; l'altezza del messaggio non cambia.
+    def update_timestamp(self, position, timestamp):
+        index = position + self.first
+        self.history.timestamps[index] = sys.intern(timestamp)
+        bubble = self.visible.get(index)
+        if bubble is not None:
+            bubble.show(self, *self.history.get(index))
+
+    #Cambia il tema e ridisegna i messaggi visibili con i nuovi colori.
+    def set_theme(self, theme):
+        self.theme = theme
+        self.frame.configure(fg_color=self.background())
+        self.canvas.configure(bg=self.background())
+        self.release(list(self.visible))
+        self.render()
+
+    #Nasconde i bubble dei messaggi indicati e li rende disponibili per il riuso.
+    def release(self, indexes):
+        for index in indexes:
+            bubble = self.visible.pop(index)
+            self.canvas.itemconfigure(bubble.item, state="hidden")
+            self.free.append(bubble)
+
+    #Mostra i soli messaggi nell'area visibile (più il margine), riciclando i bubble già creati.
+    def render(self):
+        started = time.perf_counter()
+        width = self.canvas.winfo_width()
+        height = self.canvas.winfo_height()
+        total = self.history.height()
+        offsets = self.history.offsets
+        self.top = max(0, min(self.top, total - height))
+        if len(self.history):
+            first = self.history.index_at(self.top - self.MARGIN)
+            last = min(self.history.index_at(self.top + height + self.MARGIN), len(self.history) - 1)
+        else:
+            first, last = 0, -1
+        #Libero i bubble dei messaggi usciti dall'area da renderizzare.
+        self.release([index for index in self.visible if index < first or index > last])
+        shown = [] #Messaggi mostrati in questo passaggio, di cui verificare l'altezza stimata.
+        for index in range(first, last + 1):
+            bubble = self.visible.get(index)
+            if bubble is None:
+                #Riuso un bubble libero (o ne creo uno nuovo) per il messaggio appena entrato nell'area.
+                bubble = self.free.pop() if self.free else MessageBubble(self)
+                bubble.show(self, *self.history.get(index))
+                self.visible[index] = bubble
+                shown.append(index)
+            #Posiziono il bubble rispetto al bordo superiore dell'area visibile.
+            self.canvas.coords(bubble.item, 10, offsets[index] - self.top + self.SPACING)
+            self.canvas.itemconfigure(bubble.item, state="normal", width=max(1, width - 20),
+                                      height=offsets[index + 1] - offsets[index] - 2 * self.SPACING)
+        if shown and self.fit(shown):
+            self.render() #Altezze corrette: ridispongo i messaggi con le posizioni esatte.
+            return
+        #Aggiorno la scrollbar con la porzione di storico visibile.
+        if total > height:
+            self.scrollbar.set(self.top / total, (self.top + height) / total)
+        else:
+            self.scrollbar.set(0, 1)
+        if self.metrics is not None:
+            self.metrics.observe("ui.render", time.perf_counter() - started)
+
+    #Sostituisce l'altezza stimata dei messaggi appena mostrati con quella richiesta dai loro widget: le label vanno a capo
+    #tra le parole, e un messaggio può occupare più righe della stima (l'ultima verrebbe tagliata). I messaggi sopra l'area
+    #visibile spostano anche la vista, così i messaggi che l'utente sta guardando restano fermi; restituisce True se almeno
+    #un'altezza è cambiata. Ogni messaggio viene corretto al massimo una volta: dopo, l'altezza nello storico è quella esatta.
+    def fit(self, indexes):
+        self.canvas.update_idletasks() #Calcola la geometria dei bubble appena configurati.
+        at_bottom = self.top >= self.history.height() - self.canvas.winfo_height()
+        changed = False
+        for index in indexes:
+            above = self.history.offsets[index] < self.top
+            delta = self.history.resize(index, self.visible[index].frame.winfo_reqheight() + 2 * self.SPACING)
+            if delta:
+                changed = True
+                if above:
+                    self.top += delta
+        if changed and at_bottom:
+            self.top = self.history.height() #La vista era in fondo e ci resta (il valore viene limitato in render()).
+        return changed
+
+    #Scorre la vista fino alla posizione verticale y.
+    def scroll_to(self, y):
+        self.top = y
+        self.render()
+        if self.top == 0 and self.on_top is not None:
+            self.on_top() #Arrivato all'inizio: chiedo i messaggi più vecchi.
+
+    #Gestisce la rotella del mouse.
+    def on_wheel(self, event):
+        #Su Linux la rotella genera Button-4 (su) e Button-5 (giù), altrimenti il verso è in event.delta.
+        if event.num == 4 or getattr(event, "delta", 0) > 0:
+            self.scroll_to(self.top - self.SCROLL_STEP)
+        else:
+            self.scroll_to(self.top + self.SCROLL_STEP)
+
+    #Gestisce i comandi della scrollbar ("moveto" frazione oppure "scroll" n unità/pagine).
+    def on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(float(amount) * self.history.height())
+        else:
+            step = self.canvas.winfo_height() if unit == "pages" else self.SCROLL_STEP
+            self.scroll_to(self.top + int(amount) * step)
+
 #Classe principale che gestisce la chat P2P, l'interfaccia e le connessioni.
 class PeerToPeerChat:
-    #Inizializza socket, GUI, connessioni e layout iniziale.
-    def __init__(self, host='0.0.0.0', port=0):
-        self.peers = {} #Dizionario per memorizzare le connessioni socket verso i peer connessi.
-        self.usernames = {} #Dizionario per associare a ogni socket il nome utente del peer.
-        #Mostra una finestra di dialogo per chiedere all'utente il proprio nome (username).
-        self.username = simpledialog.askstring("Nome utente", "Inserisci il tuo username:")
+    ROOM_BACKLOG = 1000 #Messaggi conservati al massimo per ogni stanza non ancora aperta.
+    AWAITING_LIMIT = 10000 #Messaggi propri di cui si attende la conferma di consegna, al massimo (oltre, i più vecchi restano 🕓).
+    DELIVERY_MARKS = {"pending": "🕓", "delivered": "✓", "evicted": "✗", "unsent": "✗"} #Stato della consegna, dopo l'orario.
+    FRAME_INTERVAL = 16 #Millisecondi tra due cicli di elaborazione degli eventi di rete (circa 60 al secondo).
+    FRAME_BUDGET = 0.008 #Secondi massimi spesi a raccogliere eventi in un ciclo, per lasciare la GUI reattiva.
+
+    #Inizializza il nodo di rete, la GUI e il layout iniziale.
+    #ip_service e ip_cache_ttl configurano la ricerca dell'IP pubblico; con startup_probe la finestra stampa i tempi di avvio
+    #(istanti, come time.time(), in cui il nodo è in ascolto e la finestra è visibile) e si chiude (usato da benchmark.py).
+    def __init__(self, host='0.0.0.0', port=0, username=None, connect=(), ip_service=IP_SERVICE, ip_cache_ttl=ADDRESS_TTL,
+                 startup_probe=False, **node_options):
+        load_gui() #Carico i moduli grafici solo ora che serve la GUI.
+        #Se l'username non è passato da riga di comando, mostra una finestra di dialogo per chiederlo.
+        self.username = username or simpledialog.askstring("Nome utente", "Inserisci il tuo username:")
         if not self.username:
             #Se non viene inserito un nome, mostra un avviso e termina il proramma.
             messagebox.showwarning("Input mancante", "Nome utente obbligatorio.")
             exit(1)
 
-        self.host = host #Indirizzo IP su cui mettere in ascolto il server (di default imposto '0.0.0.0' per tutte le interfacce).
-        self.port = port #Porta su cui ascoltare (0 significa che il sistema deciderà automaticamente una porta disponibile).
+        #Il nodo headless gestisce tutta la parte di rete; la GUI ne consuma gli eventi dalla coda.
+        #Le opzioni aggiuntive (gossip, code in uscita, ...) vengono passate direttamente al nodo.
+        self.node = ChatNode(self.username, host, port, **node_options).start()
+        self.port = self.node.port #Porta effettiva su cui il nodo è in ascolto.
+        self.listening_at = time.time() #Istante in cui il nodo è in ascolto (per startup_probe).
+        #Connessioni iniziali indicate da riga di comando nel formato IP:PORTA.
+        for address in connect:
+            ip, peer_port = address.rsplit(":", 1)
+            self.node.connect(ip, int(peer_port))
 
-        #Creo un socket TCP IPv4 per accettare le connessioni in entrata.
-        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        #Permetto il riutilizzo immediato della porta se il programma viene riavviato.
-        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        #Associo il socket all'indirizzo IP e porta specificati.
-        self.listener.bind((host, port))
-        #Aggiorno la porta assegnata (utile se era 0 e il sistema ha assegnato una porta disponibile).
-        self.port = self.listener.getsockname()[1]
-        #Metto il socket in ascolto (in background) per nuove connessioni.
-        self.listener.listen()
-        #Avvio un thread in background per accettare nuove connessioni, senza bloccare la GUI.
-        threading.Thread(target=self.accept_connections, daemon=True).start()
-
-        #Provo a ottenere l'indirizzo IP locale della macchina.
-        try:
-            local_ip = socket.gethostbyname(socket.gethostname())
-        except:
-            local_ip = 'localhost'#Se fallisce, uso localhost come fallback.
-        #Provo a ottenere l'indirizzo IP pubblico usando un servizio web esterno (api ipify).
-        try:
-            external_ip = urllib.request.urlopen('https://api.ipify.org', timeout=5).read().decode('utf8')
-        except:
-            external_ip = 'N/D' #Se non riesco, segno come non disponibile.
+        #Gli indirizzi IP locale e pubblico vengono cercati in background: la finestra si apre subito
+        #e la label degli indirizzi si aggiorna quando arrivano (eventi "address").
+        self.local_ip = "…" #Indirizzo IP locale della macchina.
+        self.public_ip = "…" #Indirizzo IP pubblico (N/D se non disponibile).
+        self.node.discover_addresses(ip_service, ttl=ip_cache_ttl)
 
         self.theme = "light" #Tema di default per la GUI (light mode).
         ctk.set_appearance_mode(self.theme) #Applico il tema a customtkinter.
@@ -124,8 +3014,9 @@ class PeerToPeerChat:
         #Creo la finestra principale dell'app con customtkinter.
         self.root = ctk.CTk()
         self.copy_in_progress = False #Flag per evitare più copie di seguito negli appunti di testo.
-        #Imposto il titolo della finestra con username e porta in cui si è in ascolto.
-        self.root.title(f"Chat P2P - {self.username} (Porta: {self.port})")
+        #Imposto il titolo della finestra con username e porta in cui si è in ascolto (e il lucchetto se la chat è cifrata).
+        lock = " 🔒" if self.node.identity is not None else ""
+        self.root.title(f"Chat P2P - {self.username} (Porta: {self.port}){lock}")
         #Imposto la dimensione iniziale della finestra.
         self.root.geometry("800x900")
         #Configuro il colore di sfondo della finestra.
@@ -149,16 +3040,15 @@ class PeerToPeerChat:
         ip_frame.columnconfigure(0, weight=3) #Colonna 0 più larga (Info IP)
         ip_frame.columnconfigure(1, weight=1) #Colonna 1 (Bottone Copia IP)
         ip_frame.columnconfigure(2, weight=1) #Colonna 2 (Bottone Cambio Tema)
+        ip_frame.columnconfigure(3, weight=1) #Colonna 3 (Bottone Cerca)
 
-        #Preparo la stringa IP: porta locale per la copia negli appunti.
-        ip_info = f"{local_ip}:{self.port}"
         #Label che mostra l'indirizzo IP locale e pubblico.
-        self.ip_label = ctk.CTkLabel(ip_frame, text=f"📡 IP locale: {local_ip} | IP pubblico: {external_ip}", font=("Segoe UI", 12))
+        self.ip_label = ctk.CTkLabel(ip_frame, text=self.address_text(), font=("Segoe UI", 12))
         #Posiziono la label nella colonna 0 allineata a sinistra.
         self.ip_label.grid(row=0, column=0, sticky="w")
 
         #Bottone per copiare negli appunti l'indirizzo IP locale e porta.
-        self.copy_button = ctk.CTkButton(ip_frame, text="📋 Copia IP", command=lambda: self.copy_to_clipboard(ip_info), height=30)
+        self.copy_button = ctk.CTkButton(ip_frame, text="📋 Copia IP", command=lambda: self.copy_to_clipboard(f"{self.local_ip}:{self.port}"), height=30)
         #Posiziono il bottone nella colonna 1, allineato a destra con paddding orizzontale.
         self.copy_button.grid(row=0, column=1, sticky="e", padx=5)
 
@@ -167,33 +3057,50 @@ class PeerToPeerChat:
         #Posiziono il bottone nella colonna 2, allineato a destra con padding. 
         self.theme_button.grid(row=0, column=2, sticky="e", padx=5)
 
+        #Bottone per cercare nello storico dei messaggi (attivo solo se lo storico persistente è abilitato).
+        self.search_button = ctk.CTkButton(ip_frame, text="🔍 Cerca", command=self.search_history, height=30,
+                                           state="normal" if self.node.history is not None else "disabled")
+        #Posiziono il bottone nella colonna 3, allineato a destra con padding.
+        self.search_button.grid(row=0, column=3, sticky="e", padx=5)
+
         #Creo un frame principale per contenere i messaggi e la lista dei peer connessi, con angoli arrotondati.
         self.main_frame = ctk.CTkFrame(self.root, corner_radius=15)
         #Posiziono il frame in griglia alla riga 2, spanning su 3 colonne, con padding.
         self.main_frame.grid(row=2, column=0, columnspan=3, sticky="nsew", padx=15, pady=(0, 10))
         #Configuro righe e colonne del frame per ridimensionamento (più spazio ai messaggi).
-        self.main_frame.rowconfigure(0, weight=1)
+        self.main_frame.rowconfigure(1, weight=1)
         self.main_frame.columnconfigure(0, weight=4) #Colonna messaggi più larga.
         self.main_frame.columnconfigure(1, weight=1) #Colonna per la lista dei peer più stretta.
 
-        #Creo un frame scrollabile per contenere i messaggi, con angoli arrotondati e colore di sfondo in base al tema.
-        self.message_frame = ctk.CTkScrollableFrame(
-            self.main_frame,
-            corner_radius=10,
-            fg_color="#f5f5f5" if self.theme == "light" else "#1e1e1e",
-            height=550
-        )
-        #Posiziono il frame scrollabile dei messaggi nella griglia (riga 0, colonna 0),
-        #con opzioni sticky per espandersi in tutte le direzioni (nsew),
-        #con padding orizzontale e verticale per distanziarlo dagli altri elementi.
-        self.message_frame.grid(row=0, column=0, sticky="nsew", padx=(10, 15), pady=10)
+        #Sopra i messaggi, una scheda per ogni stanza (con i messaggi non letti) e i bottoni per entrare e uscire.
+        room_frame = ctk.CTkFrame(self.main_frame, fg_color="transparent")
+        room_frame.grid(row=0, column=0, sticky="ew", padx=(10, 15), pady=(10, 0))
+        room_frame.columnconfigure(0, weight=1)
+        self.room_button = ctk.CTkSegmentedButton(room_frame, command=self.switch_room_ui)
+        self.room_button.grid(row=0, column=0, sticky="w")
+        self.join_button = ctk.CTkButton(room_frame, text="➕ Stanza", width=90, command=self.join_room_ui)
+        self.join_button.grid(row=0, column=1, sticky="e", padx=(5, 0))
+        self.leave_button = ctk.CTkButton(room_frame, text="➖ Esci", width=70, command=self.leave_room_ui)
+        self.leave_button.grid(row=0, column=2, sticky="e", padx=(5, 0))
+
+        #Ogni stanza ha la sua vista virtualizzata dei messaggi (mostra solo quelli visibili, riciclando i widget),
+        #creata solo quando la stanza viene aperta: i messaggi delle stanze mai aperte restano in attesa, senza widget.
+        self.rooms = [name for name in self.node.room_list() if name != ALL_ROOMS] or [DEFAULT_ROOM] #Schede, in ordine.
+        self.views = {} #Vista dei messaggi di ogni stanza già aperta.
+        self.pending = {} #Messaggi arrivati nelle stanze non visibili, in attesa di essere mostrati.
+        self.oldest_ids = {} #ID del messaggio più vecchio caricato dallo storico per stanza (0 = niente da caricare).
+        self.room = None #Stanza visibile.
+        self.message_view = None #Vista della stanza visibile.
+        #Messaggi propri in attesa di conferma (solo con la coda persistente): stanza, vista, posizione e orario, per ID.
+        self.awaiting = OrderedDict()
+        self.show_room(self.rooms[0])
 
         #Creo una label sopra la lista dei peer connessi, con icona e testo,
         #allineata a sinistra (anchor="w") e font in grassetto dimensione 14.
         self.peer_list_label = ctk.CTkLabel(self.main_frame, text="👥 Peer connessi:", anchor="w", font=("Segoe UI", 14, "bold"))
-        #Posiziono la label nella griglia a riga 0, colonna 1, con sticky top e sinistra (new),
+        #Posiziono la label nella griglia a riga 0, colonna 1 (accanto alle schede e ai messaggi), con sticky top e sinistra (new),
         #con padding a sinistra e in alto per distanziarla.
-        self.peer_list_label.grid(row=0, column=1, sticky="new", padx=10, pady=(10, 0))
+        self.peer_list_label.grid(row=0, column=1, rowspan=2, sticky="new", padx=10, pady=(10, 0))
 
         #Creo una Listbox Tkinter standard per mostrare la lista dei peer connessi,
         #con colori di sfondo e testo adattati al tema (light/dark),
@@ -209,9 +3116,14 @@ class PeerToPeerChat:
             borderwidth=0,
             highlightthickness=0
         )
-        #Posiziono la listbox nella griglia a riga 0, colonna 1, con sticky in tutte le direzioni,
+        #Posiziono la listbox nella griglia a riga 0, colonna 1 (accanto alle schede e ai messaggi), con sticky in tutte le direzioni,
         #con padding per distanziarla dai bordi e dalla label sopra.
-        self.peer_listbox.grid(row=0, column=1, sticky="nsew", padx=10, pady=(40, 10))
+        self.peer_listbox.grid(row=0, column=1, rowspan=2, sticky="nsew", padx=10, pady=(40, 10))
+        #Sotto i peer connessi la lista mostra quelli scoperti in rete locale: con un doppio clic ci si collega.
+        self.peer_names = [] #Peer connessi mostrati nella lista.
+        self.lan_peers = [] #Peer scoperti in rete locale (nome utente, host, porta).
+        self.lan_rows = [] #Indirizzo dei peer scoperti mostrati nella lista, dopo quelli connessi.
+        self.peer_listbox.bind("<Double-Button-1>", self.connect_to_lan_peer)
 
         #Creo una textbox customtkinter per l'input del messaggio da inviare,
         #con altezza 60 pixel, angoli arrotondati, font e colore del testo/sfondo in base al tema,
@@ -267,70 +3179,107 @@ class PeerToPeerChat:
         #con sticky orizzontale e padding.
         self.connect_button.grid(row=6, column=0, columnspan=3, sticky="ew", padx=20, pady=(0, 10))
 
+        #Creo un bottone per inviare un file al peer selezionato nella lista (o a tutti se nessuno è selezionato).
+        self.file_button = ctk.CTkButton(self.root, text="📁 Invia file", command=self.send_file_ui, corner_radius=10)
+        #Posiziono il bottone sotto quello di connessione, spanning su 3 colonne.
+        self.file_button.grid(row=7, column=0, columnspan=3, sticky="ew", padx=20, pady=(0, 15))
+
         #Imposto la funzione di callback da chiamare quando l'utente chiude la finestra del programma,
         #per chiudere socket e pulire le risorse prima di uscire.
         self.root.protocol("WM_DELETE_WINDOW", self.close_app)
+        #Avvio il controllo periodico degli eventi di rete in arrivo dal thread asyncio.
+        self.root.after(self.FRAME_INTERVAL, self.process_events)
+        if startup_probe:
+            self.root.after_idle(self.report_startup)
         #Avvio il ciclo principale dell'interfaccia grafica (bloccante fino a chiusura).
         self.root.mainloop()
+    #Rende visibile la stanza indicata: nasconde la vista precedente, crea quella della stanza se è la prima volta
+    #(caricando l'ultima pagina dello storico) e le aggiunge i messaggi arrivati nel frattempo.
+    def show_room(self, room):
+        if self.message_view is not None:
+            self.message_view.grid_remove()
+        view = self.views.get(room)
+        if view is None:
+            view = self.views[room] = VirtualMessageView(self.main_frame, self.theme, self.node.metrics)
+            #Dallo storico persistente carico solo l'ultima pagina; le precedenti arrivano scorrendo verso l'alto.
+            self.oldest_ids[room] = 0
+            if self.node.history is not None:
+                rows = self.node.history.page(before=self.node.history.session_start, room=room)
+                if rows:
+                    self.oldest_ids[room] = rows[0][0]
+                    view.extend([history_message(row) for row in rows])
+                view.on_top = lambda: self.load_older(room)
+        #Posiziono la vista dei messaggi nella griglia (riga 1, colonna 0),
+        #con opzioni sticky per espandersi in tutte le direzioni (nsew) e padding per distanziarla dagli altri elementi.
+        view.grid(row=1, column=0, sticky="nsew", padx=(10, 15), pady=(5, 10))
+        pending = self.pending.pop(room, None)
+        if pending:
+            view.extend(pending)
+        self.room = room
+        self.message_view = view
+        self.update_room_tabs()
+
+    #Aggiorna le schede delle stanze, con il numero di messaggi non letti di quelle non visibili.
+    def update_room_tabs(self):
+        self.room_tabs = {} #Stanza di ogni etichetta delle schede.
+        for room in self.rooms:
+            unread = len(self.pending.get(room, ()))
+            self.room_tabs[f"{room} ({unread})" if unread else room] = room
+        self.room_button.configure(values=list(self.room_tabs))
+        self.room_button.set(self.room)
+        self.leave_button.configure(state="normal" if len(self.rooms) > 1 else "disabled")
+
+    #Clic su una scheda: mostra la stanza corrispondente.
+    def switch_room_ui(self, label):
+        self.show_room(self.room_tabs[label])
+
+    #Chiede il nome di una stanza, ci entra e la mostra.
+    def join_room_ui(self):
+        name = simpledialog.askstring("Stanza", "Nome della stanza in cui entrare:")
+        name = name.strip() if name else ""
+        if not name or name == ALL_ROOMS:
+            return
+        if name not in self.rooms:
+            self.node.join(name)
+            self.rooms.append(name)
+        self.show_room(name)
+
+    #Esce dalla stanza visibile e mostra la prima delle altre.
+    def leave_room_ui(self):
+        if len(self.rooms) < 2:
+            return #Resta sempre almeno una stanza.
+        room = self.room
+        self.node.leave(room)
+        self.rooms.remove(room)
+        self.pending.pop(room, None)
+        self.message_view = None
+        self.views.pop(room).destroy()
+        self.show_room(self.rooms[0])
+
     #Mostra un messaggio formattato nella finestra della chat.
     def display_message(self, msg, tag="peer", timestamp=""):
-        #Divide il messaggio in due parti: header (ad esempio l'username) e corpo del messaggio.
-        parts = msg.split(": ", 1)
-        header, body = (parts[0], parts[1]) if len(parts) > 1 else (msg, "")
-        is_dark = self.theme == "dark" #Controlla se il tema corrente è scuro.
-
-        #Imposta colori e allineamento in base al tipo di messaggio.
-        if tag == "own":
-            #Messaggi inviati dall'utente stesso (allineati a destra, colori chiari o scuri).
-            bg_color = "#dcf8c6" if not is_dark else "#3a5f3a"
-            fg_color = "black" if not is_dark else "white"
-            anchor = "e"   #Ancora (allineamento) a destra.
-            justify = "right" #Giustifica il testo a destra.
-        elif tag == "system":
-            #Messaggi di sistema (allineati al centro, con colore diverso per evidenziare).
-            bg_color = "#ffe0b2" if not is_dark else "#44475a"
-            fg_color = "black" if not is_dark else "white"
-            anchor = "center"
-            justify = "center"
-        else:
-            #Messaggi ricevuti dai peer (allineati a siistra).
-            bg_color = "#ffffff" if not is_dark else "#2c2f33"
-            fg_color = "black" if not is_dark else "white"
-            anchor = "w"
-            justify = "left"
+        #Aggiungo il messaggio allo storico: la vista crea o ricicla i widget solo se è visibile.
+        self.message_view.append(*split_message(msg, tag, timestamp))
 
-        if tag != "system":
-            #Per messaggi normali, creo un "bubble" contenitore con background colorato.
-            bubble = tk.Frame(self.message_frame, bg=bg_color, padx=10, pady=6, bd=0, relief="flat", highlightthickness=0)
-            #Label per il nome del mittente, in grassetto.
-            sender = tk.Label(bubble, text=header, font=("Segoe UI", 9, "bold"), fg=fg_color, bg=bg_color, anchor=anchor, justify=justify)
-            #Label per il contenuto del messaggio.
-            content = tk.Label(bubble, text=body, font=("Segoe UI", 11), fg=fg_color, bg=bg_color, wraplength=600, justify=justify)
-            #Label per il timestamp del messaggio, in grigio chiaro.
-            timestamp_label = tk.Label(bubble, text=timestamp, font=("Segoe UI", 8), fg="lightgray", bg=bg_color, anchor=anchor, justify=justify)
-            #Posiziono le label nel bubble, con allineamento definito.
-            sender.pack(anchor=anchor)
-            content.pack(anchor=anchor)
-            timestamp_label.pack(anchor=anchor)
-            #Posiziono il bubble nella finestra messaggi, con padding e fill orizzontale.
-            bubble.pack(anchor=anchor, padx=10, pady=4, fill='x')
-            #Aggiungo un tooltip al bubble che mostra il timestamp completo al passaggio del mouse.
-            ToolTip(bubble, f"Inviato alle {timestamp}")
-        else:
-            #Per messaggi di sistema, creo una label semplice, centrata, in corsivo.
-            sys_label = tk.Label(self.message_frame, text=msg, bg=bg_color, fg=fg_color, font=("Segoe UI", 10, "italic"), anchor="center", padx=10, pady=5)
-            sys_label.pack(anchor="center", fill='x', padx=10, pady=5)
+    #Testo della label degli indirizzi IP.
+    def address_text(self):
+        return f"📡 IP locale: {self.local_ip} | IP pubblico: {self.public_ip}"
+
+    #Stampa (in JSON) gli istanti in cui il nodo è in ascolto e la finestra è visibile, poi chiude l'app.
+    def report_startup(self):
+        self.root.update_idletasks()
+        print(json.dumps({"listening": self.listening_at, "window": time.time()}), flush=True)
+        self.close_app()
 
-        #Aggiorna la GUI per mostrare subito i messaggi e scrolla automaticamente in fondo.
-        self.message_frame.update_idletasks()
-        self.message_frame._parent_canvas.yview_moveto(1.0)
-    
     #Cambia il tema dell'interfaccia (chiaro/scuro).
     def toggle_theme(self):
         #Cambia il tema da light a dark o viceversa.
         self.theme = "dark" if self.theme == "light" else "light"
         #Aggiorna il tema di customtkinter di conseguenza.
         ctk.set_appearance_mode(self.theme)
+        #Ridisegno i messaggi visibili (di tutte le stanze aperte) con i colori del nuovo tema.
+        for view in self.views.values():
+            view.set_theme(self.theme)
 
     #Incolla negli input il contenuto copiato negli appunti di sistema.
     def manual_paste(self):
@@ -339,7 +3288,7 @@ class PeerToPeerChat:
             data = self.root.clipboard_get().strip()
             self.connect_entry.delete(0, tk.END) #Cancella contenuto precedente.
             self.connect_entry.insert(0, data) #Inserisce nuovo testo.
-        except:
+        except tk.TclError:
             #Ignora errori se non riesce (ad esempio appunti vuoti o non testo).
             pass
     
@@ -355,41 +3304,16 @@ class PeerToPeerChat:
         #Dopo 200 millisecondi resetta il flag per permettere nuove copie.
         self.root.after(200, lambda: setattr(self, 'copy_in_progress', False))
     
-    # Accetta nuove connessioni in entrata e avvia un thread per ognuna
-    def accept_connections(self):
-        #Loop infinito per accettare connessioni in ingresso.
-        while True:
-            conn, addr = self.listener.accept() #Accetto una nuova connessione, ottengo socket e indirizzo peer.
-            self.peers[conn] = addr #Salvo la connessione nel dizionario peers.
-            #Invio al peer connesso il mio utente e porta con un messaggio speciale.
-            conn.send(f"__username__:{self.username}@{self.port}".encode())
-            #Creo un thread separato per ricevere messaggi da questo peer senza bloccare il main thread.
-            threading.Thread(target=self.receive_messages, args=(conn,), daemon=True).start()
-
     #Recupera IP e porta dalla GUI e tenta la connessione a un peer remoto.
     def connect_to_peer_ui(self):
         try:
             ip_port = self.connect_entry.get().strip() #Prendo l'indirizzo IP e la porta inserito nella UI.
             ip, port = ip_port.split(":")  #Splitto in IP e porta.
-            self.connect_to_peer(ip, int(port)) #Provo a connettermi al peer.
-        except Exception as e:
+            self.node.connect(ip, int(port)) #Provo a connettermi al peer (l'esito arriva come evento).
+        except ValueError as e:
             #Se errore, mostro una finestra di errore con il messaggio di errore.
             messagebox.showerror("Errore", f"Formato non valido o connessione fallita: {e}")
 
-    #Stabilisce una connessione socket a un peer e inizia la ricezione dei messaggi.
-    def connect_to_peer(self, ip, port):
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM) #Creo un nuovo socket TCP IPv4.
-        s.connect((ip, port)) #Provo a connettermi al peer specificato.
-        self.peers[s] = (ip, port) #Salvo la connessione nel dizionario peers.
-        #Invio il mio utente e porta al peer appena connesso.
-        s.send(f"__username__:{self.username}@{self.port}".encode())
-        #Avvio un thread per ricevere messaggi da questo peer.
-        threading.Thread(target=self.receive_messages, args=(s,), daemon=True).start()
-        #Mostro un messaggio di sistema nella chat che indica la connessione riuscita.
-        self.display_message(f"Connesso a {ip}:{port}", tag="system")
-        #Aggiorno la lista dei peer visibile nella GUI.
-        self.update_peer_list()
-
     #Evento legato al tasto Invio: invia messaggio se non è Shift+Invio.
     def send_message_event(self, event):
         #Controlla se il tasto Shift è premuto; se sì non invia il messaggio (per permettere invio a capo).
@@ -400,71 +3324,339 @@ class PeerToPeerChat:
 
      #Invia il messaggio scritto a tutti i peer connessi e lo visualizza localmente.
     def send_message(self):
+        started = time.perf_counter()
         content = self.entry.get("1.0", ctk.END).strip() #Prende il testo scritto dall'utente.
         if not content:
             return #Se il contenuto è vuoto, non viene inviato nulla.
         timestamp = datetime.now().strftime("%H:%M") #Ottiene l'orario corrente per il timestamp.
-        full_msg = f"{self.username}: {content}"  #Prepara il messaggio completo da inviare.
+        msg_id = os.urandom(16)
+        full_msg = self.node.send(content, self.room, msg_id) #Il nodo invia il messaggio ai peer iscritti alla stanza visibile.
+        if full_msg is None:
+            return #Messaggio rifiutato (troppo grande): il testo resta nella textbox e l'errore arriva come evento.
+        if self.node.store is not None:
+            #Accanto all'orario compare lo stato della consegna, aggiornato dagli eventi "delivery".
+            view = self.message_view
+            self.awaiting[msg_id] = (self.room, view, len(view.history) - view.first, timestamp)
+            if len(self.awaiting) > self.AWAITING_LIMIT:
+                self.awaiting.popitem(last=False)
+            timestamp = f"{timestamp} {self.DELIVERY_MARKS['pending']}"
         self.display_message(full_msg, tag="own", timestamp=timestamp) #Mostra il messaggio nella chat locale.
-        #Invio il messaggio a tutti i peer connessi.
-        for peer in list(self.peers.keys()):
-            try:
-                peer.send(full_msg.encode())
-            except:
-                continue #Se fallisce l'invio a qualche peer, continua senza interrompere.
         self.entry.delete("1.0", ctk.END) #Pulisce la textbox dopo l'invio.
+        self.node.metrics.observe("ui.send", time.perf_counter() - started)
 
-    #Riceve messaggi da un singolo peer, gestisce nomi e disconnessioni.
-    def receive_messages(self, conn):
-        #Loop infinito per ricevere messaggi da un singolo peer.
-        while True:
+    #Carica dallo storico la pagina di messaggi della stanza precedente a quelli già mostrati e la inserisce in testa alla vista.
+    def load_older(self, room):
+        if self.oldest_ids.get(room, 0) <= 1 or room not in self.views:
+            return #Nessun messaggio più vecchio (o stanza chiusa).
+        rows = self.node.history.page(before=self.oldest_ids[room], room=room)
+        self.oldest_ids[room] = rows[0][0] if rows else 0
+        if rows:
+            self.views[room].prepend([history_message(row) for row in rows])
+
+    #Chiede un testo da cercare nello storico e mostra i risultati, dal più recente, in una finestra separata.
+    def search_history(self):
+        query = simpledialog.askstring("Cerca", "Testo da cercare nello storico:")
+        if not query:
+            return
+        rows = self.node.history.search(query, limit=200)
+        window = ctk.CTkToplevel(self.root)
+        window.title(f"Risultati per '{query}' ({len(rows)})")
+        window.geometry("600x400")
+        results = tk.Listbox(window, font=("Segoe UI", 11), activestyle="none")
+        results.pack(fill="both", expand=True, padx=10, pady=10)
+        for row in rows:
+            sender, body, tag, timestamp = history_message(row)
+            results.insert(tk.END, f"[{timestamp}] {sender}: {body}")
+        if not rows:
+            results.insert(tk.END, "Nessun messaggio trovato.")
+
+    #Chiede il file da inviare e lo spedisce al peer selezionato nella lista, o a tutti i peer se nessuno è selezionato.
+    def send_file_ui(self):
+        path = filedialog.askopenfilename(title="Scegli il file da inviare")
+        if not path:
+            return #Selezione annullata.
+        selection = self.peer_listbox.curselection()
+        peer = self.peer_names[selection[0]] if selection and selection[0] < len(self.peer_names) else None
+        self.node.send_file(path, peer)
+
+    #Doppio clic sulla lista dei peer: se la riga è un peer scoperto in rete locale, mi collego.
+    def connect_to_lan_peer(self, event):
+        selection = self.peer_listbox.curselection()
+        if selection and selection[0] >= len(self.peer_names):
+            self.node.connect(*self.lan_rows[selection[0] - len(self.peer_names)])
+
+    #Elabora gli eventi di rete in coda nel thread della GUI e si ripianifica.
+    #Gli eventi vengono raccolti per al massimo FRAME_BUDGET secondi e applicati in blocco:
+    #i messaggi entrano nella vista in un solo passaggio (un ridisegno e uno scroll per ciclo),
+    #la lista dei peer viene ricostruita al massimo una volta con l'ultimo stato ricevuto.
+    def process_events(self):
+        started = time.perf_counter()
+        deadline = started + self.FRAME_BUDGET
+        messages = [] #Messaggi da aggiungere alla vista in questo ciclo.
+        peers = None #Ultima lista dei peer ricevuta (le precedenti sono superate).
+        errors = [] #Errori da mostrare dopo aver aggiornato la vista.
+        transfer = None #Ultimo avanzamento di un file in arrivo (i precedenti sono superati).
+        offers = [] #File proposti dai peer, per cui chiedere conferma dopo aver aggiornato la vista.
+        addresses = False #Se è cambiato almeno un indirizzo IP del nodo.
+        discovered = None #Ultima lista dei peer scoperti in rete locale.
+        unread = False #Se sono arrivati messaggi in stanze non visibili.
+        ring = False #Se è arrivato almeno un messaggio da un peer (anche in altre stanze).
+        while time.perf_counter() < deadline:
             try:
-                data = conn.recv(1024) #Riceve dati dal peer (massimo 1024 byte).
-                if not data:
-                    break #Se la connessione si chiude (dati vuoti), esce dal loop.
-                message = data.decode() #Decodifica il messaggio ricevuto.
-                if message.startswith("__username__:"):
-                    #Se il messaggio è un identificativo utente speciale, aggiorna il dizionario usernames.
-                    name_info = message.split(":", 1)[1]
-                    self.usernames[conn] = name_info
-                    self.update_peer_list() #Aggiorna la lista dei peer visibile nella GUI.
+                event = self.node.events.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] == "message":
+                #I messaggi di chat delle stanze non visibili restano in attesa (senza rendering) finché la stanza non viene aperta.
+                room = event[4] if len(event) > 4 else None
+                if room is None or room == self.room:
+                    messages.append(split_message(*event[1:4]))
                 else:
-                    #Messaggi normali vengono mostrato nella chat con timestamp e suono di notifica.
-                    timestamp = datetime.now().strftime("%H:%M")
-                    self.display_message(message, tag="peer", timestamp=timestamp)
-                    notify() #Suono di notifica.
-            except:
-                break #In caso di errore, esce dal loop.
-        #Quando il peer si disconnette, mostra messaggio informativo nella chat.
-        name = self.usernames.get(conn, "sconosciuto")
-        self.display_message(f"[INFO] Il peer '{name}' si è disconnesso.", tag="system")
-        conn.close() #Chiude la connessione socket.
-        #Rimuove la connessione dai dizionari peers ed usernames.
-        if conn in self.peers:
-            del self.peers[conn]
-        if conn in self.usernames:
-            del self.usernames[conn]
-        self.update_peer_list() #Aggiorna la lista dei peer connessi.
-
-    #Aggiorna visivamente la lista dei peer connessi nella listbox.
-    def update_peer_list(self):
+                    if room not in self.rooms:
+                        self.rooms.append(room) #Stanza nuova (nodo iscritto a tutte le stanze).
+                    self.pending.setdefault(room, deque(maxlen=self.ROOM_BACKLOG)).append(split_message(*event[1:4]))
+                    unread = True
+                    if event[2] == "peer":
+                        ring = True
+            elif event[0] == "peers":
+                peers = event[1]
+            elif event[0] == "error":
+                errors.append(event[1])
+            elif event[0] == "transfer":
+                transfer = event[1:]
+            elif event[0] == "file_offer":
+                offers.append(event[1:])
+            elif event[0] == "address":
+                if event[1] == "local":
+                    self.local_ip = event[2]
+                else:
+                    self.public_ip = event[2] or "N/D"
+                addresses = True
+            elif event[0] == "discovered":
+                discovered = event[1]
+            elif event[0] == "delivery":
+                #Aggiorno lo stato dei messaggi propri (nelle stanze ancora aperte).
+                for msg_id in event[2]:
+                    entry = self.awaiting.pop(msg_id, None)
+                    if entry is not None and self.views.get(entry[0]) is entry[1]:
+                        entry[1].update_timestamp(entry[2], f"{entry[3]} {self.DELIVERY_MARKS[event[1]]}")
+        if messages:
+            self.message_view.extend(messages)
+            ring = ring or any(message[2] == "peer" for message in messages)
+        if ring:
+            notify() #Un solo suono di notifica per gruppo di messaggi ricevuti.
+        if unread:
+            self.update_room_tabs()
+        if discovered is not None:
+            self.lan_peers = discovered
+        if peers is not None or discovered is not None:
+            self.update_peer_list(self.peer_names if peers is None else peers)
+        if addresses:
+            self.ip_label.configure(text=self.address_text())
+        if transfer is not None:
+            #L'avanzamento del file in arrivo viene mostrato sul bottone dei file.
+            name, received, size = transfer
+            if received < size:
+                self.file_button.configure(text=f"📁 {name}: {received * 100 // size}%")
+            else:
+                self.file_button.configure(text="📁 Invia file")
+        if messages or peers is not None:
+            #Tempo speso ad applicare gli eventi del ciclo (solo per i cicli con aggiornamenti della vista).
+            self.node.metrics.observe("ui.events", time.perf_counter() - started)
+        for error in errors:
+            messagebox.showerror("Errore", error)
+        for peer, transfer_id, name, size in offers:
+            accept = messagebox.askyesno("File in arrivo", f"{peer} vuole inviarti '{name}' ({size} byte). Vuoi riceverlo?")
+            self.node.answer_file(transfer_id, accept)
+        self.root.after(self.FRAME_INTERVAL, self.process_events)
+
+    #Aggiorna visivamente la lista dei peer connessi nella listbox, seguiti da quelli scoperti in rete locale.
+    def update_peer_list(self, names):
         self.peer_listbox.delete(0, tk.END) #Pulisce la listbox dei peer connessi.
-        #Per ogni peer connesso inserisce il nome utente o l'indirizzo IP:PORTA nella listbox. 
-        for conn, addr in self.peers.items():
-            name = self.usernames.get(conn, f"{addr[0]}:{addr[1]}")
+        self.peer_names = list(names)
+        #Per ogni peer connesso inserisce il nome utente o l'indirizzo IP:PORTA nella listbox.
+        for name in names:
             self.peer_listbox.insert(tk.END, name)
+        #I peer scoperti (non già connessi) compaiono in grigio con l'icona 📡.
+        connected = set(names)
+        self.lan_rows = []
+        for username, host, port in self.lan_peers:
+            if f"{username}@{port}" not in connected:
+                self.peer_listbox.insert(tk.END, f"📡 {username} ({host}:{port})")
+                self.peer_listbox.itemconfig(tk.END, fg="gray")
+                self.lan_rows.append((host, port))
 
     # Chiude correttamente socket, connessioni e finestra principale all’uscita
     def close_app(self):
-        #Chiude tutte le connessioni socket verso i peer.
-        for peer in self.peers:
-            try:
-                peer.close()
-            except:
-                pass
-        self.listener.close() #Chiude il socket in ascolto.
+        self.node.stop() #Chiude listener e connessioni del nodo.
         self.root.destroy() #Distrugge/Chiude la finestra GUI.
 
+#Avvia il nodo senza GUI: stampa gli eventi sulla console e invia come messaggio ogni riga letta da stdin.
+def run_headless(args):
+    #Gli eventi vengono stampati direttamente dal thread del loop, senza passare dalla coda.
+    def print_event(event):
+        if event[0] == "message":
+            msg, tag, timestamp = event[1:4]
+            #I messaggi delle stanze diverse da quella predefinita sono preceduti da "#stanza".
+            if len(event) > 4 and event[4] != DEFAULT_ROOM:
+                msg = f"#{event[4]} {msg}"
+            print(f"[{timestamp}] {msg}" if timestamp else msg, flush=True)
+        elif event[0] == "peers":
+            print(f"👥 Peer connessi: {', '.join(event[1]) or '-'}", flush=True)
+        elif event[0] == "error":
+            print(f"[ERRORE] {event[1]}", file=sys.stderr, flush=True)
+        elif event[0] == "address" and event[2]:
+            print(f"📡 IP {'locale' if event[1] == 'local' else 'pubblico'}: {event[2]}", flush=True)
+        elif event[0] == "discovered":
+            names = ", ".join(f"{username} ({host}:{port})" for username, host, port in event[1][:10]) or "-"
+            more = f" e altri {len(event[1]) - 10}" if len(event[1]) > 10 else ""
+            print(f"📡 Peer in rete locale: {names}{more}", flush=True)
+        elif event[0] == "delivery" and event[1] == "evicted":
+            print(f"[INFO] {len(event[2])} messaggi non consegnati a qualche peer: la sua coda era piena.", flush=True)
+        elif event[0] == "file_offer":
+            peer, transfer_id, name, size = event[1:]
+            print(f"📁 {peer} vuole inviarti '{name}' ({size} byte): /accetta {transfer_id} oppure /rifiuta {transfer_id}", flush=True)
+
+    node = ChatNode(args.username or "bot", args.host, args.port, on_event=print_event,
+                    gossip=args.gossip, ttl=args.ttl, fanout=args.fanout,
+                    queue_limit=args.queue_limit, backpressure=args.backpressure,
+                    download_dir=args.download_dir, history=None if args.no_history else args.history,
+                    stats_port=args.stats_port, stats_file=args.stats_file, stats_interval=args.stats_interval,
+                    profile=args.profile, address_book=None if args.no_address_book else args.address_book,
+                    autoconnect=args.autoconnect, compression=args.compression,
+                    encrypt=args.encrypt, identity=args.identity,
+                    discovery=args.discovery or args.discovery_connect > 0, discovery_port=args.discovery_port,
+                    discovery_connect=args.discovery_connect, rooms=args.room or (DEFAULT_ROOM,),
+                    delivery=None if args.no_delivery else args.delivery,
+                    accept_files=args.accept_files, max_file_size=args.max_file_size * 1024 * 1024).start()
+    if args.startup_probe:
+        #Stampa l'istante in cui il nodo è in ascolto ed esce (usato da benchmark.py).
+        print(json.dumps({"listening": time.time()}), flush=True)
+        node.stop()
+        return
+    print(f"Nodo '{node.username}' in ascolto sulla porta {node.port}", flush=True)
+    if node.stats_port is not None:
+        print(f"📊 Statistiche su http://127.0.0.1:{node.stats_port}/", flush=True)
+    node.discover_addresses(args.ip_service, ttl=args.ip_cache_ttl)
+    #Connessioni iniziali indicate da riga di comando nel formato IP:PORTA.
+    for address in args.connect:
+        ip, port = address.rsplit(":", 1)
+        node.connect(ip, int(port))
+    #Stanza in cui vengono inviate le righe lette: la prima indicata da riga di comando, poi l'ultima in cui si è entrati.
+    room = next((name for name in node.room_list() if name != ALL_ROOMS), DEFAULT_ROOM)
+    try:
+        #Ogni riga letta da stdin viene inviata ai peer; a fine input (ad esempio stdin chiuso) il nodo resta attivo come relay.
+        #La riga "/file percorso" invia invece un file a tutti i peer connessi, "/cerca testo" cerca nello storico,
+        #"/entra stanza" entra in una stanza (e ci invia le righe successive), "/esci stanza" ne esce,
+        #"/accetta ID" e "/rifiuta ID" rispondono a un file proposto da un peer.
+        for line in sys.stdin:
+            line = line.strip()
+            if line.startswith("/entra "):
+                room = line[7:].strip()
+                node.join(room)
+            elif line.startswith("/esci "):
+                node.leave(line[6:].strip())
+            elif line.startswith("/file "):
+                node.send_file(line[6:].strip())
+            elif line.startswith("/accetta ") or line.startswith("/rifiuta "):
+                node.answer_file(line[9:].strip(), line.startswith("/accetta "))
+            elif line == "/stats":
+                #La riga "/stats" stampa le statistiche del nodo in JSON.
+                print(json.dumps(node.stats(), indent=2), flush=True)
+            elif line.startswith("/cerca "):
+                #La riga "/cerca testo" stampa i messaggi dello storico che contengono il testo (mai inviata ai peer).
+                if node.history is None:
+                    print("[INFO] Storico disabilitato (--no-history): nessun messaggio in cui cercare.", flush=True)
+                    continue
+                for row in node.history.search(line[7:]):
+                    sender, body, tag, timestamp = history_message(row)
+                    print(f"🔍 [{timestamp}] {sender}: {body}", flush=True)
+            elif line:
+                node.send(line, room)
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    node.stop()
+
+#Legge le opzioni da riga di comando.
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Chat P2P con interfaccia grafica o in modalità headless.")
+    parser.add_argument("--headless", action="store_true", help="avvia il nodo senza GUI (relay o bot su server)")
+    parser.add_argument("--username", help="nome utente (in modalità GUI evita la finestra di dialogo)")
+    parser.add_argument("--host", default="0.0.0.0", help="indirizzo su cui mettersi in ascolto")
+    parser.add_argument("--port", type=int, default=0, help="porta su cui mettersi in ascolto (0 = automatica)")
+    parser.add_argument("--connect", action="append", default=[], metavar="IP:PORTA", help="peer a cui connettersi all'avvio (ripetibile)")
+    parser.add_argument("--gossip", action="store_true", help="inoltra i messaggi ricevuti agli altri peer (rete mesh multi-hop)")
+    parser.add_argument("--ttl", type=int, default=DEFAULT_TTL, help="numero massimo di hop dei messaggi in modalità gossip")
+    parser.add_argument("--fanout", type=int, default=None, help="numero massimo di peer a cui inoltrare ogni messaggio (default: tutti)")
+    parser.add_argument("--queue-limit", type=int, default=1024, help="numero massimo di frame nella coda in uscita di ogni peer")
+    parser.add_argument("--backpressure", choices=BACKPRESSURE_POLICIES, default="drop_oldest",
+                        help="cosa fare quando la coda di un peer è piena")
+    parser.add_argument("--download-dir", default=None, help="cartella in cui salvare i file ricevuti (default: ~/Downloads/P2PChat)")
+    parser.add_argument("--accept-files", choices=FILE_POLICIES, default="ask",
+                        help="file proposti dai peer: ask = chiedi ogni volta (headless: /accetta o /rifiuta), all = accetta tutti, none = rifiuta tutti")
+    parser.add_argument("--max-file-size", type=int, default=MAX_FILE_SIZE // (1024 * 1024), metavar="MB",
+                        help="dimensione massima dei file accettati, in MB")
+    parser.add_argument("--history", default=os.path.join(os.path.expanduser("~"), ".p2pchat", "history.db"),
+                        help="file SQLite dello storico persistente dei messaggi")
+    parser.add_argument("--no-history", action="store_true", help="non salvare i messaggi su disco")
+    parser.add_argument("--delivery", default=DELIVERY_FILE,
+                        help="file SQLite della coda dei messaggi da consegnare ai peer (anche offline), con conferma di ricezione")
+    parser.add_argument("--no-delivery", action="store_true", help="invia i messaggi solo ai peer connessi, senza conferme")
+    parser.add_argument("--ip-service", default=IP_SERVICE, metavar="URL",
+                        help="servizio che restituisce l'IP pubblico in chiaro (stringa vuota = nessuna richiesta esterna)")
+    parser.add_argument("--ip-cache-ttl", type=int, default=ADDRESS_TTL, help="secondi di validità dell'IP pubblico salvato in cache")
+    parser.add_argument("--address-book", default=os.path.join(os.path.expanduser("~"), ".p2pchat", "peers.json"),
+                        help="file JSON della rubrica dei peer conosciuti")
+    parser.add_argument("--no-address-book", action="store_true", help="non salvare la rubrica dei peer su disco")
+    parser.add_argument("--forget-peer", action="append", default=[], metavar="IP:PORTA",
+                        help="rimuovi un peer dalla rubrica, con la sua chiave (per accettarne una nuova; ripetibile)")
+    parser.add_argument("--autoconnect", action="store_true", help="all'avvio ricollegati ai peer della rubrica contattati nell'ultima settimana")
+    parser.add_argument("--compression", type=lambda value: tuple(name for name in value.split(",") if name and name != "none"),
+                        default=DEFAULT_CODECS, metavar="CODEC,...",
+                        help=f"codec di compressione in ordine di preferenza ({', '.join(CODECS)}; none = nessuno)")
+    parser.add_argument("--encrypt", action="store_true", help="cifra tutte le connessioni (richiede il pacchetto cryptography)")
+    parser.add_argument("--identity", default=IDENTITY_FILE, help="file della chiave del nodo per le connessioni cifrate")
+    parser.add_argument("--room", action="append", default=None, metavar="STANZA",
+                        help=f"stanza in cui entrare all'avvio (ripetibile, default: {DEFAULT_ROOM}; {ALL_ROOMS} = tutte, per i relay)")
+    parser.add_argument("--discovery", action="store_true", help="annuncia il nodo e scopri gli altri peer in rete locale (UDP multicast)")
+    parser.add_argument("--discovery-connect", type=int, default=0, metavar="N",
+                        help="collegati da solo ai peer scoperti in rete locale fino ad averne N (attiva --discovery)")
+    parser.add_argument("--discovery-port", type=int, default=DISCOVERY_PORT, help="porta UDP dei beacon di scoperta")
+    parser.add_argument("--stats-port", type=int, default=None, help="porta dell'endpoint HTTP delle statistiche su 127.0.0.1 (0 = automatica)")
+    parser.add_argument("--stats-file", default=None, help="file in cui salvare periodicamente le statistiche in JSON")
+    parser.add_argument("--stats-interval", type=float, default=10, help="secondi tra un salvataggio delle statistiche e il successivo")
+    parser.add_argument("--profile", action="store_true", help="avvia subito il profiler a campionamento (risultati nelle statistiche)")
+    parser.add_argument("--startup-probe", action="store_true", help="stampa i tempi di avvio in JSON ed esce (usato da benchmark.py)")
+    return parser.parse_args(argv)
+
+#Punto di ingresso: sceglie tra modalità headless e GUI.
+def main(argv=None):
+    args = parse_args(argv)
+    if args.forget_peer and not args.no_address_book:
+        #Rimozione esplicita di peer dalla rubrica, prima di avviare il nodo: l'unico modo di accettarne una nuova chiave.
+        book = AddressBook(args.address_book)
+        for address in args.forget_peer:
+            if not book.forget(address):
+                print(f"[INFO] {address} non è nella rubrica.", file=sys.stderr)
+        book.save(book.peers)
+    if args.headless:
+        run_headless(args)
+    else:
+        PeerToPeerChat(args.host, args.port, args.username, args.connect,
+                       ip_service=args.ip_service, ip_cache_ttl=args.ip_cache_ttl, startup_probe=args.startup_probe,
+                       gossip=args.gossip, ttl=args.ttl, fanout=args.fanout,
+                       queue_limit=args.queue_limit, backpressure=args.backpressure,
+                       download_dir=args.download_dir, history=None if args.no_history else args.history,
+                       stats_port=args.stats_port, stats_file=args.stats_file, stats_interval=args.stats_interval,
+                       profile=args.profile, address_book=None if args.no_address_book else args.address_book,
+                       autoconnect=args.autoconnect, compression=args.compression,
+                       encrypt=args.encrypt, identity=args.identity,
+                       discovery=args.discovery or args.discovery_connect > 0, discovery_port=args.discovery_port,
+                       discovery_connect=args.discovery_connect, rooms=args.room or (DEFAULT_ROOM,),
+                       delivery=None if args.no_delivery else args.delivery,
+                       accept_files=args.accept_files, max_file_size=args.max_file_size * 1024 * 1024)
+
 #Se questo file è eseguito come script principale, avvia l'applicazione.
 if __name__ == "__main__":
-    PeerToPeerChat()
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,151 @@
+#Test della consegna affidabile: coda persistente (DeliveryStore) e ritrasmissione tra due nodi.
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+import p2pchat
+from p2pchat import ChatNode, DeliveryStore, room_id
+
+B, C = b"B" * 8, b"C" * 8
+
+class DeliveryStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "outbox.db")
+        self.store = DeliveryStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def test_message_is_delivered_when_every_recipient_acks(self):
+        self.store.remember(B, "b", {room_id("r1")})
+        self.store.remember(C, "c", {room_id("r1")})
+        seq, nodes, evicted = self.store.enqueue(b"m1", room_id("r1"), b"payload")
+        self.assertEqual((set(nodes), evicted), ({B, C}, []))
+        self.assertEqual(self.store.ack(B, seq), ([], []))
+        self.assertEqual(self.store.ack(C, seq), ([b"m1"], []))
+        self.assertEqual(self.store.ack(C, seq), ([], [])) #ACK ripetuto.
+
+    #Un destinatario offline in un'altra stanza non trattiene la conferma dei messaggi successivi.
+    def test_offline_recipient_does_not_block_later_messages(self):
+        self.store.remember(B, "b", {room_id("r1")})
+        self.store.remember(C, "c", {room_id("r2")})
+        self.store.enqueue(b"for-c", room_id("r2"), b"x")
+        seq, nodes, _ = self.store.enqueue(b"for-b", room_id("r1"), b"y")
+        self.assertEqual(set(nodes), {B})
+        self.assertEqual(self.store.ack(B, seq), ([b"for-b"], []))
+        self.assertEqual(self.store.fetch(C, 0, 10), [(1, b"x")])
+
+    def test_fetch_returns_pending_messages_in_order(self):
+        self.store.remember(B, "b", {None})
+        seqs = [self.store.enqueue(bytes([i]) * 16, room_id("r1"), b"%d" % i)[0] for i in range(5)]
+        self.assertEqual(self.store.fetch(B, seqs[1], 2), [(seqs[2], b"2"), (seqs[3], b"3")])
+        self.store.ack(B, seqs[2])
+        self.assertEqual([seq for seq, _ in self.store.fetch(B, 0, 10)], seqs[3:])
+
+    def test_full_queue_evicts_the_oldest_message(self):
+        self.store.remember(B, "b", {None})
+        self.store.remember(C, "c", {room_id("r1")})
+        with mock.patch.object(p2pchat, "MAX_PENDING", 3):
+            first, _, _ = self.store.enqueue(b"shared", room_id("r1"), b"s")
+            self.store.enqueue(b"only-b", room_id("r2"), b"b")
+            self.store.enqueue(b"r1", room_id("r1"), b"r")
+            #Per B la coda è piena: "shared" è scartato per lui, ma attende ancora C.
+            _, _, evicted = self.store.enqueue(b"r1-bis", room_id("r1"), b"r")
+            self.assertEqual(evicted, [])
+            #"only-b" attendeva solo B: scartato, è subito completato.
+            _, _, evicted = self.store.enqueue(b"r2", room_id("r2"), b"r")
+            self.assertEqual(evicted, [b"only-b"])
+        self.assertEqual(self.store.stats()["evicted"], 2)
+        self.assertEqual(self.store.ack(C, first), ([], [b"shared"]))
+
+    def test_node_id_and_acks_survive_a_restart(self):
+        self.store.remember(B, "b", {None})
+        seq, _, _ = self.store.enqueue(b"m1", room_id("r1"), b"x")
+        self.store.set_received(B, 7)
+        node_id = self.store.node_id
+        self.store.close()
+        self.store = DeliveryStore(self.path)
+        self.assertEqual(self.store.node_id, node_id)
+        self.assertEqual(self.store.received(B), 7)
+        self.assertEqual(self.store.fetch(B, 0, 10), [(seq, b"x")])
+
+    def test_store_is_locked_by_one_instance(self):
+        with self.assertRaises(sqlite3.OperationalError):
+            DeliveryStore(self.path)
+
+#Attende (al massimo timeout secondi) che condition() diventi vera.
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+class RetransmissionTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        options = dict(history=None, address_book=None)
+        self.a = ChatNode("a", "127.0.0.1", delivery=os.path.join(self.directory.name, "a.db"), **options).start()
+        self.b = ChatNode("b", "127.0.0.1", delivery=os.path.join(self.directory.name, "b.db"), **options).start()
+        self.received = []
+        self.delivered = []
+
+    def tearDown(self):
+        self.a.stop()
+        self.b.stop()
+        self.directory.cleanup()
+
+    def collect(self):
+        while not self.b.events.empty():
+            event = self.b.events.get()
+            if event[0] == "message" and event[2] == "peer":
+                self.received.append(event[1])
+        while not self.a.events.empty():
+            event = self.a.events.get()
+            if event[0] == "delivery" and event[1] == "delivered":
+                self.delivered += event[2]
+
+    #Un messaggio perso (ad esempio scartato da una coda piena) viene segnalato con un ACK "gap" e reinviato:
+    #il destinatario riceve tutti i messaggi, in ordine e senza duplicati.
+    def test_lost_message_is_resent_in_order(self):
+        receive = self.b.receive_delivery
+        lost = []
+        async def lossy(conn, payload):
+            previous, seq = p2pchat.DELIVER_HEADER.unpack_from(payload)
+            if seq == 10 and not lost:
+                lost.append(seq)
+                return
+            await receive(conn, payload)
+        self.b.receive_delivery = lossy
+        self.b.connect("127.0.0.1", self.a.port).result()
+        self.assertTrue(wait_for(lambda: self.a.deliveries))
+        for i in range(50):
+            self.a.send(f"m{i}")
+        expected = [f"a: m{i}" for i in range(50)]
+        self.assertTrue(wait_for(lambda: self.collect() or len(self.delivered) == 50))
+        self.assertEqual(lost, [10])
+        self.assertEqual(self.received, expected)
+        self.assertEqual(self.b.stats()["counters"].get("delivery.gaps"), 1)
+
+    #I messaggi inviati mentre il destinatario è offline arrivano alla riconnessione.
+    def test_offline_recipient_gets_messages_on_reconnect(self):
+        self.b.connect("127.0.0.1", self.a.port).result()
+        self.assertTrue(wait_for(lambda: self.a.deliveries))
+        self.b.stop()
+        self.assertTrue(wait_for(lambda: not self.a.deliveries))
+        for i in range(20):
+            self.a.send(f"m{i}")
+        self.b = ChatNode("b", "127.0.0.1", delivery=os.path.join(self.directory.name, "b.db"),
+                          history=None, address_book=None).start()
+        self.b.connect("127.0.0.1", self.a.port).result()
+        self.assertTrue(wait_for(lambda: self.collect() or len(self.delivered) == 20))
+        self.assertEqual(self.received, [f"a: m{i}" for i in range(20)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#Test dei file in arrivo: consenso dell'utente, limite di dimensione e scadenza dei file parziali.
+import os
+import tempfile
+import time
+import unittest
+
+from p2pchat import ChatNode, expire_part_files
+
+#Attende (al massimo timeout secondi) che condition() sia vera.
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+class PartFilesTest(unittest.TestCase):
+    def test_only_stale_part_files_are_removed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            paths = {name: os.path.join(directory, name) for name in (".old.part", ".new.part", "old.txt")}
+            for path in paths.values():
+                with open(path, "wb") as file:
+                    file.write(b"x")
+            stale = time.time() - 30 * 24 * 3600
+            os.utime(paths[".old.part"], (stale, stale))
+            os.utime(paths["old.txt"], (stale, stale))
+            self.assertEqual(expire_part_files(directory), 1)
+            self.assertEqual(sorted(os.listdir(directory)), [".new.part", "old.txt"])
+        self.assertEqual(expire_part_files(os.path.join(directory, "assente")), 0)
+
+class FileOfferTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.directory.name, "documento.bin")
+        with open(self.source, "wb") as file:
+            file.write(os.urandom(300 * 1024))
+        self.downloads = os.path.join(self.directory.name, "downloads")
+        self.events = {"a": [], "b": []}
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        self.directory.cleanup()
+
+    def connect(self, **options):
+        options = dict(history=None, address_book=None, **options)
+        a = ChatNode("a", "127.0.0.1", on_event=self.events["a"].append, **options).start()
+        options.pop("max_file_size", None)
+        options.pop("accept_files", None)
+        b = ChatNode("b", "127.0.0.1", on_event=self.events["b"].append, **options).start()
+        self.nodes += [a, b]
+        b.connect("127.0.0.1", a.port).result()
+        self.assertTrue(wait_for(lambda: b.node_ids and a.node_ids))
+        return a, b
+
+    def messages(self, name):
+        return [event[1] for event in self.events[name] if event[0] == "message"]
+
+    def received(self):
+        return os.listdir(self.downloads) if os.path.isdir(self.downloads) else []
+
+    def test_offer_waits_for_the_user(self):
+        a, b = self.connect(download_dir=self.downloads)
+        b.send_file(self.source).result()
+        self.assertTrue(wait_for(lambda: any(event[0] == "file_offer" for event in self.events["a"])))
+        offer = next(event for event in self.events["a"] if event[0] == "file_offer")
+        self.assertEqual(offer[3:], ("documento.bin", 300 * 1024))
+        time.sleep(0.2)
+        self.assertEqual(self.received(), [])
+        a.answer_file(offer[2], True).result()
+        self.assertTrue(wait_for(lambda: "documento.bin" in self.received()))
+        self.assertTrue(wait_for(lambda: not b.outgoing))
+
+    def test_declined_offer_is_dropped_by_the_sender(self):
+        a, b = self.connect(download_dir=self.downloads)
+        b.send_file(self.source).result()
+        self.assertTrue(wait_for(lambda: any(event[0] == "file_offer" for event in self.events["a"])))
+        offer = next(event for event in self.events["a"] if event[0] == "file_offer")
+        a.answer_file(offer[2], False).result()
+        self.assertTrue(wait_for(lambda: any("rifiutato" in msg for msg in self.messages("b"))))
+        self.assertEqual(b.outgoing, {})
+        self.assertEqual(self.received(), [])
+
+    def test_policy_none_and_size_limit(self):
+        a, b = self.connect(download_dir=self.downloads, accept_files="all", max_file_size=100 * 1024)
+        b.send_file(self.source).result()
+        self.assertTrue(wait_for(lambda: any("rifiutato" in msg for msg in self.messages("b"))))
+        self.assertFalse(any(event[0] == "file_offer" for event in self.events["a"]))
+        self.assertEqual(self.received(), [])
+        a.accept_files = "none"
+        a.max_file_size = 1024 * 1024
+        b.send_file(self.source).result()
+        self.assertTrue(wait_for(lambda: sum("rifiutato" in msg for msg in self.messages("b")) == 2))
+        self.assertEqual(self.received(), [])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+#Test della verifica dell'identità dei peer (trust on first use) sulle connessioni cifrate.
+import os
+import tempfile
+import time
+import unittest
+
+from p2pchat import AddressBook, ChatNode
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
+
+#Attende (al massimo timeout secondi) che condition() diventi vera.
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+#Eventi accumulati da un nodo, svuotandone la coda.
+def drain(node):
+    events = []
+    while not node.events.empty():
+        events.append(node.events.get())
+    return events
+
+class AddressBookTest(unittest.TestCase):
+    def test_conflict_by_address_whatever_the_username(self):
+        book = AddressBook()
+        book.update("10.0.0.1", 5000, "bob", b"\x01" * 8, "aaaa")
+        self.assertIsNone(book.conflict("10.0.0.1", 5000, b"\x01" * 8, "aaaa"))
+        self.assertEqual(book.conflict("10.0.0.1", 5000, b"\x02" * 8, "bbbb")[0], "10.0.0.1:5000")
+
+    def test_conflict_by_node_id_at_another_address(self):
+        book = AddressBook()
+        book.update("10.0.0.1", 5000, "bob", b"\x01" * 8, "aaaa")
+        self.assertEqual(book.conflict("10.0.0.2", 6000, b"\x01" * 8, "bbbb")[0], "10.0.0.1:5000")
+        self.assertIsNone(book.conflict("10.0.0.2", 6000, b"\x02" * 8, "bbbb"))
+
+    def test_update_never_replaces_a_pinned_key(self):
+        book = AddressBook()
+        book.update("10.0.0.1", 5000, "bob", b"\x01" * 8, "aaaa")
+        book.update("10.0.0.1", 5000, "bob2", b"\x02" * 8, "bbbb")
+        self.assertEqual(book.peers["10.0.0.1:5000"]["identity"], "aaaa")
+        self.assertTrue(book.forget("10.0.0.1:5000"))
+        book.update("10.0.0.1", 5000, "bob2", b"\x02" * 8, "bbbb")
+        self.assertEqual(book.peers["10.0.0.1:5000"]["identity"], "bbbb")
+
+@unittest.skipIf(cryptography is None, "richiede il pacchetto cryptography")
+class PinningTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.nodes = []
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stop()
+        self.directory.cleanup()
+
+    def node(self, username, port=0, key=None, **options):
+        node = ChatNode(username, "127.0.0.1", port, encrypt=True, history=None,
+                        identity=key and os.path.join(self.directory.name, key), **options).start()
+        self.nodes.append(node)
+        return node
+
+    #Un impostore all'indirizzo di un peer già noto, con un'altra chiave, viene rifiutato anche con un altro nome utente.
+    def test_impostor_with_another_username_is_rejected(self):
+        book = os.path.join(self.directory.name, "peers.json")
+        alice = self.node("alice", address_book=book)
+        bob = self.node("bob", key="bob.key")
+        alice.connect("127.0.0.1", bob.port).result()
+        self.assertTrue(wait_for(lambda: f"127.0.0.1:{bob.port}" in alice.address_book.peers))
+        pinned = alice.address_book.peers[f"127.0.0.1:{bob.port}"]["identity"]
+        port = bob.port
+        bob.stop()
+        self.nodes.remove(bob)
+        self.assertTrue(wait_for(lambda: not alice.peers))
+        self.node("bob2", port=port, key="impostor.key")
+        alice.tickets.clear() #Senza ticket: handshake completo con la chiave dell'impostore.
+        drain(alice)
+        alice.connect("127.0.0.1", port).result()
+        self.assertTrue(wait_for(lambda: any(event[0] == "error" and "rifiutata" in event[1] for event in drain(alice))))
+        self.assertEqual(alice.address_book.peers[f"127.0.0.1:{port}"]["identity"], pinned)
+        self.assertEqual(alice.address_book.peers[f"127.0.0.1:{port}"]["username"], "bob")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+#Test della coda in uscita verso un peer (Outbox): politiche di backpressure, corsia dei frame di controllo
+#e limite alla dimensione dei frame (anche cifrati).
+import asyncio
+import unittest
+
+from p2pchat import (FRAME_ACK, FRAME_CHAT, FRAME_HEADER, FRAME_SEALED, FRAME_SUBSCRIBE, MAX_FRAME_SIZE, MAX_MESSAGE_SIZE,
+                     SEAL_OVERHEAD, ChatNode, Outbox, encode_control, encode_frame)
+
+#Connessione finta che registra i frame scritti.
+class FakeWriter:
+    def __init__(self):
+        self.written = []
+
+    def writelines(self, frames):
+        self.written.extend(bytes(frame) for frame in frames)
+
+    async def drain(self):
+        pass
+
+#Sessione finta: "cifra" aggiungendo un tag di SEAL_OVERHEAD byte.
+class FakeSession:
+    def seal(self, data):
+        return data + bytes(SEAL_OVERHEAD)
+
+def chat(n):
+    return encode_frame(FRAME_CHAT, b"%d" % n)
+
+class OutboxTest(unittest.TestCase):
+    def test_drop_oldest_evicts_only_chat_frames(self):
+        async def scenario():
+            outbox = Outbox(FakeWriter(), limit=2, policy="drop_oldest")
+            subscribe = encode_control(FRAME_SUBSCRIBE, join=["nuova"], leave=[])
+            self.assertTrue(await outbox.put(chat(0)))
+            self.assertTrue(await outbox.put(subscribe))
+            for n in range(1, 4):
+                self.assertTrue(await outbox.put(chat(n)))
+            self.assertTrue(await outbox.put(encode_control(FRAME_ACK, seq=1, gap=False)))
+            return outbox
+        outbox = asyncio.run(scenario())
+        self.assertEqual(list(outbox.frames), [chat(2), chat(3)])
+        self.assertEqual([frame[1] for frame in outbox.control], [FRAME_SUBSCRIBE, FRAME_ACK])
+        self.assertEqual(outbox.dropped, 2)
+
+    def test_control_frames_are_written_first(self):
+        async def scenario():
+            writer = FakeWriter()
+            outbox = Outbox(writer, limit=8)
+            task = asyncio.create_task(outbox.run())
+            await outbox.put(chat(0))
+            await outbox.put(encode_control(FRAME_ACK, seq=1, gap=False))
+            await asyncio.sleep(0.01)
+            outbox.close()
+            await task
+            return writer
+        writer = asyncio.run(scenario())
+        self.assertEqual([frame[1] for frame in writer.written], [FRAME_ACK, FRAME_CHAT])
+
+    def test_block_waits_for_space_but_not_for_control_frames(self):
+        async def scenario():
+            writer = FakeWriter()
+            outbox = Outbox(writer, limit=1, policy="block")
+            await outbox.put(chat(0))
+            blocked = asyncio.create_task(outbox.put(chat(1)))
+            await asyncio.sleep(0.01)
+            self.assertFalse(blocked.done())
+            self.assertTrue(await asyncio.wait_for(outbox.put(encode_control(FRAME_ACK, seq=1, gap=False)), 1))
+            task = asyncio.create_task(outbox.run())
+            self.assertTrue(await asyncio.wait_for(blocked, 1))
+            await asyncio.sleep(0.01)
+            outbox.close()
+            await task
+            return writer
+        writer = asyncio.run(scenario())
+        self.assertEqual(writer.written, [encode_control(FRAME_ACK, seq=1, gap=False), chat(0), chat(1)])
+
+class FrameSizeTest(unittest.TestCase):
+    def test_sealed_batch_is_split_under_the_limit(self):
+        outbox = Outbox(FakeWriter())
+        outbox.session = FakeSession()
+        big = encode_frame(FRAME_CHAT, bytes(MAX_FRAME_SIZE // 3))
+        too_big = encode_frame(FRAME_CHAT, bytes(MAX_FRAME_SIZE))
+        batch = [chat(0), big, big, too_big, big, chat(1)]
+        sealed = outbox.seal(batch)
+        self.assertEqual(len(sealed), 2)
+        inner = b""
+        for frame in sealed:
+            self.assertEqual(frame[1], FRAME_SEALED)
+            self.assertLessEqual(len(frame), FRAME_HEADER.size + MAX_FRAME_SIZE)
+            inner += frame[FRAME_HEADER.size:-SEAL_OVERHEAD]
+        self.assertEqual(inner, b"".join([chat(0), big, big, big, chat(1)]))
+        self.assertEqual(outbox.dropped, 1)
+
+    def test_oversized_message_is_rejected(self):
+        node = ChatNode("a", "127.0.0.1", history=None, address_book=None)
+        self.assertIsNone(node.send("x" * MAX_MESSAGE_SIZE))
+        event = node.events.get_nowait()
+        self.assertEqual(event[0], "error")
+        self.assertIn("troppo grande", event[1])
+        self.assertTrue(node.events.empty())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+#Test del protocollo di rete: estrazione dei frame (FrameBuffer), compressione (Compressor)
+#e handshake cifrato, completo e ripreso con un ticket (Handshake).
+import os
+import unittest
+
+from p2pchat import (CODECS, FRAME_CHAT, FRAME_HANDSHAKE, FRAME_HEADER, MAX_FRAME_SIZE, PROTOCOL_VERSION, Compressor,
+                     FrameBuffer, Handshake, Identity, ProtocolError, encode_frame)
+
+try:
+    import cryptography
+except ImportError:
+    cryptography = None
+
+class FrameBufferTest(unittest.TestCase):
+    def test_frames_split_across_reads(self):
+        frames = [encode_frame(FRAME_CHAT, b"uno"), encode_frame(FRAME_HANDSHAKE, b"{}"), encode_frame(FRAME_CHAT, os.urandom(100000))]
+        data = b"".join(frames)
+        buffer = FrameBuffer(size=1024)
+        received = []
+        for start in range(0, len(data), 7000):
+            buffer.feed(data[start:start + 7000])
+            received += list(buffer.frames())
+        self.assertEqual(received, [(frame[1], 0, frame[FRAME_HEADER.size:]) for frame in frames])
+        self.assertEqual((buffer.start, buffer.end), (0, 0))
+
+    def test_partial_header_waits_for_more_data(self):
+        buffer = FrameBuffer()
+        frame = encode_frame(FRAME_CHAT, b"ciao")
+        buffer.feed(frame[:5])
+        self.assertEqual(list(buffer.frames()), [])
+        buffer.feed(frame[5:])
+        self.assertEqual(list(buffer.frames()), [(FRAME_CHAT, 0, b"ciao")])
+
+    def test_invalid_frames_are_protocol_errors(self):
+        buffer = FrameBuffer()
+        buffer.feed(FRAME_HEADER.pack(PROTOCOL_VERSION + 1, FRAME_CHAT, 0, 0))
+        with self.assertRaises(ProtocolError):
+            list(buffer.frames())
+        buffer = FrameBuffer()
+        buffer.feed(FRAME_HEADER.pack(PROTOCOL_VERSION, FRAME_CHAT, 0, MAX_FRAME_SIZE + 1))
+        with self.assertRaises(ProtocolError):
+            list(buffer.frames())
+
+class CompressorTest(unittest.TestCase):
+    def test_compressed_frame_round_trip(self):
+        for codec in CODECS.values():
+            compressor = Compressor(codec)
+            frame = encode_frame(FRAME_CHAT, b"alice: ciao a tutti, come va? " * 100)
+            encoded = compressor.encode(frame)
+            version, ftype, flags, length = FRAME_HEADER.unpack_from(encoded)
+            self.assertEqual((ftype, flags, length), (FRAME_CHAT, codec.codec_id, len(encoded) - FRAME_HEADER.size))
+            self.assertLess(len(encoded), len(frame))
+            self.assertEqual(codec.decompress(encoded[FRAME_HEADER.size:], MAX_FRAME_SIZE), frame[FRAME_HEADER.size:])
+
+    def test_small_or_incompressible_payloads_are_sent_as_is(self):
+        compressor = Compressor(CODECS["zlib"])
+        small = encode_frame(FRAME_CHAT, b"ciao")
+        random = encode_frame(FRAME_CHAT, os.urandom(4096))
+        self.assertIs(compressor.encode(small), small)
+        self.assertIs(compressor.encode(random), random)
+        self.assertEqual((compressor.frames, compressor.skipped), (0, 2))
+
+    def test_decompression_is_bounded(self):
+        codec = CODECS["zlib"]
+        with self.assertRaises(ProtocolError):
+            codec.decompress(codec.compress(bytes(1024 * 1024)), 1024)
+
+@unittest.skipIf(cryptography is None, "richiede il pacchetto cryptography")
+class HandshakeTest(unittest.TestCase):
+    def setUp(self):
+        self.initiator = Identity()
+        self.responder = Identity()
+
+    #Esegue l'handshake tra i due lati; restituisce le sessioni (initiator, responder).
+    def handshake(self, ticket=None, responder_ticket=None):
+        initiator = Handshake(self.initiator, ticket)
+        message = initiator.initiate()
+        reply, responder_session = Handshake(self.responder).respond(message[FRAME_HEADER.size:], responder_ticket)
+        return initiator.complete(reply[FRAME_HEADER.size:]), responder_session
+
+    def assert_connected(self, first, second):
+        for sender, receiver in ((first, second), (second, first), (first, second)):
+            self.assertEqual(receiver.open(sender.seal(b"frame")), b"frame")
+
+    def test_full_handshake(self):
+        initiator, responder = self.handshake()
+        self.assert_connected(initiator, responder)
+        self.assertEqual((initiator.peer_public, responder.peer_public), (self.responder.public, self.initiator.public))
+        self.assertEqual(initiator.resumption, responder.resumption)
+        self.assertFalse(initiator.resumed or responder.resumed)
+
+    def test_ticket_resumption(self):
+        initiator, responder = self.handshake()
+        ticket = (os.urandom(16), initiator.resumption, initiator.peer_public)
+        initiator, responder = self.handshake(ticket, (responder.resumption, responder.peer_public))
+        self.assertTrue(initiator.resumed and responder.resumed)
+        self.assert_connected(initiator, responder)
+        self.assertEqual((initiator.peer_public, responder.peer_public), (self.responder.public, self.initiator.public))
+
+    def test_wrong_ticket_secret_cannot_decrypt(self):
+        initiator, responder = self.handshake()
+        ticket = (os.urandom(16), os.urandom(32), initiator.peer_public)
+        initiator, responder = self.handshake(ticket, (responder.resumption, responder.peer_public))
+        with self.assertRaises(ProtocolError):
+            responder.open(initiator.seal(b"frame"))
+
+    def test_tampered_frame_is_rejected(self):
+        initiator, responder = self.handshake()
+        sealed = bytearray(initiator.seal(b"frame"))
+        sealed[0] ^= 1
+        with self.assertRaises(ProtocolError):
+            responder.open(bytes(sealed))
+
+if __name__ == "__main__":
+    unittest.main()